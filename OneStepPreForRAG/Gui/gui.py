@@ -8,6 +8,9 @@ import subprocess
 import logging
 from pathlib import Path
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from env_resolver import env_command, env_environ
+
 class MainWindow(QMainWindow):
     def __init__(self):
         super().__init__()
@@ -154,16 +157,17 @@ class MainWindow(QMainWindow):
         self.log_area.clear()
 
         # 创建并启动处理进程
+        # 直接运行环境中的python，省去每次 conda run 的启动开销
         self.process = subprocess.Popen(
-            [
-                "conda", "run", "--no-capture-output", "-n", "pdf2md",
-                "python", "../main.py",
+            env_command(
+                "pdf2md", "python", "../main.py",
                 "--input_dir", input_dir,
                 "--output_dir", output_dir,
                 "--steps", " ".join(map(str, steps)),
                 "--uploader", uploader,
                 "--qps", str(qps)
-            ],
+            ),
+            env=env_environ("pdf2md"),
             stdout=subprocess.PIPE,
             stderr=subprocess.STDOUT,
             text=True
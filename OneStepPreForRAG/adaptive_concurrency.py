@@ -0,0 +1,132 @@
+"""
+上传并发数的自适应控制（AIMD）
+
+手动设置的QPS对PicGO/OSS往往不是太保守就是触发限流。这里像TCP拥塞控制一样调整同时进行的上传数：
+    - 加性增：每个成功且延迟正常的上传使并发上限增加 1/上限，即每一轮约增加1
+    - 乘性减：遇到限流（429/503）或超时，并发上限乘以DECREASE；
+      同一轮中已经发出的请求再次失败不会重复减小
+    - 延迟超过基准延迟的LATENCY_FACTOR倍时只保持不增加；基准延迟取近期的最小延迟并缓慢上浮
+
+所有方法都在上传引擎的事件循环中调用。
+"""
+import asyncio
+import time
+
+# 初始并发上限
+DEFAULT_INITIAL = 4
+
+# 遇到限流时并发上限的缩小比例
+DECREASE = 0.5
+
+# 延迟超过基准延迟的这么多倍时不再增加并发
+LATENCY_FACTOR = 3.0
+
+# 记录并发上限变化的最小时间间隔（秒）
+HISTORY_INTERVAL = 1.0
+
+OK, THROTTLED, ERROR = 'ok', 'throttled', 'error'
+
+
+class AdaptiveConcurrency:
+    def __init__(self, maximum, adaptive=True, initial=DEFAULT_INITIAL, minimum=1):
+        """
+        Args:
+            maximum: 并发上限的最大值
+            adaptive: False时并发上限固定为maximum，只统计结果
+            initial: 自适应时的初始并发上限
+            minimum: 并发上限的最小值
+        """
+        self.maximum = max(1, maximum)
+        self.minimum = max(1, min(minimum, self.maximum))
+        self.adaptive = adaptive
+        self.limit = float(min(max(initial, self.minimum), self.maximum) if adaptive else self.maximum)
+        self.in_flight = 0
+        # 每次减小并发上限后进入新的一轮
+        self.epoch = 0
+        self.base_latency = None
+        self.completed = 0
+        self.throttled = 0
+        self.errors = 0
+        self.started = time.monotonic()
+        self.history = []
+        self._last_sample = (self.started, 0)
+        self._record(force=True)
+        self._condition = None
+
+    def _cond(self):
+        # asyncio.Condition 需要在事件循环中创建
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    async def acquire(self):
+        """
+        等待一个上传位置
+
+        Returns:
+            int: 当前轮次，释放时传回
+        """
+        async with self._cond():
+            await self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+            return self.epoch
+
+    async def release(self, epoch, outcome, latency):
+        """
+        释放上传位置并根据结果调整并发上限
+
+        Args:
+            epoch: acquire 返回的轮次
+            outcome: OK、THROTTLED（429/503/超时）或 ERROR（其他失败，不调整）
+            latency: 本次请求的耗时（秒）
+        """
+        async with self._cond():
+            self.in_flight -= 1
+            if outcome == OK:
+                self.completed += 1
+                self._on_success(latency)
+            elif outcome == THROTTLED:
+                self.throttled += 1
+                if self.adaptive and epoch == self.epoch:
+                    self.limit = max(float(self.minimum), self.limit * DECREASE)
+                    self.epoch += 1
+                    self._record(force=True)
+            else:
+                self.errors += 1
+            self._condition.notify_all()
+
+    def _on_success(self, latency):
+        if self.base_latency is None or latency < self.base_latency:
+            self.base_latency = latency
+        else:
+            self.base_latency = self.base_latency * 0.99 + latency * 0.01
+        if self.adaptive and latency <= self.base_latency * LATENCY_FACTOR and self.limit < self.maximum:
+            self.limit = min(float(self.maximum), self.limit + 1 / self.limit)
+            self._record()
+
+    def _record(self, force=False):
+        """记录并发上限和这段时间的上传速率，两次记录至少间隔HISTORY_INTERVAL秒（减小时立即记录）"""
+        now = time.monotonic()
+        last_time, last_completed = self._last_sample
+        if not force and now - last_time < HISTORY_INTERVAL:
+            return
+        if self.history and int(self.limit) == self.history[-1]['concurrency'] and not force:
+            return
+        elapsed = now - last_time
+        self.history.append({
+            't': round(now - self.started, 2),
+            'concurrency': int(self.limit),
+            'uploads_per_second': round((self.completed - last_completed) / elapsed, 1) if elapsed > 0 else 0.0
+        })
+        self._last_sample = (now, self.completed)
+
+    def stats(self):
+        """并发控制的统计，用于运行总结"""
+        self._record(force=True)
+        return {
+            'upload_concurrency': int(self.limit),
+            'upload_concurrency_history': self.history,
+            'upload_completed': self.completed,
+            'upload_throttled': self.throttled,
+            'upload_errors': self.errors
+        }
@@ -0,0 +1,434 @@
+"""
+基于asyncio的图片上传引擎
+
+pdfdeal的PicGO/OSS上传函数每次调用都新建一个HTTP连接，只能靠线程并发。这里：
+    - 所有上传共享一个 httpx.AsyncClient，连接池中的keep-alive连接被重复使用
+    - 同时进行的上传数由concurrency限制，不需要为每个上传占用一个线程
+    - 读取本地图片在线程中进行，与正在进行的上传重叠（最多预读concurrency个文件）
+    - 429/5xx、超时和连接错误按带随机抖动的指数退避重试；adaptive=True时由
+      AdaptiveConcurrency 根据限流和延迟自动调整并发数（AIMD）
+    - 事件循环运行在后台线程中，多个线程（如同时处理的多个文档）可以共享同一个引擎
+
+通过 UploaderFactory.create_uploader(..., engine='async') 创建。引擎对象本身可以像
+pdfdeal的上传函数一样调用，process_document_images 会优先使用 upload_files 一次提交一个文档的所有图片。
+
+`python async_upload.py --benchmark` 启动本地的模拟PicGO服务，比较线程上传和异步引擎的吞吐量。
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import mimetypes
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import quote
+
+import httpx
+
+from adaptive_concurrency import AdaptiveConcurrency, OK, THROTTLED, ERROR
+
+DEFAULT_CONCURRENCY = 16
+
+# 单个上传请求的超时（秒）
+REQUEST_TIMEOUT = 60
+
+# 每张图片的默认重试次数
+DEFAULT_RETRIES = 3
+
+# 重试退避：第n次重试前等待 [0, min(BACKOFF_MAX, BACKOFF_BASE * 2^n)) 之间的随机时间
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+
+# 可以重试的HTTP状态码，其中THROTTLE_STATUSES表示服务端限流，会减小并发数
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+THROTTLE_STATUSES = (429, 503)
+
+
+class RetryableUploadError(Exception):
+    """服务端返回了可以重试的状态码"""
+
+    def __init__(self, status_code, retry_after=None):
+        super().__init__(f"Upload server returned {status_code}")
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+def _check_retryable(response):
+    """状态码可以重试时抛出 RetryableUploadError"""
+    if response.status_code in RETRY_STATUSES:
+        retry_after = response.headers.get('Retry-After')
+        try:
+            retry_after = float(retry_after) if retry_after is not None else None
+        except ValueError:
+            retry_after = None
+        raise RetryableUploadError(response.status_code, retry_after)
+
+
+class PicGOBackend:
+    """PicGO HTTP接口：POST /upload，由PicGO自己读取本地文件"""
+
+    def __init__(self, endpoint='http://127.0.0.1:36677'):
+        self.endpoint = endpoint.rstrip('/')
+
+    def read(self, local_file_path):
+        return None
+
+    async def upload(self, client, local_file_path, remote_file_path, data):
+        response = await client.post(f"{self.endpoint}/upload", json={'list': [local_file_path]})
+        _check_retryable(response)
+        result = response.json()
+        if result.get('success'):
+            return result['result'][0], True
+        return result, False
+
+
+class AliOSSBackend:
+    """阿里云OSS：带V1签名的PUT Object请求，返回的地址与pdfdeal的Ali_OSS一致（假定bucket公共读）"""
+
+    def __init__(self, access_key_id, access_key_secret, endpoint, bucket):
+        self.access_key_id = access_key_id
+        self.access_key_secret = access_key_secret
+        self.bucket = bucket
+        scheme, _, host = endpoint.rpartition('://')
+        self.scheme = scheme or 'http'
+        self.host = host.rstrip('/')
+
+    def read(self, local_file_path):
+        with open(local_file_path, 'rb') as f:
+            return f.read()
+
+    def _authorization(self, content_type, date, remote_file_path):
+        string_to_sign = f"PUT\n\n{content_type}\n{date}\n/{self.bucket}/{remote_file_path}"
+        digest = hmac.new(self.access_key_secret.encode(), string_to_sign.encode(), hashlib.sha1).digest()
+        return f"OSS {self.access_key_id}:{base64.b64encode(digest).decode()}"
+
+    async def upload(self, client, local_file_path, remote_file_path, data):
+        content_type = mimetypes.guess_type(remote_file_path)[0] or 'application/octet-stream'
+        date = formatdate(usegmt=True)
+        response = await client.put(
+            f"{self.scheme}://{self.bucket}.{self.host}/{quote(remote_file_path)}",
+            content=data,
+            headers={
+                'Content-Type': content_type,
+                'Date': date,
+                'Authorization': self._authorization(content_type, date, remote_file_path)
+            }
+        )
+        _check_retryable(response)
+        if response.status_code != 200:
+            return f"OSS returned {response.status_code}: {response.text[:200]}", False
+        return f"https://{self.bucket}.{self.host}/{remote_file_path}", True
+
+
+class AsyncUploadEngine:
+    def __init__(self, backend, concurrency=DEFAULT_CONCURRENCY, adaptive=False, retries=DEFAULT_RETRIES):
+        """
+        创建上传引擎并启动后台事件循环
+
+        Args:
+            backend: PicGOBackend 或 AliOSSBackend
+            concurrency: 同时进行的上传数，也是连接池的大小；adaptive=True时为并发数的上限
+            adaptive: 是否根据限流和延迟自动调整并发数
+            retries: 每张图片遇到限流、5xx、超时或连接错误时的重试次数
+        """
+        self.backend = backend
+        self.concurrency = max(1, concurrency)
+        self.adaptive = adaptive
+        self.retries = max(0, retries)
+        self.retried = 0
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name='async-upload', daemon=True)
+        self._thread.start()
+        self._client = None
+        self._closed = False
+        asyncio.run_coroutine_threadsafe(self._start(), self._loop).result()
+
+    async def _start(self):
+        self._client = httpx.AsyncClient(
+            timeout=REQUEST_TIMEOUT,
+            limits=httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+        )
+        self._limit = AdaptiveConcurrency(self.concurrency, self.adaptive)
+        # 预读的文件加上正在上传的文件最多2*concurrency个，限制内存占用
+        self._read_slots = asyncio.Semaphore(2 * self.concurrency)
+
+    async def _attempt(self, local_file_path, remote_file_path, data, rate_limiter):
+        """
+        占用一个上传位置上传一次
+
+        Returns:
+            tuple: (上传结果或None, 可以重试的异常或None)
+        """
+        epoch = await self._limit.acquire()
+        outcome = ERROR
+        start = time.monotonic()
+        try:
+            if rate_limiter is not None:
+                await rate_limiter.acquire_async()
+                start = time.monotonic()
+            result = await self.backend.upload(self._client, local_file_path, remote_file_path, data)
+            outcome = OK
+            return result, None
+        except RetryableUploadError as e:
+            if e.status_code in THROTTLE_STATUSES:
+                outcome = THROTTLED
+            return None, e
+        except httpx.TimeoutException as e:
+            outcome = THROTTLED
+            return None, e
+        except httpx.TransportError as e:
+            return None, e
+        finally:
+            await self._limit.release(epoch, outcome, time.monotonic() - start)
+
+    async def _upload_one(self, local_file_path, remote_file_path, rate_limiter=None):
+        try:
+            async with self._read_slots:
+                data = await asyncio.to_thread(self.backend.read, local_file_path)
+                for attempt in range(self.retries + 1):
+                    result, error = await self._attempt(local_file_path, remote_file_path, data, rate_limiter)
+                    if error is None:
+                        return result
+                    if attempt == self.retries:
+                        break
+                    self.retried += 1
+                    delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+                    await asyncio.sleep(max(delay, getattr(error, 'retry_after', None) or 0))
+                return f"{error} (after {self.retries} retries)", False
+        except Exception as e:
+            return str(e), False
+
+    async def _upload_many(self, tasks, rate_limiter=None):
+        return await asyncio.gather(*(
+            self._upload_one(local_file_path, remote_file_path, rate_limiter)
+            for local_file_path, remote_file_path in tasks
+        ))
+
+    def upload_file(self, local_file_path, remote_file_path=None):
+        """
+        上传单个文件，与pdfdeal上传函数的接口一致
+
+        Returns:
+            tuple: (图片地址或错误信息, 是否成功)
+        """
+        return self.upload_files([(local_file_path, remote_file_path)])[0]
+
+    __call__ = upload_file
+
+    def upload_files(self, tasks, rate_limiter=None):
+        """
+        并发上传一批文件，可以从多个线程同时调用
+
+        Args:
+            tasks: [(本地文件路径, 远程文件名)]
+            rate_limiter: 限流器，每个上传请求前获取一个许可
+
+        Returns:
+            list: 与tasks顺序一致的 (图片地址或错误信息, 是否成功)
+        """
+        if self._closed:
+            raise RuntimeError("Upload engine is closed")
+        if not tasks:
+            return []
+        return asyncio.run_coroutine_threadsafe(self._upload_many(tasks, rate_limiter), self._loop).result()
+
+    async def _stats(self):
+        return dict(self._limit.stats(), upload_retries=self.retried)
+
+    def stats(self):
+        """
+        上传统计，用于运行总结
+
+        Returns:
+            dict: 当前并发数、并发数随时间的变化、成功/限流/失败的请求数和重试次数
+        """
+        if self._closed:
+            return {}
+        return asyncio.run_coroutine_threadsafe(self._stats(), self._loop).result()
+
+    def close(self):
+        """关闭连接池并停止后台事件循环"""
+        if self._closed:
+            return
+        self._closed = True
+        asyncio.run_coroutine_threadsafe(self._client.aclose(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+
+class _StandInHandler(BaseHTTPRequestHandler):
+    """
+    模拟PicGO的 /upload 接口，每个请求等待固定的延迟；
+    server.capacity 大于0时，同时处理的请求超过capacity个则返回429
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        with self.server.lock:
+            throttled = 0 < self.server.capacity <= self.server.active
+            if throttled:
+                self.server.throttled += 1
+            else:
+                self.server.active += 1
+        if throttled:
+            self.send_response(429)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        time.sleep(self.server.latency)
+        with self.server.lock:
+            self.server.active -= 1
+            self.server.requests += 1
+        payload = json.dumps({
+            'success': True,
+            'result': [f"http://127.0.0.1/{Path(path).name}" for path in body['list']]
+        }).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _make_document(doc_dir: Path, images: int, image_bytes: int):
+    """生成引用images张本地图片的Markdown文档"""
+    (doc_dir / 'images').mkdir(parents=True)
+    lines = []
+    for index in range(images):
+        (doc_dir / 'images' / f'{index}.png').write_bytes(index.to_bytes(4, 'big') * (image_bytes // 4))
+        lines.append(f"Figure {index}\n\n![](images/{index}.png)\n\n")
+    md_file = doc_dir / f'{doc_dir.name}.md'
+    md_file.write_text(''.join(lines), encoding='utf-8')
+    return md_file
+
+
+def benchmark(images=200, latency_ms=20, concurrency=DEFAULT_CONCURRENCY, threads=3, image_kb=64, capacity=0):
+    """
+    用本地模拟PicGO服务比较几种上传方式处理同一个文档的耗时
+
+    thread 为原来的方式（pdfdeal的PicGO上传函数，同一文档threads个线程，每次上传新建连接），
+    async 为异步引擎（固定concurrency个并发上传，共享连接池），
+    adaptive 为自适应并发的异步引擎（并发数上限为concurrency）。
+    capacity 大于0时模拟服务端限流：同时处理的请求超过capacity个返回429。
+    """
+    from pdfdeal.FileTools.Img.PicGO import PicGO
+    from step3_process_images import process_document_images
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _StandInHandler)
+    server.daemon_threads = True
+    server.latency = latency_ms / 1000
+    server.capacity = capacity
+    server.lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    endpoint = f"http://127.0.0.1:{server.server_address[1]}"
+
+    root = Path(tempfile.mkdtemp(prefix='async_upload_bench_'))
+    results = []
+    try:
+        for mode in ('thread', 'async', 'adaptive'):
+            md_file = _make_document(root / mode, images, image_kb * 1024)
+            server.connections = server.requests = server.throttled = server.active = 0
+            engine = None
+            if mode != 'thread':
+                engine = AsyncUploadEngine(PicGOBackend(endpoint), concurrency, adaptive=mode == 'adaptive')
+            start = time.perf_counter()
+            try:
+                doc_result = process_document_images(
+                    str(md_file), engine if engine is not None else PicGO(endpoint), threads=threads
+                )
+                stats = engine.stats() if engine is not None else {}
+            finally:
+                if engine is not None:
+                    engine.close()
+            elapsed = time.perf_counter() - start
+            row = {
+                'mode': mode,
+                'failed_images': len(doc_result['failed_files']),
+                'uploads': server.requests,
+                'throttled': server.throttled,
+                'seconds': round(elapsed, 2),
+                'uploads_per_second': round(server.requests / elapsed, 1),
+                'connections': server.connections,
+                'final_concurrency': stats.get('upload_concurrency')
+            }
+            results.append(row)
+            print(
+                f"{mode}: {row['uploads']} uploads in {row['seconds']} s "
+                f"({row['uploads_per_second']}/s), {row['connections']} connections opened, "
+                f"{row['throttled']} requests throttled, {row['failed_images']} images failed"
+                + (f", final concurrency {row['final_concurrency']}" if engine is not None else '')
+            )
+    finally:
+        server.shutdown()
+        shutil.rmtree(root, ignore_errors=True)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the asyncio upload engine against threaded uploads with a local stand-in PicGO server'
+    )
+    parser.add_argument(
+        '--benchmark',
+        action='store_true',
+        help='Run the benchmark'
+    )
+    parser.add_argument(
+        '--images',
+        type=int,
+        default=200,
+        help='Number of images in the generated document (default: 200)'
+    )
+    parser.add_argument(
+        '--latency-ms',
+        type=float,
+        default=20,
+        help='Simulated server latency per upload in milliseconds (default: 20)'
+    )
+    parser.add_argument(
+        '--concurrency',
+        type=int,
+        default=DEFAULT_CONCURRENCY,
+        help=f'In-flight uploads of the async engine (default: {DEFAULT_CONCURRENCY})'
+    )
+    parser.add_argument(
+        '--threads',
+        type=int,
+        default=3,
+        help='Upload threads per document of the threaded path (default: 3)'
+    )
+    parser.add_argument(
+        '--capacity',
+        type=int,
+        default=0,
+        help='Simulate throttling: the server answers 429 when more than this many requests are in flight (default: 0, unlimited)'
+    )
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.images, args.latency_ms, args.concurrency, args.threads, capacity=args.capacity)
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
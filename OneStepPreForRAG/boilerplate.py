@@ -0,0 +1,145 @@
+"""
+去除重复的页眉、页脚和页码
+
+转换得到的Markdown中每页的页眉、页脚和页码都会留下一行，增加分块数量并干扰检索。
+页面边界在Markdown中已经不可见，这里按以下特征识别：
+    - 单独成段（前后都是空行）的短行，不在代码块中，不是标题、表格、图片
+    - 规范化（小写、合并空白）后相同；只有页码形式的行（"第 12 页"、"Page 3 of 8"、"- 7 -"）
+      和以分隔符隔开页码的页眉（"Annual Report | 12"）中的数字替换为#，
+      因此 "第 12 页" 和 "第 13 页" 视为同一行，而 "Figure 1"、"Table 2" 这类题注保持不同
+    - 在同一文档中至少出现min_repeats次，且相邻两次出现之间至少相隔MIN_GAP_LINES行（即分布在不同的页上）
+
+先流式统计一遍规范化行的出现次数，拆分时在同一遍读写中删除这些行。
+"""
+import re
+
+from chunker import count_tokens
+from md_stream import iter_pieces
+
+# 页眉页脚的最大长度（字符）
+MAX_LINE_CHARS = 100
+
+# 同一行两次出现之间至少间隔的行数，同一页中重复出现的内容不计入
+MIN_GAP_LINES = 10
+
+DEFAULT_MIN_REPEATS = 4
+
+_DIGITS = re.compile(r'\d+')
+_ROMAN = re.compile(r'^[ivxlcdm]+$')
+# 数字替换为#后的页码行：# / Page # / p. # / Page # of # / # / # / - # - / 第 # 页 / 第#页 共#页
+_PAGE_NUMBER = re.compile(
+    r'^[\W_]*(?:(?:page|pg\.?|p\.?|seite|第)\s*)?#\s*页?\s*(?:(?:of|/|von|共)\s*#\s*页?)?[\W_]*$'
+)
+# 页码在行首或行尾、用分隔符与标题隔开的页眉页脚：# | 标题 / 标题 | #
+_NUMBERED_HEADER = re.compile(r'^#\s+[|·•—–-]\s+\S.*$|^.*\S\s+[|·•—–-]\s+#$')
+_WHITESPACE = re.compile(r'\s+')
+_FENCE = re.compile(r'\s{0,3}(```|~~~)')
+_SKIP_PREFIXES = ('#', '|', '![', '<img', '<table', '```', '~~~', '=+=+=+=+')
+
+
+def normalize_line(line: str):
+    """
+    页眉页脚的比较键：去掉强调符号，小写，合并空白
+
+    只有页码形式的行中的数字和罗马数字页码替换为#；其他行中的数字保持不变，
+    避免 "Figure 1"、"Table 2"、"Step 3" 这类题注被当作同一行删除。
+    """
+    text = _WHITESPACE.sub(' ', line.strip().strip('*_').lower())
+    if _ROMAN.match(text):
+        return '#'
+    collapsed = _DIGITS.sub('#', text)
+    if _PAGE_NUMBER.match(collapsed) or _NUMBERED_HEADER.match(collapsed):
+        return collapsed
+    return text
+
+
+def _candidate_key(line: str):
+    """可能是页眉页脚的行返回其比较键，否则返回None"""
+    stripped = line.strip()
+    if not stripped or len(stripped) > MAX_LINE_CHARS or stripped.startswith(_SKIP_PREFIXES):
+        return None
+    if not any(char.isalnum() for char in stripped):
+        return None
+    return normalize_line(stripped)
+
+
+def classify_pieces(pieces):
+    """
+    标记单独成段的候选行
+
+    Args:
+        pieces: iter_pieces 产生的 (片段, 是否位于行首)
+
+    Yields:
+        tuple: (片段, 是否位于行首, 比较键或None)，只有单独成段的候选行才有比较键
+    """
+    in_fence = False
+    previous_blank = True
+    pending = None
+    for piece, at_line_start in pieces:
+        whole_line = at_line_start and piece.endswith('\n')
+        blank = whole_line and not piece.strip()
+
+        # 候选行要等读到下一行、确认其后是空行后才能确定
+        if pending is not None:
+            yield pending[0], True, pending[1] if blank else None
+            pending = None
+
+        if at_line_start and _FENCE.match(piece):
+            in_fence = not in_fence
+        elif whole_line and previous_blank and not in_fence:
+            key = _candidate_key(piece)
+            if key is not None:
+                pending = (piece, key)
+                previous_blank = False
+                continue
+
+        yield piece, at_line_start, None
+        previous_blank = blank
+    if pending is not None:
+        yield pending[0], True, pending[1]
+
+
+def find_boilerplate(md_file: str, min_repeats=DEFAULT_MIN_REPEATS):
+    """
+    统计文档中的页眉页脚
+
+    Returns:
+        set: 出现次数达到min_repeats的比较键
+    """
+    counts = {}
+    last_seen = {}
+    line_number = 0
+    with open(md_file, 'r', encoding='utf-8') as f:
+        for _, at_line_start, key in classify_pieces(iter_pieces(f)):
+            if at_line_start:
+                line_number += 1
+            if key is None:
+                continue
+            if line_number - last_seen.get(key, -MIN_GAP_LINES) >= MIN_GAP_LINES:
+                counts[key] = counts.get(key, 0) + 1
+                last_seen[key] = line_number
+    return {key for key, count in counts.items() if count >= min_repeats}
+
+
+class BoilerplateStats:
+    """一个文档去除页眉页脚的统计"""
+
+    def __init__(self):
+        self.lines_removed = 0
+        self.bytes_saved = 0
+        self.tokens_saved = 0
+
+    def add(self, line: str):
+        self.lines_removed += 1
+        self.bytes_saved += len(line.encode('utf-8'))
+        self.tokens_saved += count_tokens(line)
+
+    def report(self, chunk_tokens=512):
+        """chunks_saved 按每个分块chunk_tokens个token估算"""
+        return {
+            'lines_removed': self.lines_removed,
+            'bytes_saved': self.bytes_saved,
+            'tokens_saved': self.tokens_saved,
+            'chunks_saved': round(self.tokens_saved / max(1, chunk_tokens), 1)
+        }
@@ -0,0 +1,295 @@
+"""
+分块近似去重（MinHash + LSH）
+
+同一文档的多个修订版会产生大量几乎相同的段落。这里对分块文件中的每个分块：
+    1. 把规范化后的文本切成字符shingle，用NumPy向量化计算哈希
+    2. 用NUM_PERM个随机哈希函数计算MinHash签名
+    3. 签名分成若干band，任一band相同的分块成为候选，再用签名估计的相似度确认
+
+按分块文件中的顺序处理，每个分块只与之前的非重复分块比较，
+相似度达到阈值时标记为最相似的那个分块的重复。
+'link' 模式在分块记录中加入 duplicate_of/similarity 字段，'drop' 模式删除重复分块；
+两种模式都在 <output_dir>/chunks_dedup.json 中写出映射报告。
+"""
+import json
+import os
+import re
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+DEDUP_MODES = ('link', 'drop')
+REPORT_NAME = 'chunks_dedup.json'
+
+# 字符shingle长度，按字符切分对中文同样适用
+SHINGLE_CHARS = 5
+NUM_PERM = 128
+# 太短的分块（如只有标题）不参与去重
+MIN_DEDUP_CHARS = 32
+# 每批计算签名的分块数
+BATCH_SIZE = 1024
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+def _permutations(num_perm=NUM_PERM, seed=1):
+    """
+    随机哈希 ((a * h + b) mod 2^64) >> 32 的参数（multiply-add-shift），
+    a为奇数，uint64溢出即取模，不需要逐元素求余
+    """
+    rng = np.random.default_rng(seed)
+    a = rng.integers(0, 1 << 63, size=num_perm, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+    b = rng.integers(0, 1 << 63, size=num_perm, dtype=np.uint64)
+    return a[:, None], b[:, None]
+
+
+def shingle_hashes(text: str, k=SHINGLE_CHARS):
+    """规范化文本（小写、合并空白）的字符k-gram的32位哈希（已去重）"""
+    text = _WHITESPACE.sub(' ', text.lower()).strip()
+    codes = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32).astype(np.uint64)
+    count = max(1, len(codes) - k + 1)
+    k = min(k, len(codes))
+    hashes = np.zeros(count, dtype=np.uint64)
+    # 多项式滚动哈希，uint64溢出自动取模
+    for offset in range(k):
+        hashes = hashes * np.uint64(1000003) + codes[offset:offset + count]
+    return np.unique((hashes ^ (hashes >> np.uint64(32))) & np.uint64(0xFFFFFFFF))
+
+
+def minhash(texts, permutations):
+    """计算一批文本的MinHash签名，返回 (len(texts), NUM_PERM) 的uint32数组"""
+    a, b = permutations
+    signatures = np.empty((len(texts), a.shape[0]), dtype=np.uint32)
+    buffer = np.empty((a.shape[0], 0), dtype=np.uint64)
+    shift = np.uint64(32)
+    for index, text in enumerate(texts):
+        hashes = shingle_hashes(text)
+        if buffer.shape[1] < len(hashes):
+            buffer = np.empty((a.shape[0], len(hashes)), dtype=np.uint64)
+        # 在预分配的缓冲区中原地计算，避免每步生成 NUM_PERM x shingle数 的临时数组
+        view = buffer[:, :len(hashes)]
+        np.multiply(a, hashes[None, :], out=view)
+        view += b
+        view >>= shift
+        signatures[index] = view.min(axis=1)
+    return signatures
+
+
+def lsh_params(threshold, num_perm=NUM_PERM):
+    """
+    选择band数和每个band的行数
+
+    取 (1/bands)^(1/rows) 不超过阈值的组合中最接近阈值的一个，
+    宁可多产生候选（之后会用签名相似度确认），也不漏掉相似分块。
+    """
+    best = (num_perm, 1)
+    for rows in range(1, num_perm + 1):
+        if num_perm % rows:
+            continue
+        bands = num_perm // rows
+        if (1 / bands) ** (1 / rows) <= threshold:
+            best = (bands, rows)
+    return best
+
+
+def find_duplicates(signatures, eligible, threshold):
+    """
+    按顺序查找每个分块之前最相似的非重复分块
+
+    Args:
+        signatures: (n, NUM_PERM) 签名数组
+        eligible: 长度为n的布尔数组，False的分块不参与去重
+        threshold: 相似度阈值
+
+    Returns:
+        dict: {重复分块下标: (保留分块下标, 相似度)}
+    """
+    bands, rows = lsh_params(threshold, signatures.shape[1])
+    band_view = signatures[:, :bands * rows].reshape(len(signatures), bands, rows)
+    buckets = [{} for _ in range(bands)]
+    duplicates = {}
+    for index in range(len(signatures)):
+        if not eligible[index]:
+            continue
+        keys = [band_view[index, band].tobytes() for band in range(bands)]
+        candidates = set()
+        for band, key in enumerate(keys):
+            candidates.update(buckets[band].get(key, ()))
+        best, best_similarity = None, threshold
+        if candidates:
+            candidates = sorted(candidates)
+            similarities = (signatures[candidates] == signatures[index]).mean(axis=1)
+            top = int(similarities.argmax())
+            if similarities[top] >= best_similarity:
+                best, best_similarity = candidates[top], float(similarities[top])
+        if best is not None:
+            duplicates[index] = (best, best_similarity)
+            continue
+        # 只有保留的分块进入桶中，完全相同的分块不会让候选数增长
+        for band, key in enumerate(keys):
+            buckets[band].setdefault(key, []).append(index)
+    return duplicates
+
+
+def _signatures(text_batches, workers=1):
+    """
+    计算各批文本的签名并按顺序拼接
+
+    workers大于1时在进程池中计算，同时最多提交2*workers批，避免把所有文本读入内存。
+    """
+    permutations = _permutations()
+    results = []
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            for batch in text_batches:
+                pending.append(executor.submit(minhash, batch, permutations))
+                if len(pending) >= 2 * workers:
+                    results.append(pending.popleft().result())
+            results.extend(future.result() for future in pending)
+    else:
+        results = [minhash(batch, permutations) for batch in text_batches]
+    return np.concatenate(results) if results else np.empty((0, NUM_PERM), dtype=np.uint32)
+
+
+def _read_jsonl_texts(store: Path, workers=1):
+    """读取JSONL分块文件的 id、是否参与去重、token数，按批计算签名"""
+    ids, eligible, tokens = [], [], []
+
+    def text_batches():
+        batch = []
+        with open(store, 'r', encoding='utf-8') as f:
+            for line in f:
+                record = json.loads(line)
+                ids.append(record['id'])
+                tokens.append(record.get('tokens', 0))
+                eligible.append(len(record['text']) >= MIN_DEDUP_CHARS)
+                batch.append(record['text'])
+                if len(batch) >= BATCH_SIZE:
+                    yield batch
+                    batch = []
+        if batch:
+            yield batch
+
+    signatures = _signatures(text_batches(), workers)
+    return ids, np.array(eligible, dtype=bool), tokens, signatures
+
+
+def _rewrite_jsonl(store: Path, ids, duplicates, mode):
+    """按模式重写JSONL分块文件"""
+    fd, temp_file = tempfile.mkstemp(prefix='.chunks_', suffix='.tmp', dir=store.parent)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as out, open(store, 'r', encoding='utf-8') as f:
+            for index, line in enumerate(f):
+                duplicate = duplicates.get(index)
+                if mode == 'drop':
+                    if duplicate is None:
+                        out.write(line)
+                    continue
+                record = json.loads(line)
+                record['duplicate_of'] = ids[duplicate[0]] if duplicate else None
+                record['similarity'] = round(duplicate[1], 4) if duplicate else None
+                out.write(json.dumps(record, ensure_ascii=False) + '\n')
+        os.replace(temp_file, store)
+    except BaseException:
+        os.remove(temp_file)
+        raise
+
+
+def _dedup_parquet(store: Path, mode, threshold, workers=1):
+    """Parquet分块文件去重，返回 (ids, tokens, duplicates)"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    table = pq.read_table(store)
+    texts = table.column('text').to_pylist()
+    ids = table.column('id').to_pylist()
+    tokens = table.column('tokens').to_pylist() if 'tokens' in table.column_names else [0] * len(ids)
+    signatures = _signatures(
+        (texts[start:start + BATCH_SIZE] for start in range(0, len(texts), BATCH_SIZE)), workers
+    )
+    eligible = np.array([len(text) >= MIN_DEDUP_CHARS for text in texts], dtype=bool)
+    duplicates = find_duplicates(signatures, eligible, threshold)
+
+    if mode == 'drop':
+        table = table.filter(pa.array([index not in duplicates for index in range(len(ids))]))
+    else:
+        for name in ('duplicate_of', 'similarity'):
+            if name in table.column_names:
+                table = table.drop([name])
+        table = table.append_column('duplicate_of', pa.array(
+            [ids[duplicates[index][0]] if index in duplicates else None for index in range(len(ids))], pa.string()
+        ))
+        table = table.append_column('similarity', pa.array(
+            [round(duplicates[index][1], 4) if index in duplicates else None for index in range(len(ids))], pa.float64()
+        ))
+
+    fd, temp_file = tempfile.mkstemp(prefix='.chunks_', suffix='.tmp', dir=store.parent)
+    os.close(fd)
+    try:
+        pq.write_table(table, temp_file)
+        os.replace(temp_file, store)
+    except BaseException:
+        os.remove(temp_file)
+        raise
+    return ids, tokens, duplicates
+
+
+def dedup_chunk_store(store: str, mode='link', threshold=0.85, workers=1):
+    """
+    对分块文件进行近似去重
+
+    Args:
+        store: 分块文件路径（chunks.jsonl 或 chunks.parquet）
+        mode: 'link' 标记重复分块，'drop' 删除重复分块
+        threshold: 估计的Jaccard相似度阈值
+        workers: 并行计算签名的进程数
+
+    Returns:
+        dict: {'chunks', 'duplicates', 'tokens_saved', 'report'}
+    """
+    if mode not in DEDUP_MODES:
+        raise ValueError(f"Unsupported dedup mode: {mode}")
+    store = Path(store)
+    if store.suffix == '.parquet':
+        ids, tokens, duplicates = _dedup_parquet(store, mode, threshold, workers)
+    else:
+        ids, eligible, tokens, signatures = _read_jsonl_texts(store, workers)
+        duplicates = find_duplicates(signatures, eligible, threshold)
+        _rewrite_jsonl(store, ids, duplicates, mode)
+
+    clusters = {}
+    for index, (canonical, similarity) in sorted(duplicates.items()):
+        clusters.setdefault(canonical, []).append({'id': ids[index], 'similarity': round(similarity, 4)})
+    bands, rows = lsh_params(threshold)
+    report = {
+        'mode': mode,
+        'threshold': threshold,
+        'num_perm': NUM_PERM,
+        'bands': bands,
+        'rows': rows,
+        'chunks': len(ids),
+        'duplicates': len(duplicates),
+        'tokens_saved': sum(tokens[index] or 0 for index in duplicates),
+        'clusters': [
+            {'canonical': ids[canonical], 'duplicates': members}
+            for canonical, members in sorted(clusters.items())
+        ]
+    }
+    report_file = store.parent / REPORT_NAME
+    with open(report_file, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    print(
+        f"Dedup results - {len(duplicates)} of {len(ids)} chunks are near-duplicates "
+        f"({report['tokens_saved']} tokens), mapping written to {report_file}"
+    )
+    return {
+        'chunks': len(ids),
+        'duplicates': len(duplicates),
+        'tokens_saved': report['tokens_saved'],
+        'report': str(report_file)
+    }
@@ -0,0 +1,477 @@
+"""
+按token预算切分Markdown，导出供向量化使用的分块文件
+
+分块遵循文档结构：
+    - 分块不跨越标题，每个分块记录其所在的标题路径
+    - 表格和代码块作为整体，只有超过预算时才按行切分（表格的后续部分重复表头，代码块的每部分补齐围栏）
+    - 相邻分块之间按块重叠，重叠部分不超过overlap
+
+分块文件（<output_dir>/chunks.jsonl 或 chunks.parquet）每行/每条记录为：
+    {"id": "<doc_id>:<序号>", "doc_id": ..., "chunk_index": ..., "source": "<相对路径>",
+     "start": ..., "end": ..., "heading_path": [...], "tokens": ..., "text": ...}
+start/end 是分块在源Markdown文件中的字符偏移。
+"""
+import importlib.util
+import json
+import os
+import re
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from md_stream import SPLIT_STR
+
+CHUNK_STORE_NAME = 'chunks'
+STORE_FORMATS = ('jsonl', 'parquet')
+
+_HEADING = re.compile(r'(#{1,6})\s+(.*?)\s*#*\s*$')
+_FENCE = re.compile(r'\s{0,3}(`{3,}|~{3,})')
+_CJK = re.compile(r'[　-鿿가-힯豈-﫿]')
+
+_encoding = None
+
+
+def _get_encoding():
+    """tiktoken可用时使用cl100k_base编码计数，否则返回None使用估算"""
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding('cl100k_base')
+        except Exception:
+            _encoding = False
+    return _encoding or None
+
+
+def count_tokens(text: str, unit='tokens'):
+    """
+    计算文本长度
+
+    unit为'chars'时返回字符数；为'tokens'时优先用tiktoken计数，
+    没有安装时按 每个中日韩字符1个token、其余每4个字符1个token 估算。
+    """
+    if unit == 'chars':
+        return len(text)
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+class ChunkOptions:
+    """分块参数"""
+
+    def __init__(self, max_tokens=512, overlap=64, unit='tokens', store_format='jsonl',
+                 dedup_mode=None, dedup_threshold=0.85):
+        """
+        Args:
+            max_tokens: 每个分块的最大长度
+            overlap: 相邻分块的最大重叠长度
+            unit: 长度单位，'tokens' 或 'chars'
+            store_format: 分块文件格式，'jsonl' 或 'parquet'
+            dedup_mode: 写入分块文件后的近似去重模式，'link'、'drop' 或 None（不去重）
+            dedup_threshold: 近似去重的相似度阈值
+        """
+        if store_format not in STORE_FORMATS:
+            raise ValueError(f"Unsupported chunk store format: {store_format}")
+        if store_format == 'parquet' and importlib.util.find_spec('pyarrow') is None:
+            # 在转换开始前报错，而不是在所有文档处理完后才失败
+            raise RuntimeError("Parquet chunk export requires pyarrow: pip install pyarrow")
+        self.max_tokens = max(1, max_tokens)
+        self.overlap = max(0, min(overlap, self.max_tokens // 2))
+        self.unit = unit
+        self.store_format = store_format
+        self.dedup_mode = dedup_mode
+        self.dedup_threshold = dedup_threshold
+
+
+def _parse_blocks(content: str):
+    """
+    把Markdown解析为块
+
+    Returns:
+        list: [(类型, 起始偏移, 结束偏移, 标题级别或None, 标题文本或None), ...]
+              类型为 'heading'、'code'、'table'、'text' 或 'break'（分隔符）
+    """
+    lines = content.splitlines(keepends=True)
+    blocks = []
+    offset = 0
+    index = 0
+    while index < len(lines):
+        line = lines[index]
+        start = offset
+        stripped = line.strip()
+
+        if not stripped:
+            index += 1
+            offset += len(line)
+            continue
+
+        if stripped == SPLIT_STR:
+            blocks.append(('break', start, start + len(line), None, None))
+            index += 1
+            offset += len(line)
+            continue
+
+        heading = _HEADING.match(line)
+        if heading:
+            blocks.append(('heading', start, start + len(line), len(heading.group(1)), heading.group(2)))
+            index += 1
+            offset += len(line)
+            continue
+
+        fence = _FENCE.match(line)
+        if fence:
+            marker = fence.group(1)
+            index += 1
+            offset += len(line)
+            # 找到相同字符、不短于开头的结束标记
+            while index < len(lines):
+                closing = lines[index]
+                index += 1
+                offset += len(closing)
+                if closing.strip().startswith(marker[0] * len(marker)) and not closing.strip().strip(marker[0]):
+                    break
+            blocks.append(('code', start, offset, None, None))
+            continue
+
+        if stripped.startswith('|') or stripped.lower().startswith('<table'):
+            html = not stripped.startswith('|')
+            while index < len(lines):
+                current = lines[index].strip()
+                if html:
+                    index += 1
+                    offset += len(lines[index - 1])
+                    if '</table>' in current.lower():
+                        break
+                elif current.startswith('|'):
+                    index += 1
+                    offset += len(lines[index - 1])
+                else:
+                    break
+            blocks.append(('table', start, offset, None, None))
+            continue
+
+        # 普通段落：直到空行、标题、代码块、表格或分隔符
+        while index < len(lines):
+            current = lines[index]
+            current_stripped = current.strip()
+            if index > 0 and offset > start and (
+                not current_stripped
+                or current_stripped == SPLIT_STR
+                or _HEADING.match(current)
+                or _FENCE.match(current)
+                or current_stripped.startswith('|')
+            ):
+                break
+            index += 1
+            offset += len(current)
+        blocks.append(('text', start, offset, None, None))
+    return blocks
+
+
+def _split_line(line: str, budget: int, options: ChunkOptions):
+    """把过长的一行在空白处切分为不超过budget的片段，返回各片段的 (起始, 结束) 相对偏移"""
+    pieces = []
+    piece_start = 0
+    current = 0
+    for word in re.finditer(r'\S+\s*|\s+', line):
+        size = count_tokens(word.group(), options.unit)
+        if size > budget:
+            # 单个词过长，按字符切分
+            if word.start() > piece_start:
+                pieces.append((piece_start, word.start()))
+            step = max(1, len(word.group()) * budget // size)
+            for offset in range(word.start(), word.end(), step):
+                pieces.append((offset, min(word.end(), offset + step)))
+            piece_start = word.end()
+            current = 0
+            continue
+        if current + size > budget and word.start() > piece_start:
+            pieces.append((piece_start, word.start()))
+            piece_start = word.start()
+            current = 0
+        current += size
+    if len(line) > piece_start:
+        pieces.append((piece_start, len(line)))
+    return pieces
+
+
+def _split_oversized(content: str, kind: str, start: int, end: int, options: ChunkOptions):
+    """
+    把超过预算的块按行（单行过长时在空白处）切分为多个单元
+
+    表格的后续部分重复表头，代码块的每一部分都补齐开始和结束的围栏，
+    使每个分块单独看也是完整的Markdown。
+
+    Returns:
+        list: [(起始偏移, 结束偏移, 前缀文本, 后缀文本), ...]
+    """
+    text = content[start:end]
+    lines = text.splitlines(keepends=True)
+    prefix = suffix = ''
+    if kind == 'table' and text.lstrip().startswith('|'):
+        if len(lines) >= 2 and set(lines[1].strip()) <= set('|-: '):
+            prefix = ''.join(lines[:2])
+    elif kind == 'code':
+        prefix = lines[0]
+        suffix = _FENCE.match(lines[0]).group(1) + '\n'
+    budget = max(1, options.max_tokens - count_tokens(prefix + suffix, options.unit))
+
+    spans = []
+    unit_start = start
+    current = 0
+    position = start
+    for line in lines:
+        size = count_tokens(line, options.unit)
+        if size > budget:
+            if position > unit_start:
+                spans.append((unit_start, position))
+            spans.extend((position + a, position + b) for a, b in _split_line(line, budget, options))
+            position += len(line)
+            unit_start = position
+            current = 0
+            continue
+        if current + size > budget and position > unit_start:
+            spans.append((unit_start, position))
+            unit_start = position
+            current = 0
+        current += size
+        position += len(line)
+    if position > unit_start:
+        spans.append((unit_start, position))
+
+    units = []
+    for index, (unit_start, unit_end) in enumerate(spans):
+        unit_prefix = prefix if index > 0 else ''
+        unit_suffix = suffix if index < len(spans) - 1 else ''
+        if unit_suffix and not content[unit_start:unit_end].endswith('\n'):
+            unit_suffix = '\n' + unit_suffix
+        units.append((unit_start, unit_end, unit_prefix, unit_suffix))
+    return units
+
+
+def chunk_markdown(content: str, doc_id: str, source: str, options: ChunkOptions):
+    """
+    把一个Markdown文档的内容切分为分块记录
+
+    Returns:
+        list: 分块记录（字典），字段见模块说明
+    """
+    # 按标题划分为小节，每个小节是 (标题路径, [(起始, 结束, 前缀, 后缀), ...])
+    sections = []
+    heading_path = []
+    units = []
+
+    def close_section():
+        if units:
+            sections.append((list(heading_path), list(units)))
+            units.clear()
+
+    for kind, start, end, level, title in _parse_blocks(content):
+        if kind == 'break':
+            close_section()
+            continue
+        if kind == 'heading':
+            close_section()
+            heading_path[:] = heading_path[:level - 1] + [''] * max(0, level - 1 - len(heading_path))
+            heading_path.append(title)
+            units.append((start, end, '', ''))
+            continue
+        if count_tokens(content[start:end], options.unit) > options.max_tokens:
+            units.extend(_split_oversized(content, kind, start, end, options))
+        else:
+            units.append((start, end, '', ''))
+    close_section()
+
+    records = []
+    for path, section_units in sections:
+        sizes = [
+            count_tokens(prefix + content[start:end] + suffix, options.unit)
+            for start, end, prefix, suffix in section_units
+        ]
+        first = 0
+        while first < len(section_units):
+            # 从first开始尽量多装入单元
+            last = first
+            total = sizes[first]
+            while last + 1 < len(section_units) and total + sizes[last + 1] <= options.max_tokens:
+                last += 1
+                total += sizes[last]
+
+            if first == 0 and last == 0 and len(section_units) > 1 and _HEADING.match(content[section_units[0][0]:section_units[0][1]]):
+                # 标题放不进下一个单元所在的分块时不单独成块，标题仍记录在heading_path中
+                first = 1
+                continue
+
+            start = section_units[first][0]
+            end = section_units[last][1]
+            text = section_units[first][2] + content[start:end] + section_units[last][3]
+            text = text.strip()
+            if text:
+                records.append({
+                    'id': f"{doc_id}:{len(records)}",
+                    'doc_id': doc_id,
+                    'chunk_index': len(records),
+                    'source': source,
+                    'start': start,
+                    'end': end,
+                    'heading_path': [item for item in path if item],
+                    'tokens': count_tokens(text, options.unit),
+                    'text': text
+                })
+
+            if last + 1 >= len(section_units):
+                break
+            # 下一个分块从末尾若干个单元开始，重叠长度不超过overlap
+            next_first = last + 1
+            overlap = 0
+            while next_first - 1 > first and overlap + sizes[next_first - 1] <= options.overlap:
+                next_first -= 1
+                overlap += sizes[next_first]
+            first = next_first
+    return records
+
+
+def document_id(md_file: Path, root: Path):
+    """文档标识：<stem>/<stem>.md 使用stem，其他文件使用去掉扩展名的相对路径"""
+    if md_file.parent.name == md_file.stem:
+        return md_file.stem
+    return md_file.relative_to(root).with_suffix('').as_posix()
+
+
+def chunk_markdown_file(md_file: str, root: str, options: ChunkOptions):
+    """切分单个Markdown文件，返回 (分块记录, 错误信息)"""
+    md_path = Path(md_file)
+    try:
+        with open(md_path, 'r', encoding='utf-8') as f:
+            content = f.read()
+        source = md_path.relative_to(root).as_posix()
+        return chunk_markdown(content, document_id(md_path, Path(root)), source, options), None
+    except Exception as e:
+        return [], str(e)
+
+
+def _write_jsonl(store: Path, records, replaced_docs):
+    """写入JSONL分块文件，保留未重新切分的文档的分块"""
+    fd, temp_file = tempfile.mkstemp(prefix='.chunks_', suffix='.tmp', dir=store.parent)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as out:
+            if store.exists():
+                with open(store, 'r', encoding='utf-8') as old:
+                    for line in old:
+                        try:
+                            if json.loads(line)['doc_id'] in replaced_docs:
+                                continue
+                        except (ValueError, KeyError):
+                            continue
+                        out.write(line)
+            for record in records:
+                out.write(json.dumps(record, ensure_ascii=False) + '\n')
+        os.replace(temp_file, store)
+    except BaseException:
+        os.remove(temp_file)
+        raise
+
+
+def _write_parquet(store: Path, records, replaced_docs):
+    """写入Parquet分块文件，保留未重新切分的文档的分块"""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Parquet chunk export requires pyarrow: pip install pyarrow")
+
+    table = pa.Table.from_pylist(records) if records else None
+    if store.exists():
+        old = pq.read_table(store)
+        keep = [doc_id not in replaced_docs for doc_id in old.column('doc_id').to_pylist()]
+        old = old.filter(pa.array(keep))
+        table = pa.concat_tables([old, table.cast(old.schema)]) if table is not None else old
+    if table is None:
+        return
+
+    fd, temp_file = tempfile.mkstemp(prefix='.chunks_', suffix='.tmp', dir=store.parent)
+    os.close(fd)
+    try:
+        pq.write_table(table, temp_file)
+        os.replace(temp_file, store)
+    except BaseException:
+        os.remove(temp_file)
+        raise
+
+
+def chunk_markdown_files(output_dir: str, md_files, options: ChunkOptions, workers=0):
+    """
+    切分Markdown文件并写入分块文件
+
+    只替换本次处理的文档在分块文件中的记录，其他文档的分块保持不变。
+
+    Args:
+        output_dir: 输出目录，分块文件写在其中
+        md_files: 要切分的Markdown文件
+        options: 分块参数(ChunkOptions)
+        workers: 并行切分的进程数，0表示按CPU核心数
+
+    Returns:
+        dict: 与 split_markdown_files 相同的结果字典，另有 'chunks'（分块数）和 'chunk_store'（分块文件路径），
+              去重时还有 'duplicates'（整个分块文件中的重复分块数）和 'dedup_report'（映射报告路径）
+    """
+    result = {
+        'success': False,
+        'success_files': [],
+        'failed_files': [],
+        'error': None,
+        'chunks': 0,
+        'chunk_store': None
+    }
+    root = Path(output_dir)
+    md_files = [str(Path(md_file)) for md_file in md_files]
+    store = root / f"{CHUNK_STORE_NAME}.{options.store_format}"
+
+    try:
+        workers = workers if workers > 0 else (os.cpu_count() or 1)
+        args = (md_files, [str(root)] * len(md_files), [options] * len(md_files))
+        if min(workers, len(md_files)) > 1:
+            with ProcessPoolExecutor(max_workers=min(workers, len(md_files))) as executor:
+                file_results = list(executor.map(chunk_markdown_file, *args, chunksize=8))
+        else:
+            file_results = list(map(chunk_markdown_file, *args))
+
+        records = []
+        replaced_docs = set()
+        for md_file, (file_records, error) in zip(md_files, file_results):
+            if error:
+                result['failed_files'].append(md_file)
+                result['error'] = error
+                print(f"Error chunking {md_file}: {error}")
+                continue
+            result['success_files'].append(md_file)
+            replaced_docs.add(document_id(Path(md_file), root))
+            records.extend(file_records)
+
+        if options.store_format == 'parquet':
+            _write_parquet(store, records, replaced_docs)
+        else:
+            _write_jsonl(store, records, replaced_docs)
+
+        result['chunks'] = len(records)
+        result['chunk_store'] = str(store)
+        result['success'] = len(result['failed_files']) == 0
+        print(f"Chunk results - {len(records)} chunks from {len(result['success_files'])} files written to {store}")
+
+        if options.dedup_mode and store.exists():
+            from chunk_dedup import dedup_chunk_store
+            dedup_result = dedup_chunk_store(
+                store, options.dedup_mode, options.dedup_threshold, workers
+            )
+            result['duplicates'] = dedup_result['duplicates']
+            result['dedup_report'] = dedup_result['report']
+
+    except Exception as e:
+        result['error'] = str(e)
+        result['success'] = False
+        print(f"Error during chunk export: {e}")
+
+    return result
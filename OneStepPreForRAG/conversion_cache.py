@@ -0,0 +1,206 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from threading import Lock
+
+
+def calculate_sha256(file_path):
+    """计算文件的SHA256值"""
+    hash_sha256 = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            hash_sha256.update(chunk)
+    return hash_sha256.hexdigest()
+
+
+def _dir_size(path: Path):
+    return sum(f.stat().st_size for f in path.rglob('*') if f.is_file())
+
+
+class ConversionCache:
+    """
+    以PDF内容哈希为键的转换结果缓存
+
+    缓存键由PDF内容的SHA256、转换器名称、版本和转换参数共同决定，
+    任意一项变化都会视为新的条目。每个条目保存整理后的文档目录
+    （<stem>.md 与图片），超过容量上限时按最近访问时间淘汰。
+
+    目录结构：
+        <cache_dir>/<key[:2]>/<key>/meta.json
+        <cache_dir>/<key[:2]>/<key>/content/...
+    """
+
+    def __init__(self, cache_dir, max_size_bytes=20 * 1024 ** 3, shared_with=None):
+        """
+        初始化缓存
+
+        Args:
+            cache_dir: 缓存目录
+            max_size_bytes: 缓存容量上限（字节），0表示不限制
+            shared_with: 共享容量上限的另一个缓存（如页级缓存与文档缓存），提供时忽略max_size_bytes，
+                         两者的条目合计不超过其上限，按最近访问时间统一淘汰
+        """
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        if shared_with is None:
+            self.max_size_bytes = max_size_bytes
+            self.lock = Lock()
+            # 共享同一容量上限的所有缓存
+            self.members = [self]
+        else:
+            self.max_size_bytes = shared_with.max_size_bytes
+            self.lock = shared_with.lock
+            self.members = shared_with.members
+            self.members.append(self)
+        self.stats = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+
+        # 内存中的索引: key -> {'size': int, 'last_access': float}
+        self.index = {}
+        for meta_file in self.cache_dir.glob('*/*/meta.json'):
+            if meta_file.parent.name.startswith('.'):
+                # 上次运行中断时遗留的临时条目
+                shutil.rmtree(meta_file.parent, ignore_errors=True)
+                continue
+            try:
+                with open(meta_file, 'r', encoding='utf-8') as f:
+                    meta = json.load(f)
+                self.index[meta_file.parent.name] = {
+                    'size': meta['size'],
+                    'last_access': meta['last_access']
+                }
+            except (OSError, ValueError, KeyError):
+                # 写入一半的条目直接丢弃
+                shutil.rmtree(meta_file.parent, ignore_errors=True)
+
+    @staticmethod
+    def make_key(pdf_file, converter: str, version: str, flags):
+        """根据PDF内容和转换配置生成缓存键"""
+        hash_sha256 = hashlib.sha256()
+        hash_sha256.update(calculate_sha256(pdf_file).encode('utf-8'))
+        hash_sha256.update(json.dumps([converter, version, list(flags)]).encode('utf-8'))
+        return hash_sha256.hexdigest()
+
+    @staticmethod
+    def make_page_key(page_hash: str, converter: str, version: str, flags):
+        """根据单页内容哈希和转换配置生成页级缓存键"""
+        hash_sha256 = hashlib.sha256()
+        hash_sha256.update(b'page:' + page_hash.encode('utf-8'))
+        hash_sha256.update(json.dumps([converter, version, list(flags)]).encode('utf-8'))
+        return hash_sha256.hexdigest()
+
+    def _entry_path(self, key: str):
+        return self.cache_dir / key[:2] / key
+
+    def _write_meta(self, key: str, meta: dict):
+        meta_file = self._entry_path(key) / 'meta.json'
+        tmp_file = meta_file.with_suffix('.tmp')
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(tmp_file, meta_file)
+
+    def contains(self, key: str):
+        """缓存中是否有该条目（不计入命中统计）"""
+        with self.lock:
+            return key in self.index
+
+    def restore(self, key: str, target_md: Path, stem: str):
+        """
+        从缓存恢复文档目录到target_md
+
+        Returns:
+            bool: 是否命中缓存
+        """
+        entry = self._entry_path(key)
+        with self.lock:
+            if key not in self.index:
+                self.stats['misses'] += 1
+                return False
+            self.index[key]['last_access'] = time.time()
+
+        try:
+            with open(entry / 'meta.json', 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            shutil.copytree(entry / 'content', target_md)
+            # 同一内容的PDF可能换了文件名，Markdown文件名跟随新的stem
+            if meta['stem'] != stem:
+                os.rename(target_md / f"{meta['stem']}.md", target_md / f"{stem}.md")
+            meta['last_access'] = self.index[key]['last_access']
+            self._write_meta(key, meta)
+        except (OSError, ValueError, KeyError):
+            shutil.rmtree(target_md, ignore_errors=True)
+            with self.lock:
+                self.index.pop(key, None)
+                self.stats['misses'] += 1
+            shutil.rmtree(entry, ignore_errors=True)
+            return False
+
+        with self.lock:
+            self.stats['hits'] += 1
+        return True
+
+    def store(self, key: str, source_md: Path, stem: str):
+        """将转换完成的文档目录存入缓存"""
+        if not (source_md / f"{stem}.md").exists():
+            return
+
+        entry = self._entry_path(key)
+        entry.parent.mkdir(parents=True, exist_ok=True)
+        # 先写到临时目录，再整体rename，避免留下不完整的条目
+        tmp_entry = Path(tempfile.mkdtemp(prefix=f".{key}_", dir=entry.parent))
+        try:
+            shutil.copytree(source_md, tmp_entry / 'content')
+            size = _dir_size(tmp_entry / 'content')
+            meta = {'stem': stem, 'size': size, 'last_access': time.time()}
+            with open(tmp_entry / 'meta.json', 'w', encoding='utf-8') as f:
+                json.dump(meta, f, ensure_ascii=False)
+
+            with self.lock:
+                if key in self.index:
+                    return
+                if entry.exists():
+                    shutil.rmtree(entry, ignore_errors=True)
+                os.replace(tmp_entry, entry)
+                self.index[key] = {'size': size, 'last_access': meta['last_access']}
+                self.stats['stores'] += 1
+            self._evict()
+        finally:
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+
+    def _evict(self):
+        """按最近访问时间淘汰共享容量上限的所有缓存中的条目，直到总大小不超过上限"""
+        if not self.max_size_bytes:
+            return
+        with self.lock:
+            entries = [
+                (item['last_access'], member, key, item['size'])
+                for member in self.members for key, item in member.index.items()
+            ]
+            total = sum(size for _, _, _, size in entries)
+            if total <= self.max_size_bytes:
+                return
+            victims = []
+            for _, member, key, size in sorted(entries, key=lambda entry: entry[0]):
+                if total <= self.max_size_bytes:
+                    break
+                total -= size
+                victims.append((member, key))
+            for member, key in victims:
+                del member.index[key]
+                member.stats['evictions'] += 1
+
+        for member, key in victims:
+            shutil.rmtree(member._entry_path(key), ignore_errors=True)
+
+    def report(self):
+        """返回命中统计，用于运行总结"""
+        with self.lock:
+            stats = dict(self.stats)
+            stats['entries'] = len(self.index)
+            stats['size_bytes'] = sum(item['size'] for item in self.index.values())
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+        return stats
@@ -0,0 +1,357 @@
+"""
+常驻转换服务
+
+在转换器所在的conda环境中启动一个长期运行的进程，只加载一次版面/OCR模型，
+之后通过本地socket接收转换任务，避免每个PDF都重复 `conda run` 和模型加载。
+
+协议：每个连接发送一行JSON请求，服务端返回一行JSON响应
+    {"pdf": "<pdf路径>", "output_dir": "<输出目录>", "ocr": true}  ->  {"ok": true} / {"ok": false, "error": "..."}
+    {"cmd": "shutdown"}                               ->  {"ok": true}
+每个请求都带有 "token" 字段，必须与启动服务时通过环境变量 SIMPLERAG_CONVERTER_TOKEN 传入的
+本次运行的随机令牌一致，否则拒绝请求；因此本机的其他用户或进程不能提交任务或关闭服务。
+转换任务同一时间只执行一个，任务开始执行时服务端先返回一行 {"started": true}，
+客户端从这时开始计算超时，排队等待的时间不计入。
+
+输出目录结构与命令行工具一致：
+    marker: <output_dir>/<stem>/<stem>.md 及图片
+    mineru: <output_dir>/<stem>/<ocr|txt>/<stem>.md 及 <ocr|txt>/images
+"""
+import argparse
+import hmac
+import json
+import os
+import secrets
+import socket
+import socketserver
+import subprocess
+import threading
+import traceback
+from pathlib import Path
+from process_utils import new_process_group_kwargs, kill_process_tree
+from env_resolver import env_command, env_environ
+
+# 各转换器所在的conda环境
+CONVERTER_ENVS = {
+    'marker': 'SimpleRAG',
+    'mineru': 'MinerU',
+}
+
+READY_PREFIX = 'CONVERTER_SERVER_READY'
+
+# 传递本次运行的请求令牌的环境变量（不放在命令行参数中，避免被其他用户通过进程列表看到）
+TOKEN_ENV = 'SIMPLERAG_CONVERTER_TOKEN'
+
+
+class MarkerBackend:
+    def __init__(self):
+        from marker.config.parser import ConfigParser
+        from marker.converters.pdf import PdfConverter
+        from marker.models import create_model_dict
+
+        # OCR与文本层两种配置共享同一份模型
+        artifact_dict = create_model_dict()
+        self.converters = {}
+        for force_ocr in (True, False):
+            config_parser = ConfigParser({'output_format': 'markdown', 'force_ocr': force_ocr})
+            self.converters[force_ocr] = PdfConverter(
+                config=config_parser.generate_config_dict(),
+                artifact_dict=artifact_dict,
+                processor_list=config_parser.get_processors(),
+                renderer=config_parser.get_renderer()
+            )
+
+    def convert(self, pdf_file: Path, output_dir: Path, ocr=True):
+        from marker.output import save_output
+
+        out_folder = output_dir / pdf_file.stem
+        out_folder.mkdir(parents=True, exist_ok=True)
+        rendered = self.converters[ocr](str(pdf_file))
+        save_output(rendered, str(out_folder), pdf_file.stem)
+
+
+class MinerUBackend:
+    def __init__(self):
+        from magic_pdf.model.doc_analyze_by_custom_model import ModelSingleton
+
+        # 预先加载模型，magic-pdf内部通过单例复用
+        ModelSingleton().get_model(True, False)
+
+    def convert(self, pdf_file: Path, output_dir: Path, ocr=True):
+        from magic_pdf.data.data_reader_writer import FileBasedDataWriter
+        from magic_pdf.data.dataset import PymuDocDataset
+        from magic_pdf.model.doc_analyze_by_custom_model import doc_analyze
+
+        out_folder = output_dir / pdf_file.stem / ('ocr' if ocr else 'txt')
+        image_dir = out_folder / 'images'
+        image_dir.mkdir(parents=True, exist_ok=True)
+
+        ds = PymuDocDataset(pdf_file.read_bytes())
+        infer_result = ds.apply(doc_analyze, ocr=ocr)
+        image_writer = FileBasedDataWriter(str(image_dir))
+        if ocr:
+            pipe_result = infer_result.pipe_ocr_mode(image_writer)
+        else:
+            pipe_result = infer_result.pipe_txt_mode(image_writer)
+        pipe_result.dump_md(FileBasedDataWriter(str(out_folder)), f"{pdf_file.stem}.md", 'images')
+
+
+BACKENDS = {
+    'marker': MarkerBackend,
+    'mineru': MinerUBackend,
+}
+
+
+class _JobHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return
+        try:
+            request = json.loads(line)
+            if not hmac.compare_digest(str(request.get('token', '')), self.server.token):
+                self._reply({'ok': False, 'error': 'invalid token'})
+                return
+            if request.get('cmd') == 'shutdown':
+                self._reply({'ok': True})
+                threading.Thread(target=self.server.shutdown, daemon=True).start()
+                return
+
+            # 模型不保证线程安全，同一时间只执行一个转换
+            with self.server.model_lock:
+                self._reply({'started': True})
+                self.server.backend.convert(
+                    Path(request['pdf']),
+                    Path(request['output_dir']),
+                    ocr=request.get('ocr', True)
+                )
+            self._reply({'ok': True})
+        except Exception as e:
+            traceback.print_exc()
+            self._reply({'ok': False, 'error': str(e)})
+
+    def _reply(self, response):
+        self.wfile.write((json.dumps(response, ensure_ascii=False) + '\n').encode('utf-8'))
+
+
+class _ConverterTCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def serve(converter: str, host='127.0.0.1', port=0):
+    """
+    加载模型并开始监听，准备就绪后在stdout打印端口号
+
+    请求令牌从环境变量 SIMPLERAG_CONVERTER_TOKEN 读取，没有设置时生成一个并打印出来。
+    """
+    token = os.environ.pop(TOKEN_ENV, None)
+    if not token:
+        token = secrets.token_hex(32)
+        print(f"Request token: {token}", flush=True)
+    backend = BACKENDS[converter]()
+    with _ConverterTCPServer((host, port), _JobHandler) as server:
+        server.token = token
+        server.backend = backend
+        server.model_lock = threading.Lock()
+        print(f"{READY_PREFIX} {server.server_address[1]}", flush=True)
+        server.serve_forever()
+
+
+class ConverterClient:
+    """
+    常驻转换服务的客户端
+
+    负责在对应的conda环境中拉起服务进程，并把转换任务提交给它。
+    可作为上下文管理器使用，退出时关闭服务。
+    """
+
+    def __init__(self, converter: str, host='127.0.0.1', startup_timeout=600):
+        if converter not in CONVERTER_ENVS:
+            raise ValueError(f"Unsupported converter: {converter}")
+        self.converter = converter
+        self.host = host
+        self.startup_timeout = startup_timeout
+        self.port = None
+        self.process = None
+        # 每次(重新)启动服务时递增，避免多个任务同时超时时重复重启
+        self.generation = 0
+        self.restart_lock = threading.Lock()
+        # 本次运行的请求令牌，服务端拒绝没有该令牌的请求
+        self.token = secrets.token_hex(32)
+
+    def start(self):
+        """启动服务进程并等待模型加载完成"""
+        command = env_command(
+            CONVERTER_ENVS[self.converter], 'python', Path(__file__).resolve(),
+            '--converter', self.converter,
+            '--host', self.host
+        )
+        print(f"Starting {self.converter} converter server...")
+        env = env_environ(CONVERTER_ENVS[self.converter])
+        env[TOKEN_ENV] = self.token
+        self.process = subprocess.Popen(
+            command,
+            env=env,
+            stdout=subprocess.PIPE,
+            text=True,
+            encoding='utf-8',
+            **new_process_group_kwargs()
+        )
+        self.port = None
+
+        # 等待服务打印就绪信息，模型加载可能需要较长时间
+        timer = threading.Timer(self.startup_timeout, kill_process_tree, args=(self.process,))
+        timer.start()
+        try:
+            for line in self.process.stdout:
+                if line.startswith(READY_PREFIX):
+                    self.port = int(line.split()[1])
+                    break
+                print(line, end='')
+        finally:
+            timer.cancel()
+
+        if self.port is None:
+            self.process.wait()
+            raise RuntimeError(f"Converter server failed to start (exit code {self.process.returncode})")
+
+        # 继续转发服务端输出，避免管道写满阻塞服务进程
+        threading.Thread(target=self._drain_output, args=(self.process,), daemon=True).start()
+        self.generation += 1
+        print(f"Converter server ready on {self.host}:{self.port}")
+        return self
+
+    def restart(self, generation=None):
+        """
+        重启服务进程，用于转换任务卡死的情况
+
+        Args:
+            generation: 发现问题时服务的代数，服务已经被其他任务重启过时不再重启
+        """
+        with self.restart_lock:
+            if generation is not None and generation != self.generation:
+                return
+            print(f"Restarting {self.converter} converter server...")
+            if self.process is not None:
+                kill_process_tree(self.process)
+                self.process.wait()
+                self.process = None
+            self.start()
+
+    @staticmethod
+    def _drain_output(process):
+        for line in process.stdout:
+            print(line, end='')
+
+    def _request(self, payload: dict, timeout=None, job_timeout=None):
+        """
+        发送请求并读取响应
+
+        Args:
+            timeout: 连接和等待任务开始的超时（秒），None表示不限制
+            job_timeout: 任务开始执行后的超时（秒），None表示不限制
+
+        Returns:
+            tuple: (响应或None, 任务是否已经开始执行)，连接在响应之前被关闭时响应为None
+        """
+        started = False
+        payload = dict(payload, token=self.token)
+        with socket.create_connection((self.host, self.port), timeout=timeout) as conn:
+            conn.sendall((json.dumps(payload, ensure_ascii=False) + '\n').encode('utf-8'))
+            with conn.makefile('r', encoding='utf-8') as reader:
+                while True:
+                    line = reader.readline()
+                    if not line:
+                        return None, started
+                    response = json.loads(line)
+                    if not response.get('started'):
+                        return response, started
+                    # 任务开始执行，从现在开始计算超时
+                    started = True
+                    conn.settimeout(job_timeout)
+
+    def convert(self, pdf_file: Path, output_dir: Path, ocr=True, timeout=None):
+        """
+        提交一个转换任务并等待完成，失败时抛出RuntimeError
+
+        服务同一时间只执行一个任务，timeout从任务开始执行时计算，排队等待的时间不计入。
+        任务执行超过timeout秒没有完成时重启服务（卡住的任务无法单独取消），
+        并抛出 subprocess.TimeoutExpired；排队中的任务因此断开时重新提交给新的服务。
+        """
+        payload = {
+            'pdf': str(Path(pdf_file).resolve()),
+            'output_dir': str(Path(output_dir).resolve()),
+            'ocr': ocr
+        }
+        while True:
+            generation = self.generation
+            if self.process is None or self.process.poll() is not None:
+                self.restart(generation)
+                generation = self.generation
+            try:
+                response, started = self._request(payload, job_timeout=timeout)
+            except socket.timeout:
+                # 只有正在执行的任务会超时，排队等待不设超时
+                self.restart(generation)
+                raise subprocess.TimeoutExpired(f"converter server: {pdf_file}", timeout)
+            except ConnectionError:
+                response, started = None, False
+            if response is not None:
+                break
+            if not started:
+                # 等待可能正在进行的重启完成；服务已被其他超时的任务重启时重新提交
+                with self.restart_lock:
+                    restarted = generation != self.generation
+                if restarted:
+                    continue
+            raise RuntimeError(f"Converter server closed the connection without a response for {pdf_file}")
+        if not response.get('ok'):
+            raise RuntimeError(f"Converter server failed on {pdf_file}: {response.get('error')}")
+
+    def close(self):
+        """关闭服务进程"""
+        if self.process is None:
+            return
+        if self.process.poll() is None:
+            try:
+                self._request({'cmd': 'shutdown'}, timeout=10, job_timeout=10)
+                self.process.wait(timeout=30)
+            except Exception:
+                kill_process_tree(self.process)
+                self.process.wait()
+        self.process = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Long-running PDF to Markdown converter server'
+    )
+    parser.add_argument(
+        '--converter',
+        choices=list(BACKENDS),
+        required=True,
+        help='Converter backend to load'
+    )
+    parser.add_argument(
+        '--host',
+        default='127.0.0.1',
+        help='Address to listen on (default: 127.0.0.1)'
+    )
+    parser.add_argument(
+        '--port',
+        type=int,
+        default=0,
+        help='Port to listen on, 0 picks a free port (default: 0)'
+    )
+    args = parser.parse_args()
+    serve(args.converter, args.host, args.port)
+
+
+if __name__ == '__main__':
+    main()
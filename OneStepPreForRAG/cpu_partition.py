@@ -0,0 +1,123 @@
+import os
+import queue
+from contextlib import contextmanager
+
+# torch/OpenMP/MKL等读取的线程数环境变量
+THREAD_ENV_VARS = (
+    'OMP_NUM_THREADS',
+    'MKL_NUM_THREADS',
+    'OPENBLAS_NUM_THREADS',
+    'NUMEXPR_NUM_THREADS',
+    'VECLIB_MAXIMUM_THREADS',
+)
+
+# 自动选择worker数时每个worker使用的线程数，CPU推理超过这个线程数后收益很小
+DEFAULT_THREADS_PER_WORKER = 4
+
+
+def available_cores():
+    """当前进程可以使用的CPU核心编号"""
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def auto_workers(cores=None):
+    """根据核心数选择并发转换数"""
+    cores = cores if cores is not None else available_cores()
+    return max(1, len(cores) // DEFAULT_THREADS_PER_WORKER)
+
+
+class CorePartition:
+    """
+    把CPU核心划分给并发运行的转换进程
+
+    每个worker占用一组互不重叠的核心（核心不够时才会重叠），
+    转换进程的线程数环境变量设置为这组核心的数量，并绑定到这组核心上，
+    避免每个进程都按全部核心开线程而互相抢占。
+    """
+
+    def __init__(self, workers: int, threads_per_worker=0, cores=None):
+        """
+        Args:
+            workers: 并发转换数
+            threads_per_worker: 每个worker的线程数，0表示平分全部核心
+            cores: 可用的核心编号，默认为当前进程可用的全部核心
+        """
+        self.cores = cores if cores is not None else available_cores()
+        self.workers = max(1, workers)
+        self.threads = threads_per_worker if threads_per_worker > 0 else max(1, len(self.cores) // self.workers)
+        self.slots = queue.Queue()
+        for index in range(self.workers):
+            start = index * self.threads
+            self.slots.put([self.cores[(start + i) % len(self.cores)] for i in range(self.threads)])
+
+    @contextmanager
+    def slot(self):
+        """占用一组核心，退出时归还"""
+        cores = self.slots.get()
+        try:
+            yield cores
+        finally:
+            self.slots.put(cores)
+
+    @staticmethod
+    def env(cores, base=None):
+        """限制线程数的子进程环境变量"""
+        env = dict(base if base is not None else os.environ)
+        for name in THREAD_ENV_VARS:
+            env[name] = str(len(cores))
+        return env
+
+    def describe(self):
+        return f"{self.workers} workers x {self.threads} threads on {len(self.cores)} cores"
+
+
+def candidate_configs(cores=None, max_configs=4):
+    """
+    自动调优时尝试的 (workers, threads_per_worker) 组合
+
+    总是包含默认的 auto_workers 组合，其余组合在默认worker数的基础上交替减半和加倍，
+    worker数限制在 1 到核心数之间，每种组合都用满全部核心。
+    """
+    cores = cores if cores is not None else available_cores()
+    core_count = len(cores)
+    default = auto_workers(cores)
+    worker_counts = [default]
+    factor = 2
+    while len(worker_counts) < max_configs:
+        smaller, larger = default // factor, default * factor
+        if smaller < 1 and larger > core_count:
+            break
+        for workers in (smaller, larger):
+            if 1 <= workers <= core_count and workers not in worker_counts and len(worker_counts) < max_configs:
+                worker_counts.append(workers)
+        factor *= 2
+    return [(workers, max(1, core_count // workers)) for workers in worker_counts]
+
+
+def autotune(measure, configs):
+    """
+    依次测量各组合的吞吐量并选出最快的一个
+
+    Args:
+        measure: measure(workers, threads_per_worker) -> 每秒转换页数，失败时抛出异常
+        configs: 要尝试的 (workers, threads_per_worker) 列表
+
+    Returns:
+        tuple: (最快的组合或None, [{'workers', 'threads', 'pages_per_second'}, ...])
+    """
+    measurements = []
+    best = None
+    best_rate = 0
+    for workers, threads in configs:
+        try:
+            rate = measure(workers, threads)
+        except Exception as e:
+            print(f"Auto-tune: {workers} workers x {threads} threads failed: {e}")
+            continue
+        print(f"Auto-tune: {workers} workers x {threads} threads -> {rate:.2f} pages/sec")
+        measurements.append({'workers': workers, 'threads': threads, 'pages_per_second': round(rate, 3)})
+        if rate > best_rate:
+            best, best_rate = (workers, threads), rate
+    return best, measurements
@@ -0,0 +1,212 @@
+"""
+conda环境解析
+
+`conda run -n <env>` 每次调用都要启动conda本身，会增加数秒的开销。
+这里每次运行只查找一次各环境的安装目录，之后直接执行环境中的可执行文件
+（marker_single、magic-pdf、python等），并补上激活环境时设置的PATH和CONDA_PREFIX。
+找不到环境或可执行文件时退回到 `conda run`。
+
+直接执行不会运行环境的 activate.d 脚本，依赖这些脚本的环境可以设置
+环境变量 SIMPLERAG_USE_CONDA_RUN=1 强制使用 `conda run`。
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+from threading import Lock
+
+# 强制使用 `conda run` 的环境变量
+USE_CONDA_RUN_ENV = 'SIMPLERAG_USE_CONDA_RUN'
+
+_lock = Lock()
+_env_prefixes = {}
+_conda_env_list = None
+
+
+def _candidate_prefixes(env_name: str):
+    """不调用conda，根据当前的conda相关环境变量推测环境目录"""
+    roots = []
+    if os.environ.get('CONDA_EXE'):
+        roots.append(Path(os.environ['CONDA_EXE']).resolve().parent.parent)
+    if os.environ.get('CONDA_PREFIX'):
+        prefix = Path(os.environ['CONDA_PREFIX'])
+        if prefix.name == env_name:
+            yield prefix
+        # 当前处于某个非base环境时，其上两级是conda的根目录
+        roots.append(prefix.parent.parent if prefix.parent.name == 'envs' else prefix)
+    for root in roots:
+        if env_name == 'base':
+            yield root
+        yield root / 'envs' / env_name
+
+
+def _list_conda_envs():
+    """调用一次 `conda env list --json`，结果在本次运行中复用"""
+    global _conda_env_list
+    if _conda_env_list is None:
+        try:
+            completed = subprocess.run(
+                ['conda', 'env', 'list', '--json'],
+                capture_output=True, text=True, timeout=120, check=True
+            )
+            _conda_env_list = [Path(prefix) for prefix in json.loads(completed.stdout).get('envs', [])]
+        except (subprocess.SubprocessError, OSError, ValueError):
+            _conda_env_list = []
+    return _conda_env_list
+
+
+def _bin_dirs(prefix: Path):
+    """环境中可执行文件所在的目录"""
+    if os.name == 'nt':
+        return [prefix, prefix / 'Scripts', prefix / 'Library' / 'bin']
+    return [prefix / 'bin']
+
+
+def env_prefix(env_name: str):
+    """
+    查找conda环境的安装目录，结果会被缓存
+
+    Returns:
+        Path: 环境目录，找不到时返回None
+    """
+    with _lock:
+        if env_name in _env_prefixes:
+            return _env_prefixes[env_name]
+
+        found = None
+        for prefix in _candidate_prefixes(env_name):
+            if (prefix / 'conda-meta').is_dir():
+                found = prefix
+                break
+        if found is None:
+            for prefix in _list_conda_envs():
+                if prefix.name == env_name and (prefix / 'conda-meta').is_dir():
+                    found = prefix
+                    break
+        _env_prefixes[env_name] = found
+        return found
+
+
+def find_executable(env_name: str, tool: str):
+    """查找环境中的可执行文件，找不到时返回None"""
+    if os.environ.get(USE_CONDA_RUN_ENV):
+        return None
+    prefix = env_prefix(env_name)
+    if prefix is None:
+        return None
+    names = [tool]
+    if os.name == 'nt':
+        names = [f"{tool}.exe", f"{tool}-script.py", tool]
+    for directory in _bin_dirs(prefix):
+        for name in names:
+            candidate = directory / name
+            if candidate.is_file():
+                return candidate
+    return None
+
+
+def env_command(env_name: str, tool: str, *args):
+    """
+    构建在conda环境中运行tool的命令
+
+    能找到可执行文件时直接执行，否则使用 `conda run`。
+    找到的是Windows的 .py 入口脚本但环境中没有python时抛出 FileNotFoundError。
+    """
+    executable = find_executable(env_name, tool)
+    if executable is None:
+        return ['conda', 'run', '--no-capture-output', '-n', env_name, tool, *map(str, args)]
+    if executable.suffix == '.py':
+        # Windows上的入口脚本需要用环境中的python运行
+        python = find_executable(env_name, 'python')
+        if python is None:
+            raise FileNotFoundError(
+                f"Cannot run {executable}: no python interpreter found in conda environment "
+                f"'{env_name}' ({env_prefix(env_name)})"
+            )
+        return [str(python), str(executable), *map(str, args)]
+    return [str(executable), *map(str, args)]
+
+
+def env_environ(env_name: str, base=None):
+    """
+    直接执行环境中的程序时使用的环境变量（相当于激活环境）
+
+    退回到 `conda run` 时原样返回base。
+    """
+    env = dict(base if base is not None else os.environ)
+    prefix = env_prefix(env_name) if not os.environ.get(USE_CONDA_RUN_ENV) else None
+    if prefix is None:
+        return env
+    paths = [str(directory) for directory in _bin_dirs(prefix)]
+    env['PATH'] = os.pathsep.join(paths + [env.get('PATH', '')])
+    env['CONDA_PREFIX'] = str(prefix)
+    env['CONDA_DEFAULT_ENV'] = env_name
+    return env
+
+
+def _time_command(command, env=None, runs=3):
+    """多次运行命令，返回平均耗时（秒）"""
+    elapsed = []
+    for _ in range(runs):
+        start = time.monotonic()
+        subprocess.run(command, env=env, capture_output=True, check=True)
+        elapsed.append(time.monotonic() - start)
+    return sum(elapsed) / len(elapsed)
+
+
+def benchmark(env_names, runs=3):
+    """
+    比较 `conda run` 与直接执行的启动时间
+
+    每个环境分别用两种方式运行 `python -c pass`，差值即每次转换调用节省的时间。
+    """
+    results = []
+    for env_name in env_names:
+        executable = find_executable(env_name, 'python')
+        if executable is None:
+            print(f"{env_name}: environment not found, skipped")
+            continue
+        conda_run = _time_command(['conda', 'run', '-n', env_name, 'python', '-c', 'pass'], runs=runs)
+        direct = _time_command([str(executable), '-c', 'pass'], env=env_environ(env_name), runs=runs)
+        results.append({'env': env_name, 'conda_run_seconds': conda_run, 'direct_seconds': direct})
+        print(
+            f"{env_name}: conda run {conda_run:.2f}s, direct {direct:.2f}s, "
+            f"saves {conda_run - direct:.2f}s per document"
+        )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Resolve conda environment executables and benchmark conda run startup overhead'
+    )
+    parser.add_argument(
+        '--env',
+        nargs='+',
+        default=['SimpleRAG', 'MinerU'],
+        help='Environments to resolve (default: SimpleRAG MinerU)'
+    )
+    parser.add_argument(
+        '--benchmark',
+        action='store_true',
+        help='Measure the startup time of conda run versus direct execution'
+    )
+    parser.add_argument(
+        '--runs',
+        type=int,
+        default=3,
+        help='Number of runs per measurement (default: 3)'
+    )
+    args = parser.parse_args()
+
+    for env_name in args.env:
+        print(f"{env_name}: {env_prefix(env_name) or 'not found, falling back to conda run'}")
+    if args.benchmark:
+        benchmark(args.env, args.runs)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,211 @@
+"""
+上传前压缩图片
+
+marker和mineru输出的是原始分辨率的PNG/JPEG截图，很多有数MB，直接上传占用大量上传带宽和CDN流量。
+TranscodingUploader 包装任意上传器，上传前在进程池中：
+    - 把长边超过max_dimension的图片按比例缩小
+    - 重新编码为WebP或JPEG
+    - 结果没有比原图小至少MIN_SAVING时上传原图
+
+压缩后的图片写入临时目录，上传后删除；本地的原图和Markdown中的链接不变，
+上传失败时仍然可以重新处理。远程文件名的扩展名改为新的格式。
+"""
+import importlib.util
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+TRANSCODE_FORMATS = ('webp', 'jpeg')
+
+# 重新编码后至少比原图小这么多（比例）才使用
+MIN_SAVING = 0.1
+
+_EXTENSIONS = {'webp': '.webp', 'jpeg': '.jpg'}
+
+
+class TranscodeOptions:
+    """图片压缩参数"""
+
+    def __init__(self, image_format='webp', max_dimension=2048, quality=80):
+        """
+        Args:
+            image_format: 输出格式，'webp' 或 'jpeg'
+            max_dimension: 图片长边的最大像素数，0表示不缩小
+            quality: 编码质量（1-100）
+        """
+        if image_format not in TRANSCODE_FORMATS:
+            raise ValueError(f"Unsupported image format: {image_format}")
+        if importlib.util.find_spec('PIL') is None:
+            # 在转换开始前报错，而不是在上传时逐个失败
+            raise RuntimeError("Image transcoding requires Pillow: pip install pillow")
+        self.image_format = image_format
+        self.max_dimension = max(0, max_dimension)
+        self.quality = min(100, max(1, quality))
+
+
+def transcode_image(src: str, dst_dir: str, options: TranscodeOptions):
+    """
+    缩小并重新编码一张图片（在进程池中运行）
+
+    Args:
+        src: 原图路径
+        dst_dir: 写入压缩结果的目录
+        options: 压缩参数
+
+    Returns:
+        dict: {'path': 要上传的文件, 'original_bytes', 'bytes', 'transcoded': 是否使用了压缩结果, 'error'}
+    """
+    from PIL import Image, ImageOps
+
+    original_bytes = os.path.getsize(src)
+    result = {'path': src, 'original_bytes': original_bytes, 'bytes': original_bytes, 'transcoded': False, 'error': None}
+    dst = None
+    try:
+        with Image.open(src) as image:
+            if getattr(image, 'n_frames', 1) > 1:
+                # 动图保持原样
+                return result
+            image = ImageOps.exif_transpose(image)
+            has_alpha = image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info
+            if has_alpha and options.image_format == 'jpeg':
+                # JPEG不支持透明，保持原图
+                return result
+            image = image.convert('RGBA' if has_alpha else 'RGB')
+            if options.max_dimension and max(image.size) > options.max_dimension:
+                image.thumbnail((options.max_dimension, options.max_dimension), Image.LANCZOS)
+
+            # PicGO按本地文件名命名远程文件，保留原来的文件名，放在单独的子目录中避免重名
+            dst = Path(dst_dir) / uuid.uuid4().hex / f"{Path(src).stem}{_EXTENSIONS[options.image_format]}"
+            dst.parent.mkdir()
+            if options.image_format == 'webp':
+                image.save(dst, 'WEBP', quality=options.quality, method=4)
+            else:
+                image.save(dst, 'JPEG', quality=options.quality, optimize=True, progressive=True)
+    except Exception as e:
+        # 无法识别的图片（如SVG）按原样上传
+        result['error'] = str(e)
+        if dst is not None:
+            shutil.rmtree(dst.parent, ignore_errors=True)
+        return result
+
+    new_bytes = dst.stat().st_size
+    if new_bytes > original_bytes * (1 - MIN_SAVING):
+        shutil.rmtree(dst.parent, ignore_errors=True)
+        return result
+    result.update(path=str(dst), bytes=new_bytes, transcoded=True)
+    return result
+
+
+class TranscodingUploader:
+    """
+    上传前压缩图片的上传器包装
+
+    与被包装的上传器接口一致：可以直接调用或调用upload_file；
+    被包装的是异步上传引擎时也提供 upload_files，一批图片在进程池中并行压缩后一次提交。
+    """
+
+    def __init__(self, uploader, options: TranscodeOptions, workers=0):
+        """
+        Args:
+            uploader: 被包装的上传器
+            options: 压缩参数
+            workers: 压缩图片的进程数，0表示CPU核心数
+        """
+        self.uploader = uploader
+        self.options = options
+        self._upload = uploader.upload_file if hasattr(uploader, 'upload_file') else uploader
+        if hasattr(uploader, 'upload_files'):
+            self.upload_files = self._upload_files
+        self.temp_dir = tempfile.mkdtemp(prefix='simplerag_transcode_')
+        # 上传引擎的后台线程已经在运行，用spawn创建子进程，避免fork时复制其他线程持有的锁
+        self.executor = ProcessPoolExecutor(
+            max_workers=workers or os.cpu_count() or 1, mp_context=multiprocessing.get_context('spawn')
+        )
+        self.lock = threading.Lock()
+        self.report = {'images': 0, 'transcoded': 0, 'original_bytes': 0, 'bytes': 0, 'errors': 0}
+
+    def _record(self, result):
+        with self.lock:
+            self.report['images'] += 1
+            self.report['transcoded'] += int(result['transcoded'])
+            self.report['original_bytes'] += result['original_bytes']
+            self.report['bytes'] += result['bytes']
+            self.report['errors'] += int(result['error'] is not None)
+
+    @staticmethod
+    def _remote_name(remote_file_path, result):
+        """压缩后远程文件名的扩展名改为新的格式"""
+        if not result['transcoded'] or remote_file_path is None:
+            return remote_file_path
+        return str(Path(remote_file_path).with_suffix(Path(result['path']).suffix)).replace(os.sep, '/')
+
+    @staticmethod
+    def _cleanup(result):
+        if result['transcoded']:
+            shutil.rmtree(Path(result['path']).parent, ignore_errors=True)
+
+    def upload_file(self, local_file_path, remote_file_path=None):
+        """
+        压缩并上传单个文件
+
+        Returns:
+            tuple: (图片地址或错误信息, 是否成功)
+        """
+        result = self.executor.submit(transcode_image, local_file_path, self.temp_dir, self.options).result()
+        self._record(result)
+        try:
+            return self._upload(result['path'], self._remote_name(remote_file_path, result))
+        finally:
+            self._cleanup(result)
+
+    __call__ = upload_file
+
+    def _upload_files(self, tasks, rate_limiter=None):
+        """
+        并行压缩一批文件后一次提交给上传引擎
+
+        Args:
+            tasks: [(本地文件路径, 远程文件名)]
+            rate_limiter: 传给被包装的上传引擎的限流器
+
+        Returns:
+            list: 与tasks顺序一致的 (图片地址或错误信息, 是否成功)
+        """
+        results = list(self.executor.map(
+            transcode_image,
+            [local_file_path for local_file_path, _ in tasks],
+            [self.temp_dir] * len(tasks),
+            [self.options] * len(tasks)
+        ))
+        for result in results:
+            self._record(result)
+        try:
+            return self.uploader.upload_files(
+                [(result['path'], self._remote_name(remote_file_path, result))
+                 for (_, remote_file_path), result in zip(tasks, results)],
+                rate_limiter=rate_limiter
+            )
+        finally:
+            for result in results:
+                self._cleanup(result)
+
+    def stats(self):
+        """被包装的上传器的统计加上压缩统计，用于运行总结"""
+        stats = self.uploader.stats() if hasattr(self.uploader, 'stats') else {}
+        with self.lock:
+            report = dict(self.report)
+        report['bytes_saved'] = report['original_bytes'] - report['bytes']
+        for key, value in report.items():
+            stats[f'transcode_{key}'] = value
+        return stats
+
+    def close(self):
+        if hasattr(self.uploader, 'close'):
+            self.uploader.close()
+        self.executor.shutdown()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
@@ -0,0 +1,88 @@
+import heapq
+import math
+import os
+from pathlib import Path
+from pdf_inspector import get_page_count
+
+# 无法读取页数时按文件大小估算页数
+BYTES_PER_PAGE_ESTIMATE = 100 * 1024
+
+
+def estimate_pages(page_count: int, file_size: int):
+    """估算文档的转换工作量（页数），页数未知时按文件大小估算"""
+    if page_count > 0:
+        return page_count
+    return max(1, math.ceil(file_size / BYTES_PER_PAGE_ESTIMATE))
+
+
+def scan_pdfs(pdf_files):
+    """
+    预扫描PDF的页数和文件大小
+
+    Returns:
+        list: [{'file': Path, 'page_count': 页数(无法解析时为0), 'size': 字节数, 'cost': 估算页数}, ...]
+    """
+    scanned = []
+    for pdf_file in pdf_files:
+        pdf_file = Path(pdf_file)
+        page_count = get_page_count(pdf_file)
+        size = os.path.getsize(pdf_file)
+        scanned.append({
+            'file': pdf_file,
+            'page_count': page_count,
+            'size': size,
+            'cost': estimate_pages(page_count, size)
+        })
+    return scanned
+
+
+def _job_costs(cost: int, shard_pages=0):
+    """单个文档拆分成的转换任务，切分的大文件每个分片是一个任务"""
+    if shard_pages > 0 and cost > shard_pages:
+        full, rest = divmod(cost, shard_pages)
+        return [shard_pages] * full + ([rest] if rest else [])
+    return [cost]
+
+
+def predict_makespan(costs, workers: int):
+    """
+    模拟按给定顺序把任务分配给最先空闲的worker，返回最忙的worker的总工作量
+    """
+    loads = [0] * max(1, workers)
+    for cost in costs:
+        heapq.heapreplace(loads, loads[0] + cost)
+    return max(loads)
+
+
+def plan_schedule(pdf_files, workers: int, shard_pages=0):
+    """
+    按估算工作量从大到小排列PDF（最长任务优先），并预测整批转换的完成时间
+
+    转换时每空出一个worker才提交估算工作量最大的待处理任务（大文件切分出的分片与其他文档一起排序），
+    大任务先开始，小文档填补空闲的worker，避免最后才开始的大文档拖长整批转换时间。
+
+    Args:
+        pdf_files: PDF文件列表
+        workers: 并发转换数
+        shard_pages: 大文件切分的分片页数，0表示不切分
+
+    Returns:
+        dict: {'order': 排序后的PDF列表, 'page_counts': {PDF: 页数}, 'costs': {PDF: 估算页数},
+               'total_pages': 总页数, 'makespan_pages': 预测最忙worker的页数,
+               'glob_makespan_pages': 按原顺序调度时的预测值}
+    """
+    scanned = scan_pdfs(pdf_files)
+    original_costs = [cost for item in scanned for cost in _job_costs(item['cost'], shard_pages)]
+
+    # 页数相同时先处理较大的文件（图片多，通常更慢）
+    scanned.sort(key=lambda item: (item['cost'], item['size']), reverse=True)
+    costs = sorted(original_costs, reverse=True)
+
+    return {
+        'order': [item['file'] for item in scanned],
+        'page_counts': {item['file']: item['page_count'] for item in scanned if item['page_count'] > 0},
+        'costs': {item['file']: item['cost'] for item in scanned},
+        'total_pages': sum(original_costs),
+        'makespan_pages': predict_makespan(costs, workers),
+        'glob_makespan_pages': predict_makespan(original_costs, workers)
+    }
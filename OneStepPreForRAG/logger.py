@@ -4,8 +4,14 @@ from datetime import datetime
 import json
 
 class ProcessLogger:
-    def __init__(self, output_dir):
+    def __init__(self, output_dir, manifest=None):
+        """
+        Args:
+            output_dir: 输出目录，日志写入其中的logs目录
+            manifest: 运行清单(RunManifest)，提供时总结中的文件列表从清单生成，包含之前运行中完成的文档
+        """
         self.output_dir = Path(output_dir)
+        self.manifest = manifest
         self.log_dir = self.output_dir / "logs"
         self.log_dir.mkdir(exist_ok=True)
         
@@ -47,6 +53,7 @@ class ProcessLogger:
     
     def log_step_result(self, step_name, success_files, failed_files, error=None):
         """记录每个步骤的结果"""
+        self.results["steps"].setdefault(step_name, {"status": "pending", "success": [], "failed": []})
         self.results["steps"][step_name]["status"] = "completed" if not failed_files else "failed"
         self.results["steps"][step_name]["success"] = success_files
         self.results["steps"][step_name]["failed"] = failed_files
@@ -62,8 +69,29 @@ class ProcessLogger:
             for f in failed_files:
                 self.logger.warning(f"  - {f}")
     
+    def log_step_stats(self, step_name, stats):
+        """记录步骤的附加统计信息（如缓存命中率）"""
+        self.results["steps"][step_name].setdefault("stats", {}).update(stats)
+        
+        for key, value in stats.items():
+            self.logger.info(f"{step_name} {key}: {value}")
+    
+    def update_from_manifest(self):
+        """根据运行清单重建各步骤的成功/失败文件列表"""
+        for step_name, result in self.results["steps"].items():
+            summary = self.manifest.step_summary(step_name)
+            if not (summary['success'] or summary['failed'] or summary['in_flight']):
+                continue
+            result["success"] = summary['success']
+            # 中断时仍在处理的文档视为失败，下次恢复运行时会重试
+            result["failed"] = summary['failed'] + summary['in_flight']
+            result["status"] = "completed" if not result["failed"] else "failed"
+    
     def finalize(self, overall_status):
         """完成处理并生成总结"""
+        if self.manifest is not None:
+            self.update_from_manifest()
+        
         self.results["end_time"] = datetime.now().isoformat()
         self.results["overall_status"] = overall_status
         
@@ -98,6 +126,11 @@ class ProcessLogger:
                     for file in result['failed']:
                         f.write(f"  - {file}\n")
                 
+                if 'stats' in result:
+                    f.write("\n统计信息:\n")
+                    for key, value in result['stats'].items():
+                        f.write(f"  {key}: {value}\n")
+                
                 if 'error' in result:
                     f.write(f"\n错误信息: {result['error']}\n")
                 
@@ -1,11 +1,44 @@
 import argparse
 from pathlib import Path
 from step1_pdf_to_md import convert_pdf_to_md
-from step2_split_md import split_markdown_files
+from step2_split_md import split_markdown_files, find_document_md_files
+from chunker import ChunkOptions, chunk_markdown_files
 from step3_process_images import process_images
 from logger import ProcessLogger
 from uploaders import UploaderFactory
+from rate_limiter import RateLimiter
+from image_transcode import TranscodeOptions
 from config import ConfigManager
+from pipeline import run_pipeline
+from run_manifest import RunManifest
+
+def chunk_stats(result):
+    """拆分/分块结果中需要记录到日志的统计信息"""
+    stats = {key: result[key] for key in ('chunks', 'chunk_store', 'duplicates', 'dedup_report') if key in result}
+    for key, value in result.get('boilerplate_total', {}).items():
+        stats[f'boilerplate_{key}'] = value
+    return stats
+
+
+def log_upload_stats(uploader, process_logger):
+    """记录上传缓存命中率、图片压缩节省的字节数和异步上传引擎的并发数变化、重试统计"""
+    stats = uploader.stats() if hasattr(uploader, 'stats') else {}
+    if stats:
+        process_logger.log_step_stats('process_images', stats)
+
+
+def export_chunks(output_dir, md_files, chunk_options, workers, process_logger):
+    """在图片处理之后分块并记录结果，返回是否成功"""
+    chunk_result = chunk_markdown_files(output_dir, md_files, chunk_options, workers)
+    process_logger.log_step_result(
+        'chunk_md',
+        chunk_result['success_files'],
+        chunk_result['failed_files'],
+        chunk_result.get('error')
+    )
+    process_logger.log_step_stats('chunk_md', chunk_stats(chunk_result))
+    return chunk_result['success']
+
 
 def main():
     parser = argparse.ArgumentParser(
@@ -81,9 +114,81 @@ def main():
     # 添加QPS限制参数
     parser.add_argument(
         '--qps',
+        type=float,
+        default=0,
+        help='Maximum queries per second for image upload, fractions allowed (e.g. 0.5; 0 for no limit)'
+    )
+    parser.add_argument(
+        '--qps-burst',
+        type=int,
+        default=1,
+        help='Uploads allowed back to back after an idle period before --qps applies (default: 1, evenly spaced)'
+    )
+    parser.add_argument(
+        '--qps-state-file',
+        help='Keep the --qps token bucket in this file so several concurrently running processes share one upload quota'
+    )
+    
+    # 上传引擎参数
+    parser.add_argument(
+        '--upload-engine',
+        choices=['thread', 'async'],
+        default='thread',
+        help='Image upload engine: per-upload connections in threads, or asyncio uploads sharing a keep-alive connection pool (default: thread)'
+    )
+    parser.add_argument(
+        '--upload-concurrency',
+        type=int,
+        default=16,
+        help='In-flight uploads of the async upload engine, shared by all documents; the upper bound with --adaptive-concurrency (default: 16)'
+    )
+    parser.add_argument(
+        '--adaptive-concurrency',
+        action='store_true',
+        help='Let the async upload engine tune its concurrency: grow while latency is healthy, halve on 429/503 or timeouts (requires --upload-engine async)'
+    )
+    parser.add_argument(
+        '--upload-retries',
+        type=int,
+        default=3,
+        help='Retries with jittered exponential backoff per image on 429/5xx, timeouts and connection errors in the async upload engine (default: 3)'
+    )
+    
+    # 上传缓存参数
+    parser.add_argument(
+        '--upload-cache',
+        metavar='DB_FILE',
+        help='SQLite file mapping image content hashes to uploaded URLs; identical images across documents and runs are uploaded once (default: disabled)'
+    )
+    parser.add_argument(
+        '--verify-upload-cache',
+        action='store_true',
+        help='Check with a HEAD request that each cached URL still exists before reusing it, re-uploading stale entries (requires --upload-cache)'
+    )
+    
+    # 图片压缩参数
+    parser.add_argument(
+        '--transcode-images',
+        choices=['webp', 'jpeg'],
+        help='Downscale and re-encode images to this format before upload, keeping the original when it would not shrink (requires Pillow; default: upload as-is)'
+    )
+    parser.add_argument(
+        '--image-max-dimension',
+        type=int,
+        default=2048,
+        help='Longest side in pixels of transcoded images, 0 to keep the size (default: 2048)'
+    )
+    parser.add_argument(
+        '--image-quality',
+        type=int,
+        default=80,
+        help='Encoder quality of transcoded images, 1-100 (default: 80)'
+    )
+    parser.add_argument(
+        '--transcode-workers',
         type=int,
         default=0,
-        help='Maximum queries per second for image upload (0 for no limit)'
+        help='Processes transcoding images (default: 0, one per CPU core)'
     )
     
     # 在参数部分添加新的选项
@@ -101,7 +206,203 @@ def main():
         help='PDF to Markdown converter to use (default: marker)'
     )
     
+    # 并发转换参数
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=1,
+        help='Number of PDFs to convert concurrently, 0 picks it from the CPU core count (default: 1)'
+    )
+    
+    # 批量转换参数
+    parser.add_argument(
+        '--batch-size',
+        type=int,
+        default=1,
+        help='Convert this many PDFs per call to the converter\'s batch entry point (marker / magic-pdf -p <dir>) so models are loaded once per batch (default: 1, one call per PDF)'
+    )
+    
+    # CPU核心划分参数
+    parser.add_argument(
+        '--threads-per-worker',
+        type=int,
+        default=0,
+        help='Threads for each converter process, pinned to its own cores (default: 0, split all cores evenly between workers)'
+    )
+    parser.add_argument(
+        '--cpu-autotune',
+        action='store_true',
+        help='Measure pages/sec of several workers x threads configurations on a sample and use the fastest'
+    )
+    parser.add_argument(
+        '--autotune-pages',
+        type=int,
+        default=4,
+        help='Number of pages of the largest PDF used as the auto-tune sample (default: 4)'
+    )
+    
+    # 常驻转换服务参数
+    parser.add_argument(
+        '--converter-server',
+        action='store_true',
+        help='Load converter models once in a long-running server and submit each PDF to it'
+    )
+    
+    # 转换缓存参数
+    parser.add_argument(
+        '--cache-dir',
+        help='Directory for the content-hash conversion cache (default: disabled)'
+    )
+    parser.add_argument(
+        '--cache-max-gb',
+        type=float,
+        default=20,
+        help='Maximum size of the conversion cache in GB, including the page cache; least recently used entries are evicted (default: 20, 0 for no limit)'
+    )
+    
+    # 页级缓存参数
+    parser.add_argument(
+        '--page-cache',
+        action='store_true',
+        help='Also cache conversion results per page in CACHE_DIR/pages, so revised PDFs only convert new or changed pages; missed pages are converted through the converter server (requires --cache-dir)'
+    )
+    
+    # OCR模式参数
+    parser.add_argument(
+        '--ocr',
+        choices=['force', 'auto'],
+        default='force',
+        help='OCR mode: force always runs OCR, auto samples each PDF and only runs OCR when it has no usable text layer (default: force)'
+    )
+    
+    # 大文件分片参数
+    parser.add_argument(
+        '--shard-pages',
+        type=int,
+        default=0,
+        help='Split PDFs with more than this many pages into shards of this size, convert them in parallel and merge the results (default: 0, no splitting)'
+    )
+    
+    # 内存准入控制参数
+    parser.add_argument(
+        '--memory-budget-gb',
+        type=float,
+        default=0,
+        help='Memory budget in GB for all converter processes, new conversions wait while the projected usage would exceed it (default: 0, no limit)'
+    )
+    parser.add_argument(
+        '--memory-cap-gb',
+        type=float,
+        default=0,
+        help='Hard memory cap in GB for a single converter process, it is killed when exceeded and requeued to run alone with the whole --memory-budget-gb as its cap, or retried in degraded mode when the budget is not larger (default: 0, no limit)'
+    )
+    
+    # 转换超时与重试参数
+    parser.add_argument(
+        '--base-timeout',
+        type=int,
+        default=300,
+        help='Base conversion timeout in seconds for each PDF or shard (default: 300)'
+    )
+    parser.add_argument(
+        '--page-timeout',
+        type=int,
+        default=60,
+        help='Additional conversion timeout in seconds per page, hung conversions are killed (default: 60, 0 for no timeout)'
+    )
+    parser.add_argument(
+        '--retries',
+        type=int,
+        default=1,
+        help='Number of retries in degraded mode (lower DPI / no table recognition) after a conversion fails or times out (default: 1)'
+    )
+    
+    # 页眉页脚去除参数
+    parser.add_argument(
+        '--strip-boilerplate',
+        type=int,
+        default=0,
+        metavar='MIN_REPEATS',
+        help='Before splitting, remove standalone short lines (running headers, footers, page numbers) repeated at least MIN_REPEATS times across a document; savings are written to output_dir/boilerplate_report.json (default: 0, disabled)'
+    )
+    
+    # 流水线模式参数
+    parser.add_argument(
+        '--pipeline',
+        action='store_true',
+        help='Split and upload each document as soon as it is converted instead of waiting for the whole batch'
+    )
+    parser.add_argument(
+        '--split-workers',
+        type=int,
+        default=0,
+        help='Number of processes splitting Markdown files in step 2, or documents split concurrently in pipeline mode (default: 0, one per CPU core in step 2 and 1 in pipeline mode)'
+    )
+    parser.add_argument(
+        '--upload-workers',
+        type=int,
+        default=2,
+        help='Number of documents whose images are uploaded concurrently in pipeline mode (default: 2)'
+    )
+    parser.add_argument(
+        '--queue-size',
+        type=int,
+        default=8,
+        help='Capacity of the queue between pipeline stages (default: 8)'
+    )
+    
+    # 分块导出参数
+    parser.add_argument(
+        '--chunk',
+        choices=['jsonl', 'parquet'],
+        help='Chunk the split Markdown by token budget and write output_dir/chunks.jsonl or chunks.parquet for the RAG index (parquet requires pyarrow)'
+    )
+    parser.add_argument(
+        '--chunk-max-tokens',
+        type=int,
+        default=512,
+        help='Maximum size of a chunk (default: 512)'
+    )
+    parser.add_argument(
+        '--chunk-overlap',
+        type=int,
+        default=64,
+        help='Maximum overlap between consecutive chunks of the same section (default: 64)'
+    )
+    parser.add_argument(
+        '--chunk-unit',
+        choices=['tokens', 'chars'],
+        default='tokens',
+        help='Unit of --chunk-max-tokens and --chunk-overlap; tokens are counted with tiktoken when installed, otherwise estimated (default: tokens)'
+    )
+    parser.add_argument(
+        '--dedup',
+        choices=['link', 'drop'],
+        help='Find near-duplicate chunks across the chunk store with MinHash/LSH and mark them (link) or remove them (drop); the mapping is written to output_dir/chunks_dedup.json'
+    )
+    parser.add_argument(
+        '--dedup-threshold',
+        type=float,
+        default=0.85,
+        help='Estimated Jaccard similarity above which chunks are near-duplicates (default: 0.85)'
+    )
+    
+    # 恢复运行参数
+    parser.add_argument(
+        '--resume',
+        action='store_true',
+        help='Skip documents and steps recorded as completed in output_dir/logs/manifest.jsonl and retry only failed or interrupted ones'
+    )
+    
     args = parser.parse_args()
+    if args.page_cache and not args.cache_dir:
+        parser.error('--page-cache requires --cache-dir')
+    if args.dedup and not args.chunk:
+        parser.error('--dedup requires --chunk')
+    if args.verify_upload_cache and not args.upload_cache:
+        parser.error('--verify-upload-cache requires --upload-cache')
+    if args.adaptive_concurrency and args.upload_engine != 'async':
+        parser.error('--adaptive-concurrency requires --upload-engine async')
     
     # 如果请求创建配置模板
     if args.create_config:
@@ -112,15 +413,18 @@ def main():
     output_path = Path(args.output_dir)
     output_path.mkdir(parents=True, exist_ok=True)
     
+    # 运行清单，记录每个文档在每个步骤中的状态
+    manifest = RunManifest(output_path / 'logs' / 'manifest.jsonl')
+    
     # 初始化日志记录器
-    process_logger = ProcessLogger(args.output_dir)
+    process_logger = ProcessLogger(args.output_dir, manifest if args.resume else None)
     
+    # 创建上传器（仅在需要时）
+    uploader = None
     try:
         # 加载配置
         config_manager = ConfigManager(args.config)
         
-        # 创建上传器（仅在需要时）
-        uploader = None
         if args.steps is None or 3 in args.steps or args.process_each:
             uploader_params = {}
             if args.uploader == 'picgo':
@@ -142,21 +446,118 @@ def main():
                 if not all(uploader_params.values()):
                     raise ValueError("Missing required OSS parameters in both command line and config file")
             
-            uploader = UploaderFactory.create_uploader(args.uploader, **uploader_params)
+            uploader = UploaderFactory.create_uploader(
+                args.uploader, engine=args.upload_engine, concurrency=args.upload_concurrency,
+                adaptive=args.adaptive_concurrency, retries=args.upload_retries,
+                cache_path=args.upload_cache, verify_cache=args.verify_upload_cache,
+                transcode=TranscodeOptions(
+                    args.transcode_images, args.image_max_dimension, args.image_quality
+                ) if args.transcode_images else None,
+                transcode_workers=args.transcode_workers, **uploader_params
+            )
+        
+        # 上传限流器，所有步骤和文档共享
+        rate_limiter = RateLimiter(args.qps, args.qps_burst, args.qps_state_file) if args.qps > 0 else None
         
         # 确定要运行的步骤
         steps_to_run = args.steps if args.steps else [1, 2, 3]
         
+        # 步骤1的转换参数
+        convert_kwargs = dict(
+            converter=args.converter,
+            workers=args.workers,
+            use_server=args.converter_server,
+            cache_dir=args.cache_dir,
+            cache_max_bytes=int(args.cache_max_gb * 1024 ** 3),
+            ocr_mode=args.ocr,
+            shard_pages=args.shard_pages,
+            base_timeout=args.base_timeout,
+            page_timeout=args.page_timeout,
+            retries=args.retries,
+            threads_per_worker=args.threads_per_worker,
+            cpu_autotune=args.cpu_autotune,
+            autotune_pages=args.autotune_pages,
+            memory_budget_bytes=int(args.memory_budget_gb * 1024 ** 3),
+            memory_cap_bytes=int(args.memory_cap_gb * 1024 ** 3),
+            page_cache=args.page_cache,
+            batch_size=args.batch_size
+        )
+        if args.process_each:
+            convert_kwargs['strip_min_repeats'] = args.strip_boilerplate
+        
+        # 分块导出：步骤3会改写图片链接，运行步骤3时在其之后分块，否则随步骤2一起分块
+        chunk_options = None
+        if args.chunk:
+            chunk_options = ChunkOptions(
+                args.chunk_max_tokens, args.chunk_overlap, args.chunk_unit, args.chunk,
+                dedup_mode=args.dedup, dedup_threshold=args.dedup_threshold
+            )
+        
+        # 流水线模式：转换、拆分、上传同时进行
+        if args.pipeline and 1 in steps_to_run and not args.process_each:
+            pipeline_results = run_pipeline(
+                args.input_dir,
+                args.output_dir,
+                steps_to_run,
+                uploader=uploader,
+                qps=args.qps,
+                rate_limiter=rate_limiter,
+                split_workers=args.split_workers,
+                upload_workers=args.upload_workers,
+                queue_size=args.queue_size,
+                manifest=manifest,
+                resume=args.resume,
+                strip_min_repeats=args.strip_boilerplate,
+                **convert_kwargs
+            )
+            failed_step = None
+            for step_name in ('pdf_to_md', 'split_md', 'process_images'):
+                if step_name not in pipeline_results:
+                    continue
+                step_result = pipeline_results[step_name]
+                process_logger.log_step_result(
+                    step_name,
+                    step_result['success_files'],
+                    step_result['failed_files'],
+                    step_result.get('error')
+                )
+                if step_result.get('stats'):
+                    process_logger.log_step_stats(step_name, step_result['stats'])
+                if not step_result['success'] and failed_step is None:
+                    failed_step = step_name
+            if 'process_images' in pipeline_results:
+                log_upload_stats(uploader, process_logger)
+            
+            # 流水线中各文档的图片处理完成后再分块
+            if chunk_options is not None and 'split_md' in pipeline_results and failed_step is None:
+                if not export_chunks(
+                    args.output_dir, pipeline_results['split_md']['success_files'],
+                    chunk_options, args.split_workers, process_logger
+                ):
+                    failed_step = 'chunk_md'
+            
+            if failed_step:
+                process_logger.finalize(f'failed at step {failed_step}')
+            else:
+                process_logger.finalize('completed with pipelined processing')
+            return
+        
+        # 本次运行中转换的文档，后续步骤只处理这些文档
+        converted_md_files = None
+        
         if 1 in steps_to_run:
             # 执行步骤1：PDF转MD
             step1_result = convert_pdf_to_md(
                 args.input_dir, 
                 args.output_dir,
-                converter=args.converter,
                 process_each=args.process_each,
                 uploader=uploader if args.process_each else None,
                 qps=args.qps if args.process_each else 0,
-                steps_to_run=steps_to_run
+                rate_limiter=rate_limiter if args.process_each else None,
+                steps_to_run=steps_to_run,
+                manifest=manifest,
+                resume=args.resume,
+                **convert_kwargs
             )
             process_logger.log_step_result(
                 'pdf_to_md',
@@ -164,40 +565,72 @@ def main():
                 step1_result['failed_files'],
                 step1_result.get('error')
             )
+            if step1_result.get('stats'):
+                process_logger.log_step_stats('pdf_to_md', step1_result['stats'])
             if not step1_result['success']:
                 process_logger.finalize('failed at step 1')
                 return
+            converted_md_files = [
+                output_path / Path(pdf_file).stem / f"{Path(pdf_file).stem}.md"
+                for pdf_file in step1_result['success_files']
+            ]
             
             # 如果启用了即时处理，跳过后续的批量处理步骤
             if args.process_each:
+                if 3 in steps_to_run:
+                    log_upload_stats(uploader, process_logger)
+                if chunk_options is not None and 2 in steps_to_run and not export_chunks(
+                    args.output_dir, converted_md_files, chunk_options, args.split_workers, process_logger
+                ):
+                    process_logger.finalize('failed at chunk export')
+                    return
                 process_logger.finalize('completed with individual processing')
                 return
         
         if 2 in steps_to_run:
             # 执行步骤2：拆分MD文件
-            step2_result = split_markdown_files(args.output_dir)
+            step2_result = split_markdown_files(
+                args.output_dir, manifest, args.resume,
+                md_files=converted_md_files,
+                workers=args.split_workers,
+                chunk_options=chunk_options if 3 not in steps_to_run else None,
+                strip_min_repeats=args.strip_boilerplate
+            )
             process_logger.log_step_result(
                 'split_md',
                 step2_result['success_files'],
                 step2_result['failed_files'],
                 step2_result.get('error')
             )
+            if chunk_stats(step2_result):
+                process_logger.log_step_stats('split_md', chunk_stats(step2_result))
             if not step2_result['success']:
                 process_logger.finalize('failed at step 2')
                 return
         
         if 3 in steps_to_run:
             # 执行步骤3：处理图片
-            step3_result = process_images(args.output_dir, uploader, args.qps)
+            step3_result = process_images(
+                args.output_dir, uploader, args.qps, rate_limiter=rate_limiter, manifest=manifest, resume=args.resume
+            )
             process_logger.log_step_result(
                 'process_images',
                 step3_result['success_files'],
                 step3_result['failed_files'],
                 step3_result.get('error')
             )
+            log_upload_stats(uploader, process_logger)
             if not step3_result['success']:
                 process_logger.finalize('failed at step 3')
                 return
+            
+            if chunk_options is not None and not export_chunks(
+                args.output_dir,
+                converted_md_files if converted_md_files is not None else find_document_md_files(args.output_dir),
+                chunk_options, args.split_workers, process_logger
+            ):
+                process_logger.finalize('failed at chunk export')
+                return
         
         # 完成处理
         steps_str = ', '.join(map(str, steps_to_run))
@@ -210,6 +643,10 @@ def main():
     except Exception as e:
         process_logger.finalize(f'failed with error: {str(e)}')
         print(f"Error: {e}")
+    finally:
+        if hasattr(uploader, 'close'):
+            uploader.close()
+        manifest.close()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,232 @@
+"""
+按固定大小窗口流式处理Markdown
+
+OCR大部头书籍得到的Markdown可能有数百MB（内联base64图片、超长表格），
+这里的函数每次只读取固定大小的窗口，峰值内存与文件大小无关：
+    - iter_pieces：按行读取，但超长的行分成不超过窗口大小的片段
+    - scan_matches：在窗口中用正则查找图片链接，窗口之间保留一段重叠，
+      跨越窗口边界的链接不会被漏掉；超过MAX_MATCH_CHARS的匹配（如内联base64图片）不处理
+    - replace_image_links：边扫描边写出替换后的内容
+
+`python md_stream.py --benchmark` 生成不同大小的Markdown，比较流式处理和整体读入的峰值内存。
+"""
+import argparse
+import base64
+import importlib.util
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+# 第2步在每个段落前插入的分隔符（与pdfdeal的auto_split_md默认值相同）
+SPLIT_STR = "=+=+=+=+=+=+=+=+="
+
+# 每次读取的字符数
+WINDOW_CHARS = 1 << 20
+
+# 单个图片链接的最大长度，窗口之间保留这么多字符的重叠
+MAX_MATCH_CHARS = 64 * 1024
+
+# 与pdfdeal的get_imgcdnlink_list相同的图片链接格式，按其优先级排列
+IMAGE_PATTERN = re.compile(
+    r'<img\s+src="(?P<html1>[^"]+)"\s+alt="[^"]*">'
+    r'|<img\s+style="[^"]*"\s+src="(?P<html2>[^"]+)"\s*/>'
+    r'|<img\s+src="(?P<html3>[^"]+)"\s*/>'
+    r'|!\[[^\]]*\]\(<(?P<angle>[^>]+)>\)'
+    r'|!\[[^\]]*\]\((?P<plain>[^)]+)\)'
+)
+
+
+def image_src(match):
+    """图片链接中的地址"""
+    return next(value for value in match.groupdict().values() if value is not None)
+
+
+def iter_pieces(f, window=WINDOW_CHARS):
+    """
+    逐行读取文本文件，超过window的行分成多个片段
+
+    Yields:
+        tuple: (片段, 是否位于行首)
+    """
+    at_line_start = True
+    while True:
+        piece = f.readline(window)
+        if not piece:
+            return
+        yield piece, at_line_start
+        at_line_start = piece.endswith('\n')
+
+
+def scan_matches(f, pattern=IMAGE_PATTERN, window=WINDOW_CHARS, max_match=MAX_MATCH_CHARS):
+    """
+    在固定大小的窗口中查找正则匹配
+
+    缓冲区最多为 window + max_match 个字符。窗口末尾max_match个字符内开始的匹配
+    留到读入下一个窗口后再判断，因此长度不超过max_match的匹配都能找到。
+
+    Yields:
+        tuple: (上一个匹配之后、本匹配之前的文本, 匹配对象)，最后一段文本的匹配对象为None
+    """
+    buffer = ''
+    eof = False
+    while not eof:
+        chunk = f.read(window)
+        eof = not chunk
+        buffer += chunk
+        limit = len(buffer) if eof else max(0, len(buffer) - max_match)
+        position = 0
+        for match in pattern.finditer(buffer):
+            if match.start() >= limit:
+                break
+            yield buffer[position:match.start()], match
+            position = match.end()
+        keep = max(position, limit)
+        if keep > position:
+            yield buffer[position:keep], None
+        buffer = buffer[keep:]
+
+
+def scan_image_links(md_file):
+    """
+    流式查找Markdown文件中的图片链接
+
+    Returns:
+        tuple: (原始链接文本列表, 图片地址列表)，按首次出现的顺序去重
+    """
+    links = {}
+    with open(md_file, 'r', encoding='utf-8') as f:
+        for _, match in scan_matches(f):
+            if match is not None and match.group(0) not in links:
+                links[match.group(0)] = image_src(match)
+    return list(links.keys()), list(links.values())
+
+
+def replace_image_links(md_file, out, replacements):
+    """
+    流式复制Markdown文件，把图片链接替换为replacements中对应的文本
+
+    Args:
+        md_file: 源Markdown文件
+        out: 写入的文本文件对象
+        replacements: {原始链接文本: 替换文本}，不在其中的链接保持不变
+    """
+    with open(md_file, 'r', encoding='utf-8') as f:
+        for text, match in scan_matches(f):
+            out.write(text)
+            if match is not None:
+                out.write(replacements.get(match.group(0), match.group(0)))
+
+
+def _make_sample(path: Path, size_mb: int, image_dir: Path):
+    """生成包含标题、段落、长表格、本地图片和内联base64图片的Markdown"""
+    image = image_dir / 'sample.png'
+    image.write_bytes(b'\x89PNG\r\n\x1a\n' + os.urandom(256))
+    inline = 'data:image/png;base64,' + base64.b64encode(os.urandom(768 * 1024)).decode()
+    paragraph = 'Lorem ipsum dolor sit amet, consectetur adipiscing elit. ' * 20 + '\n\n'
+    table = '| a | b | c |\n|---|---|---|\n' + ''.join(f'| {i} | {i * 2} | {"x" * 40} |\n' for i in range(2000)) + '\n'
+    target = size_mb * 1024 ** 2
+    written = 0
+    section = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        while written < target:
+            block = (
+                f'# Chapter {section}\n\n{paragraph}'
+                f'![](images/{image.name})\n\n{table}'
+                f'## Figure {section}\n\n![]({inline})\n\n{paragraph}'
+            )
+            f.write(block)
+            written += len(block)
+            section += 1
+
+
+_MEASURE = """
+import resource, shutil, sys, tempfile
+sys.path.insert(0, {here!r})
+mode, md_file = sys.argv[1], sys.argv[2]
+if mode == 'stream':
+    from step2_split_md import split_markdown_file
+    from step3_process_images import process_document_images
+    split_markdown_file(md_file)
+    process_document_images(md_file, lambda path, name: ('https://example.com/' + name, True))
+else:
+    with open(md_file, 'r', encoding='utf-8') as f:
+        content = f.read()
+print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+
+def benchmark(sizes_mb, work_dir=None):
+    """
+    对不同大小的Markdown分别测量峰值内存
+
+    stream 为流式拆分 + 图片替换，whole_file 为把整个文件读入内存（旧的处理方式至少需要这么多）。
+    每次测量在单独的子进程中进行，读取其 ru_maxrss。
+    """
+    # 测量在子进程中进行，这里只确认平台支持resource模块
+    if importlib.util.find_spec('resource') is None:
+        print("Benchmark requires the resource module (Linux/macOS)")
+        return []
+
+    here = str(Path(__file__).resolve().parent)
+    # macOS的ru_maxrss单位是字节，Linux是KB
+    unit = 1 if sys.platform == 'darwin' else 1024
+    results = []
+    root = Path(tempfile.mkdtemp(prefix='md_stream_bench_', dir=work_dir))
+    try:
+        for size_mb in sizes_mb:
+            doc_dir = root / f'doc{size_mb}'
+            (doc_dir / 'images').mkdir(parents=True)
+            md_file = doc_dir / f'doc{size_mb}.md'
+            _make_sample(md_file, size_mb, doc_dir / 'images')
+            row = {'size_mb': size_mb}
+            for mode in ('whole_file', 'stream'):
+                completed = subprocess.run(
+                    [sys.executable, '-c', _MEASURE.format(here=here), mode, str(md_file)],
+                    capture_output=True, text=True, check=True
+                )
+                row[f'{mode}_peak_mb'] = round(int(completed.stdout.split()[-1]) * unit / 1024 ** 2, 1)
+            results.append(row)
+            print(
+                f"{size_mb} MB: whole file {row['whole_file_peak_mb']} MB peak RSS, "
+                f"streaming split + image replace {row['stream_peak_mb']} MB peak RSS"
+            )
+            shutil.rmtree(doc_dir)
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the peak memory of streaming Markdown splitting and image replacement'
+    )
+    parser.add_argument(
+        '--benchmark',
+        action='store_true',
+        help='Generate Markdown files of increasing size and measure peak RSS'
+    )
+    parser.add_argument(
+        '--sizes-mb',
+        type=int,
+        nargs='+',
+        default=[16, 64, 256],
+        help='Sizes of the generated Markdown files in MB (default: 16 64 256)'
+    )
+    parser.add_argument(
+        '--work-dir',
+        help='Directory for the generated files (default: system temp directory)'
+    )
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.sizes_mb, args.work_dir)
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
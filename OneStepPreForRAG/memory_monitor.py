@@ -0,0 +1,237 @@
+import os
+import threading
+from contextlib import contextmanager
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+GB = 1024 ** 3
+
+# 没有历史数据时的内存估算：模型占用 + 每页占用
+DEFAULT_BASE_BYTES = 2 * GB
+DEFAULT_BYTES_PER_PAGE = 50 * 1024 ** 2
+
+# 参与估算的最近转换记录数
+HISTORY_SIZE = 50
+
+
+class MemoryCapExceeded(RuntimeError):
+    """转换进程的内存占用超过硬上限，进程已被结束"""
+
+
+def _proc_children():
+    """读取/proc，返回 {父进程: [子进程]}"""
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat', 'rb') as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # 进程名可能包含空格和括号，从最后一个右括号之后解析
+        fields = stat[stat.rfind(b')') + 2:].split()
+        children.setdefault(int(fields[1]), []).append(int(entry))
+    return children
+
+
+def _proc_rss(pid):
+    try:
+        with open(f'/proc/{pid}/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def process_tree_rss(pid):
+    """
+    进程及其所有子进程的常驻内存(RSS)之和（字节）
+
+    优先使用psutil，没有安装时读取/proc；都不可用时返回None。
+    """
+    if psutil is not None:
+        try:
+            process = psutil.Process(pid)
+            processes = [process] + process.children(recursive=True)
+        except psutil.Error:
+            return 0
+        total = 0
+        for item in processes:
+            try:
+                total += item.memory_info().rss
+            except psutil.Error:
+                continue
+        return total
+
+    if not os.path.isdir('/proc'):
+        return None
+    children = _proc_children()
+    total = 0
+    stack = [pid]
+    while stack:
+        current = stack.pop()
+        total += _proc_rss(current)
+        stack.extend(children.get(current, []))
+    return total
+
+
+class MemoryWatch:
+    """单个转换进程的内存采样，由 run_command 在等待进程时定期调用"""
+
+    def __init__(self, hard_cap_bytes=0, interval=1.0):
+        self.hard_cap_bytes = hard_cap_bytes
+        self.interval = interval
+        self.peak_bytes = 0
+        self.available = True
+
+    def check(self, process):
+        """采样一次，超过硬上限时抛出 MemoryCapExceeded（由调用方结束进程）"""
+        rss = process_tree_rss(process.pid)
+        if rss is None:
+            self.available = False
+            return
+        self.peak_bytes = max(self.peak_bytes, rss)
+        if self.hard_cap_bytes > 0 and rss > self.hard_cap_bytes:
+            raise MemoryCapExceeded(
+                f"Converter used {rss / GB:.1f} GB, above the hard cap of {self.hard_cap_bytes / GB:.1f} GB"
+            )
+
+
+class MemoryGovernor:
+    """
+    按内存预算控制同时运行的转换任务
+
+    每个任务开始前按页数估算峰值内存（模型占用 + 每页占用），
+    已运行任务的估算值加上新任务超过预算时，新任务等待其他任务结束。
+    估算参数根据已完成任务实测的峰值RSS拟合。
+    没有其他任务在运行时总是放行，避免单个大文档永远无法开始。
+    超过硬上限的任务可以单独重新运行一次，此时以整个预算作为硬上限；
+    有任务等待单独运行时不再放行新任务，避免它一直等不到其他任务全部结束。
+    """
+
+    def __init__(self, budget_bytes=0, hard_cap_bytes=0, interval=1.0):
+        """
+        Args:
+            budget_bytes: 所有转换进程的内存预算，0表示不限制
+            hard_cap_bytes: 单个转换进程的内存硬上限，超过时结束进程，0表示不限制
+            interval: 内存采样间隔（秒）
+        """
+        self.budget_bytes = budget_bytes
+        self.hard_cap_bytes = hard_cap_bytes
+        self.interval = interval
+        self.condition = threading.Condition()
+        self.reserved_bytes = 0
+        self.running = 0
+        # 等待单独运行的任务数
+        self.exclusive_waiting = 0
+        # [(页数, 峰值RSS), ...]
+        self.history = []
+        self.stats = {'held_back': 0, 'killed': 0, 'peak_rss_bytes': 0}
+        self.warned = False
+
+    def _model(self):
+        """根据历史记录拟合 峰值 = base + per_page * 页数"""
+        if not self.history:
+            return DEFAULT_BASE_BYTES, DEFAULT_BYTES_PER_PAGE
+        pages = [item[0] for item in self.history]
+        peaks = [item[1] for item in self.history]
+        if len(set(pages)) < 2:
+            # 页数都相同时无法区分模型占用和每页占用，只修正每页占用
+            base = min(DEFAULT_BASE_BYTES, min(peaks))
+            return base, max(0, (max(peaks) - base) / max(1, pages[0]))
+        mean_pages = sum(pages) / len(pages)
+        mean_peak = sum(peaks) / len(peaks)
+        covariance = sum((p - mean_pages) * (m - mean_peak) for p, m in zip(pages, peaks))
+        variance = sum((p - mean_pages) ** 2 for p in pages)
+        per_page = max(0, covariance / variance)
+        # 取各记录的最大残差作为模型占用，估算偏保守
+        base = max(m - per_page * p for p, m in zip(pages, peaks))
+        return max(0, base), per_page
+
+    def can_run_alone(self):
+        """
+        超过硬上限的任务单独重新运行是否有意义
+
+        单独运行时的硬上限是整个内存预算，预算不大于单进程硬上限时重跑只会再次被结束。
+        """
+        return self.budget_bytes > self.hard_cap_bytes > 0
+
+    def estimate(self, pages: int):
+        """估算转换pages页所需的峰值内存（字节）"""
+        with self.condition:
+            base, per_page = self._model()
+        return int(base + per_page * max(1, pages))
+
+    @contextmanager
+    def admit(self, pages: int, exclusive=False):
+        """
+        等待内存预算允许后开始一个转换任务
+
+        Args:
+            pages: 任务页数
+            exclusive: 为True时等待所有其他任务结束后单独运行（用于超过硬上限后的重新排队），
+                       运行期间占用整个预算，硬上限提高到整个预算
+
+        Yields:
+            MemoryWatch: 传给 run_command 的内存采样对象
+        """
+        estimate = self.estimate(pages)
+        hard_cap_bytes = self.hard_cap_bytes
+        if exclusive:
+            estimate = max(estimate, self.budget_bytes)
+            hard_cap_bytes = max(hard_cap_bytes, self.budget_bytes)
+        with self.condition:
+            held_back = False
+            if exclusive:
+                self.exclusive_waiting += 1
+                try:
+                    while self.running > 0:
+                        held_back = True
+                        self.condition.wait()
+                finally:
+                    self.exclusive_waiting -= 1
+            else:
+                while self.exclusive_waiting > 0 or (self.running > 0 and (
+                    self.budget_bytes > 0 and self.reserved_bytes + estimate > self.budget_bytes
+                )):
+                    held_back = True
+                    self.condition.wait()
+            if held_back:
+                self.stats['held_back'] += 1
+            self.running += 1
+            self.reserved_bytes += estimate
+
+        watch = MemoryWatch(hard_cap_bytes, self.interval)
+        succeeded = False
+        try:
+            yield watch
+            succeeded = True
+        except MemoryCapExceeded:
+            with self.condition:
+                self.stats['killed'] += 1
+            raise
+        finally:
+            if not watch.available and not self.warned:
+                self.warned = True
+                print("Warning: cannot sample converter memory on this platform, install psutil to enable it")
+            with self.condition:
+                self.running -= 1
+                self.reserved_bytes -= estimate
+                self.stats['peak_rss_bytes'] = max(self.stats['peak_rss_bytes'], watch.peak_bytes)
+                if succeeded and watch.peak_bytes > 0:
+                    self.history = (self.history + [(max(1, pages), watch.peak_bytes)])[-HISTORY_SIZE:]
+                self.condition.notify_all()
+
+    def report(self):
+        with self.condition:
+            base, per_page = self._model()
+            return {
+                'budget_bytes': self.budget_bytes,
+                'hard_cap_bytes': self.hard_cap_bytes,
+                'estimated_base_bytes': int(base),
+                'estimated_bytes_per_page': int(per_page),
+                **self.stats
+            }
@@ -0,0 +1,66 @@
+from pathlib import Path
+from PyPDF2 import PdfReader
+
+# 一页至少包含这么多可提取字符才认为该页有文本层
+MIN_TEXT_CHARS = 50
+
+
+def _sample_indices(page_count: int, sample_pages: int):
+    """在文档中均匀选取要采样的页码"""
+    if sample_pages <= 0 or sample_pages >= page_count:
+        return list(range(page_count))
+    step = page_count / sample_pages
+    return sorted({int(i * step) for i in range(sample_pages)})
+
+
+def get_page_count(pdf_file):
+    """读取PDF页数，无法解析时返回0"""
+    try:
+        with open(pdf_file, 'rb') as f:
+            return len(PdfReader(f).pages)
+    except Exception:
+        return 0
+
+
+def detect_text_layer(pdf_file, sample_pages=8, min_chars=MIN_TEXT_CHARS):
+    """
+    抽样检查PDF各页是否带有可用的文本层
+
+    Args:
+        pdf_file: PDF文件路径
+        sample_pages: 采样页数，0表示检查全部页面
+        min_chars: 一页至少包含的字符数
+
+    Returns:
+        dict: {'page_count': 总页数, 'sampled': 采样页码, 'text_pages': 有文本层的采样页码}
+    """
+    info = {'page_count': 0, 'sampled': [], 'text_pages': []}
+    try:
+        with open(pdf_file, 'rb') as f:
+            reader = PdfReader(f)
+            info['page_count'] = len(reader.pages)
+            info['sampled'] = _sample_indices(info['page_count'], sample_pages)
+            for index in info['sampled']:
+                try:
+                    text = reader.pages[index].extract_text() or ''
+                except Exception:
+                    text = ''
+                if len(''.join(text.split())) >= min_chars:
+                    info['text_pages'].append(index)
+    except Exception:
+        # 无法解析的文件交给OCR处理
+        pass
+    return info
+
+
+def needs_ocr(pdf_file, sample_pages=8, min_text_ratio=0.8):
+    """
+    判断PDF是否需要OCR
+
+    采样页面中有文本层的比例不低于min_text_ratio时认为是原生数字PDF，
+    可以直接使用文本层；否则（扫描件或混合文档）走OCR。
+    """
+    info = detect_text_layer(Path(pdf_file), sample_pages)
+    if not info['sampled']:
+        return True
+    return len(info['text_pages']) / len(info['sampled']) < min_text_ratio
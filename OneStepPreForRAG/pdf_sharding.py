@@ -0,0 +1,208 @@
+import hashlib
+import os
+import re
+import shutil
+from pathlib import Path
+from PyPDF2 import PdfReader, PdfWriter
+from PyPDF2.generic import ArrayObject, DictionaryObject, IndirectObject, StreamObject
+
+SHARD_SUFFIX = '__part'
+
+
+def shard_name(stem: str, index: int):
+    """分片文件名，序号补零以保证按名称排序即按页码排序"""
+    return f"{stem}{SHARD_SUFFIX}{index:04d}"
+
+
+def split_pdf(pdf_file, shard_dir, shard_pages: int):
+    """
+    将PDF按页码范围切分为多个分片
+
+    Args:
+        pdf_file: PDF文件路径
+        shard_dir: 分片输出目录
+        shard_pages: 每个分片的页数
+
+    Returns:
+        list: 按页码顺序排列的分片PDF路径
+    """
+    pdf_file = Path(pdf_file)
+    shard_dir = Path(shard_dir)
+    shard_dir.mkdir(parents=True, exist_ok=True)
+
+    shards = []
+    with open(pdf_file, 'rb') as f:
+        reader = PdfReader(f)
+        page_count = len(reader.pages)
+        for index, start in enumerate(range(0, page_count, shard_pages)):
+            writer = PdfWriter()
+            for page_number in range(start, min(start + shard_pages, page_count)):
+                writer.add_page(reader.pages[page_number])
+            shard_path = shard_dir / f"{shard_name(pdf_file.stem, index)}.pdf"
+            with open(shard_path, 'wb') as out:
+                writer.write(out)
+            shards.append(shard_path)
+    return shards
+
+
+def write_pages(pdf_file, shard_dir, page_numbers):
+    """
+    把指定的页分别写为单页PDF，文件名与 split_pdf(shard_pages=1) 的分片一致
+
+    Returns:
+        list: 单页PDF路径，顺序与page_numbers一致
+    """
+    pdf_file = Path(pdf_file)
+    shard_dir = Path(shard_dir)
+    shard_dir.mkdir(parents=True, exist_ok=True)
+
+    shards = []
+    with open(pdf_file, 'rb') as f:
+        reader = PdfReader(f)
+        for page_number in page_numbers:
+            writer = PdfWriter()
+            writer.add_page(reader.pages[page_number])
+            shard_path = shard_dir / f"{shard_name(pdf_file.stem, page_number)}.pdf"
+            with open(shard_path, 'wb') as out:
+                writer.write(out)
+            shards.append(shard_path)
+    return shards
+
+
+# 可以从页面树的上级节点继承的页面属性
+_INHERITABLE_KEYS = ('/Resources', '/MediaBox', '/CropBox', '/Rotate')
+
+
+def _hash_object(obj, digest, seen):
+    """把PDF对象的内容（不含对象编号）写入digest，引用的对象递归展开"""
+    if isinstance(obj, IndirectObject):
+        reference = (obj.idnum, obj.generation)
+        if reference in seen:
+            digest.update(b'<ref>')
+            return
+        seen.add(reference)
+        obj = obj.get_object()
+
+    if isinstance(obj, StreamObject):
+        # 使用未解码的原始数据，避免解码图片等数据流
+        data = getattr(obj, '_data', None)
+        digest.update(data if isinstance(data, bytes) else obj.get_data())
+    if isinstance(obj, DictionaryObject):
+        for key in sorted(obj.keys()):
+            # /Parent指向页面树，/P指向所在页面，与页面内容无关
+            if key in ('/Parent', '/P'):
+                continue
+            digest.update(key.encode('utf-8'))
+            _hash_object(obj[key], digest, seen)
+    elif isinstance(obj, ArrayObject):
+        digest.update(b'[')
+        for item in obj:
+            _hash_object(item, digest, seen)
+        digest.update(b']')
+    elif not isinstance(obj, StreamObject):
+        digest.update(repr(obj).encode('utf-8'))
+
+
+def page_hashes(pdf_file):
+    """
+    计算每一页内容的哈希
+
+    哈希覆盖页面的内容流及其引用的字体、图片等资源（含从上级节点继承的属性），
+    不包含对象编号，因此同一页面在文档改版后（其他页变化、对象重新编号）仍得到相同的哈希。
+
+    Returns:
+        list: 各页的SHA256十六进制字符串，无法解析时返回空列表
+    """
+    hashes = []
+    try:
+        with open(pdf_file, 'rb') as f:
+            reader = PdfReader(f)
+            for page in reader.pages:
+                digest = hashlib.sha256()
+                seen = set()
+                if page.indirect_reference is not None:
+                    seen.add((page.indirect_reference.idnum, page.indirect_reference.generation))
+                _hash_object(page, digest, seen)
+                # 补上从页面树继承的属性
+                for key in _INHERITABLE_KEYS:
+                    if key in page:
+                        continue
+                    node = page.get('/Parent')
+                    while node is not None:
+                        node = node.get_object()
+                        if key in node:
+                            digest.update(key.encode('utf-8'))
+                            _hash_object(node[key], digest, seen)
+                            break
+                        node = node.get('/Parent')
+                hashes.append(digest.hexdigest())
+    except Exception:
+        return []
+    return hashes
+
+
+def extract_pages(pdf_file, target_pdf, page_count: int):
+    """
+    把PDF的前page_count页写入新文件，用于抽样测试
+
+    Returns:
+        int: 实际写入的页数
+    """
+    with open(pdf_file, 'rb') as f:
+        reader = PdfReader(f)
+        writer = PdfWriter()
+        pages = min(page_count, len(reader.pages))
+        for page_number in range(pages):
+            writer.add_page(reader.pages[page_number])
+        with open(target_pdf, 'wb') as out:
+            writer.write(out)
+    return pages
+
+
+def _rewrite_image_refs(content: str, old_rel: str, new_rel: str):
+    """替换Markdown和HTML中对某个图片的引用"""
+    escaped = re.escape(old_rel)
+    content = re.sub(r'(\]\(\s*<?)' + escaped + r'(>?(?:\s+"[^"]*")?\s*\))', lambda m: m.group(1) + new_rel + m.group(2), content)
+    content = re.sub(r'''(src=["'])''' + escaped + r'''(["'])''', lambda m: m.group(1) + new_rel + m.group(2), content)
+    return content
+
+
+def stitch_shards(shard_outputs, target_md, stem: str):
+    """
+    将各分片的转换结果合并为一个文档目录
+
+    每个分片的图片加上分片序号前缀后移动到target_md中（保持原有的相对目录），
+    Markdown中的引用同步改写，因此图片名稳定且不会在分片之间冲突。
+    各分片的Markdown按顺序拼接为 <target_md>/<stem>.md。
+
+    Args:
+        shard_outputs: 按页码顺序排列的分片结果目录，每个目录包含 <分片名>.md 及图片
+        target_md: 合并后的文档目录
+        stem: 合并后的文档名
+    """
+    target_md = Path(target_md)
+    target_md.mkdir(parents=True, exist_ok=True)
+
+    parts = []
+    for index, shard_md in enumerate(shard_outputs):
+        shard_md = Path(shard_md)
+        md_file = shard_md / f"{shard_md.name}.md"
+        with open(md_file, 'r', encoding='utf-8') as f:
+            content = f.read()
+
+        prefix = f"part{index:04d}_"
+        for image in sorted(shard_md.rglob('*')):
+            if not image.is_file() or image == md_file or image.suffix.lower() == '.json':
+                continue
+            rel = image.relative_to(shard_md)
+            new_rel = rel.with_name(prefix + rel.name)
+            destination = target_md / new_rel
+            destination.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(image, destination)
+            content = _rewrite_image_refs(content, rel.as_posix(), new_rel.as_posix())
+
+        parts.append(content.strip('\n'))
+        shutil.rmtree(shard_md, ignore_errors=True)
+
+    with open(target_md / f"{stem}.md", 'w', encoding='utf-8') as f:
+        f.write('\n\n'.join(parts) + '\n')
@@ -0,0 +1,176 @@
+import queue
+import threading
+from pathlib import Path
+from step1_pdf_to_md import convert_pdf_to_md
+from step2_split_md import split_markdown_file, write_boilerplate_report
+from step3_process_images import process_document_images
+from rate_limiter import RateLimiter
+from run_manifest import run_step
+
+# 队列结束标记
+_DONE = object()
+
+
+def _empty_result():
+    return {
+        'success': False,
+        'success_files': [],
+        'failed_files': [],
+        'error': None
+    }
+
+
+def _document_md(doc_dir: Path):
+    """文档目录中的Markdown文件：<stem>/<stem>.md"""
+    return str(doc_dir / f"{doc_dir.name}.md")
+
+
+def _merge_result(total, partial, doc_dir, lock):
+    """将单个文档的处理结果合并到阶段结果中"""
+    with lock:
+        total['success_files'].extend(partial['success_files'])
+        total['failed_files'].extend(partial['failed_files'])
+        if 'boilerplate' in partial:
+            total.setdefault('boilerplate', {}).update(partial['boilerplate'])
+        if partial.get('error'):
+            total['failed_files'].append(str(doc_dir))
+            total['error'] = partial['error']
+
+
+def _stage_worker(in_queue, out_queue, process, result, lock):
+    """从上游队列取出文档目录，处理后交给下游队列"""
+    while True:
+        doc_dir = in_queue.get()
+        if doc_dir is _DONE:
+            return
+        try:
+            _merge_result(result, process(doc_dir), doc_dir, lock)
+        except Exception as e:
+            with lock:
+                result['failed_files'].append(str(doc_dir))
+                result['error'] = str(e)
+        if out_queue is not None:
+            out_queue.put(doc_dir)
+
+
+def _start_stage(name, workers, in_queue, out_queue, process, result, lock):
+    threads = []
+    for index in range(max(1, workers)):
+        thread = threading.Thread(
+            target=_stage_worker,
+            args=(in_queue, out_queue, process, result, lock),
+            name=f"{name}-{index}",
+            daemon=True
+        )
+        thread.start()
+        threads.append(thread)
+    return threads
+
+
+def _stop_stage(threads, in_queue):
+    """通知阶段内所有worker退出并等待结束"""
+    for _ in threads:
+        in_queue.put(_DONE)
+    for thread in threads:
+        thread.join()
+
+
+def run_pipeline(input_dir: str, output_dir: str, steps_to_run, uploader=None, qps=0, rate_limiter=None,
+                 split_workers=1, upload_workers=1, queue_size=8, manifest=None, resume=False,
+                 strip_min_repeats=0, **convert_kwargs):
+    """
+    以流水线方式运行步骤1→2→3
+
+    每个PDF转换完成后立即进入拆分队列，拆分完成后立即进入图片上传队列，
+    后续步骤不必等待全部PDF转换结束。每个阶段有独立的并发数，
+    阶段之间使用有界队列，下游处理不过来时会反压上游。
+
+    Args:
+        input_dir: 输入目录
+        output_dir: 输出目录
+        steps_to_run: 要运行的步骤列表，必须包含步骤1
+        uploader: 图片上传器（运行步骤3时需要）
+        qps: 上传限速，所有上传worker共享，0表示不限制
+        rate_limiter: 已有的限流器（如带突发或跨进程共享的限流器），提供时忽略qps
+        split_workers: 步骤2的并发数
+        upload_workers: 步骤3的并发数
+        queue_size: 阶段之间队列的容量
+        manifest: 运行清单(RunManifest)，记录每个文档在每个步骤中的状态
+        resume: 是否跳过清单中已完成的文档和步骤
+        strip_min_repeats: 大于0时拆分前去除出现至少这么多次的页眉页脚
+        **convert_kwargs: 传递给 convert_pdf_to_md 的其他参数（如converter、workers）
+
+    Returns:
+        dict: 各步骤的结果，键为 'pdf_to_md'、'split_md'、'process_images'
+    """
+    print(f"Running pipelined steps {', '.join(map(str, steps_to_run))}...")
+    lock = threading.Lock()
+    results = {}
+    stages = []
+
+    # 从后往前创建各阶段，这样每个阶段都知道自己的下游队列
+    next_queue = None
+    if rate_limiter is None and qps > 0:
+        rate_limiter = RateLimiter(qps)
+    if 3 in steps_to_run and uploader:
+        upload_queue = queue.Queue(maxsize=queue_size)
+        results['process_images'] = _empty_result()
+        upload_threads = _start_stage(
+            'upload', upload_workers, upload_queue, None,
+            lambda doc_dir: run_step(
+                manifest, doc_dir.name, 'process_images',
+                lambda: process_document_images(_document_md(doc_dir), uploader, qps, rate_limiter=rate_limiter),
+                _document_md(doc_dir), resume
+            ),
+            results['process_images'], lock
+        )
+        stages.insert(0, (upload_threads, upload_queue))
+        next_queue = upload_queue
+
+    if 2 in steps_to_run:
+        split_queue = queue.Queue(maxsize=queue_size)
+        results['split_md'] = _empty_result()
+        split_threads = _start_stage(
+            'split', split_workers, split_queue, next_queue,
+            lambda doc_dir: run_step(
+                manifest, doc_dir.name, 'split_md',
+                lambda: split_markdown_file(_document_md(doc_dir), strip_min_repeats),
+                _document_md(doc_dir), resume
+            ),
+            results['split_md'], lock
+        )
+        stages.insert(0, (split_threads, split_queue))
+        next_queue = split_queue
+
+    # 步骤1在当前线程运行，每转换完一个文档就放入第一个下游队列
+    on_document = None
+    if next_queue is not None:
+        first_queue = next_queue
+        on_document = lambda pdf_file, doc_dir: first_queue.put(Path(doc_dir))
+
+    try:
+        results['pdf_to_md'] = convert_pdf_to_md(
+            input_dir,
+            output_dir,
+            steps_to_run=steps_to_run,
+            on_document=on_document,
+            manifest=manifest,
+            resume=resume,
+            **convert_kwargs
+        )
+    finally:
+        # 上游结束后依次关闭各阶段，保证已入队的文档都处理完
+        for threads, stage_queue in stages:
+            _stop_stage(threads, stage_queue)
+
+    for step_name in ('split_md', 'process_images'):
+        if step_name in results:
+            results[step_name]['success'] = len(results[step_name]['failed_files']) == 0
+
+    if strip_min_repeats > 0 and 'split_md' in results:
+        total = write_boilerplate_report(
+            output_dir, results['split_md'].get('boilerplate', {}), strip_min_repeats, 512
+        )
+        results['split_md']['stats'] = {f'boilerplate_{key}': value for key, value in total.items()}
+
+    return results
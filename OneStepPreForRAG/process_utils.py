@@ -0,0 +1,92 @@
+import os
+import signal
+import subprocess
+import time
+
+
+def new_process_group_kwargs():
+    """
+    让子进程运行在独立的进程组中
+
+    `conda run` 会再启动一层子进程，转换器自身也可能启动子进程，
+    只结束直接启动的进程无法停止真正的转换进程，放在独立进程组中才能整体结束。
+    """
+    if os.name == 'nt':
+        return {'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP}
+    return {'start_new_session': True}
+
+
+def kill_process_tree(process):
+    """结束子进程及其启动的所有进程"""
+    if process.poll() is not None:
+        return
+    if os.name == 'nt':
+        subprocess.run(['taskkill', '/F', '/T', '/PID', str(process.pid)], capture_output=True)
+    else:
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            process.kill()
+
+
+def set_cpu_affinity(pid, cores):
+    """
+    把进程绑定到指定的CPU核心，不支持的平台上忽略
+
+    在Popen之后立即设置，随后启动的子进程（如 `conda run` 启动的转换进程）会继承该设置。
+    """
+    if cores and hasattr(os, 'sched_setaffinity'):
+        try:
+            os.sched_setaffinity(pid, cores)
+        except OSError:
+            pass
+
+
+def _wait(process, timeout=None, monitor=None):
+    """等待进程结束，提供monitor时每隔 monitor.interval 秒调用一次 monitor.check(process)"""
+    if monitor is None:
+        process.wait(timeout=timeout)
+        return
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        wait_time = monitor.interval
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise subprocess.TimeoutExpired(process.args, timeout)
+            wait_time = min(wait_time, remaining)
+        try:
+            process.wait(timeout=wait_time)
+            return
+        except subprocess.TimeoutExpired:
+            monitor.check(process)
+
+
+def run_command(command, timeout=None, env=None, cpu_affinity=None, monitor=None):
+    """
+    运行命令并等待结束
+
+    超时时结束整个进程组并抛出 subprocess.TimeoutExpired，
+    返回码非0时抛出 subprocess.CalledProcessError。
+
+    Args:
+        command: 命令
+        timeout: 超时时间（秒），None表示不限制
+        env: 子进程环境变量
+        cpu_affinity: 绑定的CPU核心编号列表
+        monitor: 进程运行期间定期检查的对象（如内存采样），其check抛出异常时结束进程
+    """
+    process = subprocess.Popen(command, env=env, **new_process_group_kwargs())
+    set_cpu_affinity(process.pid, cpu_affinity)
+    try:
+        _wait(process, timeout, monitor)
+    except subprocess.TimeoutExpired:
+        kill_process_tree(process)
+        process.wait()
+        raise
+    except BaseException:
+        kill_process_tree(process)
+        process.wait()
+        raise
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, command)
@@ -1,30 +1,134 @@
+import asyncio
+import os
+import struct
 import time
 from threading import Lock
 
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# 共享状态文件的内容：当前令牌数、上次更新时间（time.time()）
+_STATE = struct.Struct('<dd')
+
+
 class RateLimiter:
-    def __init__(self, qps):
+    def __init__(self, qps, burst=1, state_file=None):
         """
-        初始化限流器
-        
+        初始化令牌桶限流器
+
+        令牌以每秒qps个的速度补充，最多积累burst个；每个请求消耗一个令牌。
+        等待在锁外进行：获取许可时先预订令牌（令牌数可以为负），再在锁外睡眠到令牌补足，
+        因此等待的线程不会互相阻塞，按预订的顺序依次放行。
+
         Args:
-            qps: 每秒允许的最大请求数
+            qps: 每秒允许的平均请求数，可以是小数（如0.5表示每两秒一个）
+            burst: 空闲后允许连续发出的最大请求数，1表示请求之间严格间隔1/qps秒
+            state_file: 共享状态文件路径，提供时令牌桶保存在该文件中并用文件锁保护，
+                多个进程（如同时运行的多个main.py）使用同一文件即共享同一个限额
         """
+        if qps <= 0:
+            raise ValueError(f"qps must be positive: {qps}")
         self.qps = qps
-        self.interval = 1.0 / qps if qps > 0 else 0
-        self.last_request_time = 0
+        self.burst = max(1, burst)
+        self.interval = 1.0 / qps
+        self.state_file = state_file
         self.lock = Lock()
-    
+        # 进程内状态；共享模式下每次从文件读取
+        self.tokens = float(self.burst)
+        self.last_update = time.time()
+        if state_file is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(state_file)), exist_ok=True)
+            # 不存在时创建，已存在时保留其他进程写入的状态
+            with open(state_file, 'ab'):
+                pass
+
+    def _refill(self, tokens, last_update, now):
+        return min(float(self.burst), tokens + (now - last_update) * self.qps), now
+
+    def _reserve(self, tokens=1, wait=True):
+        """
+        预订令牌
+
+        Returns:
+            float或None: 需要等待的秒数；wait=False且令牌不足时返回None，不预订
+        """
+        with self.lock:
+            if self.state_file is None:
+                return self._reserve_state(tokens, wait)
+            with open(self.state_file, 'r+b') as f:
+                _lock_file(f)
+                try:
+                    data = f.read(_STATE.size)
+                    if len(data) == _STATE.size:
+                        self.tokens, self.last_update = _STATE.unpack(data)
+                    else:
+                        self.tokens, self.last_update = float(self.burst), time.time()
+                    delay = self._reserve_state(tokens, wait)
+                    f.seek(0)
+                    f.write(_STATE.pack(self.tokens, self.last_update))
+                    f.flush()
+                finally:
+                    _unlock_file(f)
+            return delay
+
+    def _reserve_state(self, tokens, wait):
+        """在持有锁时根据 self.tokens/self.last_update 预订令牌"""
+        now = time.time()
+        # 其他进程的时钟或状态在未来时不补充令牌
+        available, self.last_update = self._refill(self.tokens, min(self.last_update, now), now)
+        if available >= tokens:
+            self.tokens = available - tokens
+            return 0.0
+        if not wait:
+            self.tokens = available
+            return None
+        self.tokens = available - tokens
+        return -self.tokens / self.qps
+
     def acquire(self):
         """
         获取一个请求许可
         如果需要，会阻塞到下一个可用时间点
         """
-        with self.lock:
-            current_time = time.time()
-            time_since_last = current_time - self.last_request_time
-            
-            if time_since_last < self.interval:
-                sleep_time = self.interval - time_since_last
-                time.sleep(sleep_time)
-            
-            self.last_request_time = time.time() 
\ No newline at end of file
+        delay = self._reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    def try_acquire(self):
+        """
+        不等待地获取一个请求许可
+
+        Returns:
+            bool: 是否获取到许可
+        """
+        return self._reserve(wait=False) is not None
+
+    async def acquire_async(self):
+        """acquire 的asyncio版本，等待时不阻塞事件循环"""
+        delay = self._reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+def _lock_file(f):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+    else:
+        while True:
+            try:
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                return
+            except OSError:
+                # LK_LOCK 重试10次后仍未取得锁时抛出异常，继续等待
+                continue
+
+
+def _unlock_file(f):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
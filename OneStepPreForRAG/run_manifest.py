@@ -0,0 +1,132 @@
+import json
+import os
+from datetime import datetime
+from pathlib import Path
+from threading import Lock
+
+# 文档在各步骤中的状态
+STARTED = 'started'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class RunManifest:
+    """
+    可恢复运行的清单
+
+    以追加写入的JSONL文件记录每个文档在每个步骤中的状态，每条记录写入后立即落盘。
+    文档以其名称（PDF文件名去掉扩展名，也就是输出目录名）标识。
+    重新加载时按记录顺序回放，同一文档同一步骤以最后一条记录为准；
+    只有 'started' 没有结束记录的条目表示上次运行中断时正在处理。
+
+    记录格式：
+        {"time": "...", "doc": "<stem>", "step": "pdf_to_md", "state": "done", "file": "...", "error": null}
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.lock = Lock()
+        # (doc, step) -> 最后一条记录
+        self.entries = {}
+
+        if self.path.exists():
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                        self.entries[(record['doc'], record['step'])] = record
+                    except (ValueError, KeyError):
+                        # 中断时可能留下写了一半的最后一行
+                        continue
+
+        self.file = open(self.path, 'a', encoding='utf-8')
+
+    def state(self, doc: str, step: str):
+        """返回文档在某步骤中的最新状态，没有记录时返回None"""
+        with self.lock:
+            record = self.entries.get((doc, step))
+        return record['state'] if record else None
+
+    def is_done(self, doc: str, step: str):
+        return self.state(doc, step) == DONE
+
+    def mark(self, doc: str, step: str, state: str, file=None, error=None):
+        """追加一条状态记录并落盘"""
+        record = {
+            'time': datetime.now().isoformat(),
+            'doc': doc,
+            'step': step,
+            'state': state,
+            'file': str(file) if file is not None else doc,
+            'error': str(error) if error else None
+        }
+        with self.lock:
+            self.entries[(doc, step)] = record
+            self.file.write(json.dumps(record, ensure_ascii=False) + '\n')
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def step_summary(self, step: str):
+        """
+        汇总某步骤中所有文档的最新状态
+
+        Returns:
+            dict: {'success': [...], 'failed': [...], 'in_flight': [...]}
+        """
+        summary = {'success': [], 'failed': [], 'in_flight': []}
+        with self.lock:
+            records = [record for (doc, record_step), record in self.entries.items() if record_step == step]
+        for record in records:
+            if record['state'] == DONE:
+                summary['success'].append(record['file'])
+            elif record['state'] == FAILED:
+                summary['failed'].append(record['file'])
+            else:
+                summary['in_flight'].append(record['file'])
+        return summary
+
+    def close(self):
+        with self.lock:
+            if not self.file.closed:
+                self.file.close()
+
+
+def run_step(manifest, doc: str, step: str, process, file=None, resume=False):
+    """
+    执行单个文档的某一步骤，并在清单中记录开始和结束状态
+
+    Args:
+        manifest: RunManifest，为None时直接执行
+        doc: 文档名
+        step: 步骤名
+        process: 无参数的处理函数，返回包含 'success' 的结果字典
+        file: 记录在清单中的文件路径
+        resume: 为True时跳过清单中已完成的步骤
+
+    Returns:
+        dict: 处理结果；跳过时 'skipped' 为True
+    """
+    if manifest is None:
+        return process()
+
+    if resume and manifest.is_done(doc, step):
+        return {
+            'success': True,
+            'success_files': [str(file if file is not None else doc)],
+            'failed_files': [],
+            'error': None,
+            'skipped': True
+        }
+
+    manifest.mark(doc, step, STARTED, file)
+    try:
+        result = process()
+    except Exception as e:
+        manifest.mark(doc, step, FAILED, file, e)
+        raise
+    if result['success']:
+        manifest.mark(doc, step, DONE, file)
+    else:
+        manifest.mark(doc, step, FAILED, file, result.get('error') or result.get('failed_files'))
+    return result
@@ -1,7 +1,26 @@
 import subprocess
 from pathlib import Path
+import heapq
+import itertools
 import os
+import json
+import shutil
+import tempfile
+import time
 import logging
+from contextlib import ExitStack
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from converter_server import CONVERTER_ENVS, ConverterClient
+from conversion_cache import ConversionCache
+from pdf_inspector import needs_ocr, get_page_count
+from pdf_sharding import split_pdf, stitch_shards, shard_name, write_pages, page_hashes, extract_pages
+from run_manifest import run_step, STARTED, DONE, FAILED
+from env_resolver import env_command, env_environ
+from process_utils import run_command
+from job_scheduler import plan_schedule
+from cpu_partition import CorePartition, auto_workers, candidate_configs, autotune
+from memory_monitor import MemoryGovernor, MemoryCapExceeded, GB
+from rate_limiter import RateLimiter
 
 logging.basicConfig(
     level=logging.INFO,
@@ -12,10 +31,657 @@ logging.basicConfig(
     ]
 )
 
-def convert_pdf_to_md(input_dir: str, output_dir: str, converter='marker', process_each=False, uploader=None, qps=0, steps_to_run=None):
+# 每个转换任务的暂存目录，放在输出目录下以保证最终的rename在同一文件系统内
+STAGING_DIR_NAME = '.staging'
+
+# 转换器对应的Python包，用于确定缓存键中的版本号
+CONVERTER_PACKAGES = {
+    'marker': 'marker-pdf',
+    'mineru': 'magic-pdf',
+}
+
+# 降级重试时marker使用的配置：降低页面渲染分辨率
+MARKER_DEGRADED_CONFIG = {
+    'lowres_image_dpi': 72,
+    'highres_image_dpi': 96,
+}
+
+# 转换结果分类
+OUTCOME_OK = 'ok'
+OUTCOME_DEGRADED = 'degraded'
+OUTCOME_TIMEOUT = 'timeout'
+OUTCOME_FAILED = 'failed'
+OUTCOME_MEMORY = 'memory'
+
+
+def _converter_flags(converter: str, use_ocr=True):
+    """转换器的转换参数（不含输入输出路径）"""
+    if converter == 'marker':
+        flags = ['--output_format', 'markdown']
+        if use_ocr:
+            flags.append('--force_ocr')
+        return flags
+    # mineru
+    return ['-m', 'ocr' if use_ocr else 'txt']
+
+
+def _converter_version(converter: str):
+    """查询转换器所在环境中安装的版本，查询失败时返回'unknown'"""
+    command = env_command(
+        CONVERTER_ENVS[converter], 'python', '-c',
+        f"import importlib.metadata as m; print(m.version('{CONVERTER_PACKAGES[converter]}'))"
+    )
+    try:
+        completed = subprocess.run(command, capture_output=True, text=True, timeout=120, check=True,
+                                   env=env_environ(CONVERTER_ENVS[converter]))
+        return completed.stdout.strip().splitlines()[-1]
+    except (subprocess.SubprocessError, OSError, IndexError):
+        return 'unknown'
+
+
+def _build_command(pdf_file: Path, stage_path: Path, converter: str, use_ocr=True, config_json=None):
+    """构建转换命令，直接执行环境中的转换器（找不到时使用 conda run）"""
+    if converter == 'marker':
+        command = env_command(
+            CONVERTER_ENVS['marker'], 'marker_single',
+            pdf_file,
+            '--output_dir', stage_path,
+            *_converter_flags(converter, use_ocr)
+        )
+        if config_json is not None:
+            command += ['--config_json', str(config_json)]
+        return command
+    # mineru
+    return env_command(
+        CONVERTER_ENVS['mineru'], 'magic-pdf',
+        '-p', pdf_file,
+        '-o', stage_path,
+        *_converter_flags(converter, use_ocr)
+    )
+
+
+def _degraded_options(pdf_file: Path, stage_path: Path, converter: str):
+    """
+    准备降级模式的转换参数
+
+    marker: 通过 --config_json 降低页面渲染分辨率；
+    mineru: 复制用户的 magic-pdf.json 并关闭表格识别，通过 MINERU_TOOLS_CONFIG_JSON 指定，
+    没有该配置文件时使用默认设置重试。
+
+    Returns:
+        tuple: (config_json路径或None, 环境变量或None)
+    """
+    stage_path.mkdir(parents=True, exist_ok=True)
+    if converter == 'marker':
+        config_json = stage_path / f"{pdf_file.stem}.degraded.json"
+        with open(config_json, 'w', encoding='utf-8') as f:
+            json.dump(MARKER_DEGRADED_CONFIG, f)
+        return config_json, None
+
+    # mineru
+    user_config = Path(os.environ.get('MINERU_TOOLS_CONFIG_JSON', Path.home() / 'magic-pdf.json'))
+    if not user_config.is_absolute():
+        user_config = Path.home() / user_config
+    if not user_config.exists():
+        return None, None
+    with open(user_config, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    config.setdefault('table-config', {})['enable'] = False
+    degraded_config = stage_path / f"{pdf_file.stem}.degraded.json"
+    with open(degraded_config, 'w', encoding='utf-8') as f:
+        json.dump(config, f, ensure_ascii=False)
+    env = dict(os.environ, MINERU_TOOLS_CONFIG_JSON=str(degraded_config.resolve()))
+    return None, env
+
+
+def _build_batch_command(input_dir: Path, stage_path: Path, converter: str, use_ocr=True):
+    """构建批量转换命令，转换input_dir中的所有PDF，模型只加载一次"""
+    if converter == 'marker':
+        # marker的批量入口，worker进程数由本程序的并发控制，这里只用一个
+        return env_command(
+            CONVERTER_ENVS['marker'], 'marker',
+            input_dir,
+            '--output_dir', stage_path,
+            '--workers', '1',
+            *_converter_flags(converter, use_ocr)
+        )
+    # mineru：-p 传入目录时逐个转换目录中的PDF
+    return env_command(
+        CONVERTER_ENVS['mineru'], 'magic-pdf',
+        '-p', input_dir,
+        '-o', stage_path,
+        *_converter_flags(converter, use_ocr)
+    )
+
+
+def _link_or_copy(source: Path, target: Path):
+    """在批量输入目录中放置PDF，优先使用链接避免复制大文件"""
+    for link in (os.symlink, os.link):
+        try:
+            link(source.resolve(), target)
+            return
+        except (OSError, NotImplementedError):
+            continue
+    shutil.copy2(source, target)
+
+
+def _normalize_mineru_output(output_md: Path, stem: str, method='ocr'):
+    """将mineru的 <stem>/<method>/ 输出整理为 <stem>/<stem>.md 和 <stem>/images"""
+    output_file = output_md / f"{method}/{stem}.md"
+    output_file_img = output_md / f"{method}/images"
+
+    os.rename(output_file, output_md / f"{stem}.md")
+    os.rename(output_file_img, output_md / f"images")
+
+    shutil.rmtree(output_md / method, ignore_errors=True)
+
+
+def _commit_output(stage_md: Path, output_md: Path):
+    """将暂存目录中的结果移动到最终位置，已存在的旧结果会被替换"""
+    if output_md.exists():
+        shutil.rmtree(output_md)
+    os.replace(stage_md, output_md)
+
+
+def _post_process_document(pdf_file: Path, output_md: Path, ctx):
+    """
+    对刚转换的单个文档立即执行步骤2/3
+
+    直接在 output_dir/<stem>/<stem>.md 上原地处理，每一步都以rename原子提交，
+    不需要复制整个文档目录，多个文档可以安全地并发处理。
+    """
+    from step2_split_md import split_markdown_file
+    from step3_process_images import process_document_images
+    print(f"Performing immediate processing for {pdf_file}")
+
+    md_file = output_md / f"{output_md.name}.md"
+
+    # 根据选择的步骤执行处理
+    if 2 in ctx.steps_to_run:
+        print(f"Running step 2 (split) for {pdf_file}")
+        split_result = run_step(
+            ctx.manifest, output_md.name, 'split_md',
+            lambda: split_markdown_file(str(md_file), ctx.strip_min_repeats),
+            md_file, ctx.resume
+        )
+        if not split_result['success']:
+            print(f"Warning: Split failed for {pdf_file}")
+
+    if 3 in ctx.steps_to_run:
+        print(f"Running step 3 (image processing) for {pdf_file}")
+        if ctx.uploader:
+            process_result = run_step(
+                ctx.manifest, output_md.name, 'process_images',
+                lambda: process_document_images(str(md_file), ctx.uploader, rate_limiter=ctx.rate_limiter),
+                md_file, ctx.resume
+            )
+            if not process_result['success']:
+                print(f"Warning: Image processing failed for {pdf_file}")
+
+
+class _ConversionContext:
+    """一次转换运行中所有任务共享的设置"""
+
+    def __init__(self, output_path: Path, converter: str, process_each=False, uploader=None, qps=0,
+                 rate_limiter=None, steps_to_run=None, server=None, cache=None, cache_version=None, ocr_mode='force',
+                 shard_pages=0, manifest=None, resume=False, base_timeout=300, page_timeout=60, retries=1,
+                 partition=None, memory=None, page_cache=None, batch_size=1, strip_min_repeats=0):
+        self.output_path = output_path
+        self.staging_root = output_path / STAGING_DIR_NAME
+        self.converter = converter
+        self.process_each = process_each
+        self.uploader = uploader
+        self.qps = qps
+        # 所有文档的上传共享同一个限流器
+        self.rate_limiter = rate_limiter if rate_limiter is not None else (RateLimiter(qps) if qps > 0 else None)
+        self.steps_to_run = steps_to_run
+        self.server = server
+        self.cache = cache
+        self.cache_version = cache_version
+        self.ocr_mode = ocr_mode
+        self.shard_pages = shard_pages
+        self.manifest = manifest
+        self.resume = resume
+        self.base_timeout = base_timeout
+        self.page_timeout = page_timeout
+        self.retries = retries
+        # CPU核心划分(CorePartition)，None表示不限制转换进程的线程数
+        self.partition = partition
+        # 内存准入控制(MemoryGovernor)，None表示不限制
+        self.memory = memory
+        # 页级转换缓存(ConversionCache)，None表示不使用
+        self.page_cache = page_cache
+        # 每次批量转换的文档数，1表示逐个转换
+        self.batch_size = batch_size
+        # process_each拆分前去除页眉页脚的最少重复次数，0表示不去除
+        self.strip_min_repeats = strip_min_repeats
+        # 预扫描得到的页数 {PDF路径: 页数}
+        self.page_counts = {}
+
+    def page_count(self, pdf_file: Path):
+        """PDF页数，优先使用预扫描的结果"""
+        if pdf_file not in self.page_counts:
+            self.page_counts[pdf_file] = get_page_count(pdf_file)
+        return self.page_counts[pdf_file]
+
+
+class _DocumentJob:
+    """单个PDF的转换状态，转换结果先写入独立的暂存目录"""
+
+    def __init__(self, pdf_file: Path, ctx: _ConversionContext):
+        self.pdf_file = pdf_file
+        ctx.staging_root.mkdir(parents=True, exist_ok=True)
+        self.stage_path = Path(tempfile.mkdtemp(prefix=f"{pdf_file.stem}_", dir=ctx.staging_root))
+        self.stage_md = self.stage_path / pdf_file.stem
+        self.output_md = ctx.output_path / pdf_file.stem
+        self.use_ocr = True
+        self.cache_key = None
+        self.mode = 'ocr'
+        self.shards = []
+        # 需要转换的分片，使用页级缓存时只包含未命中的页
+        self.convert_shards = []
+        # 未命中页级缓存的分片名 -> 页缓存键，每页转换完成后立即写入缓存
+        self.page_keys = {}
+        # 与文档中前面某页内容相同的页: 分片名 -> 被复制的分片名，只转换一次
+        self.page_copies = {}
+        self.outcome = OUTCOME_OK
+
+    @property
+    def shard_output_path(self):
+        return self.stage_path / 'shards_out'
+
+    def cleanup(self):
+        shutil.rmtree(self.stage_path, ignore_errors=True)
+
+
+def _conversion_timeout(pdf_file: Path, ctx: _ConversionContext):
+    """按页数计算单个PDF（或分片）的转换超时时间（秒），page_timeout为0时不限制"""
+    if ctx.page_timeout <= 0:
+        return None
+    return ctx.base_timeout + ctx.page_timeout * ctx.page_count(pdf_file)
+
+
+def _run_subprocess(command, pages: int, ctx: _ConversionContext, timeout=None, env=None, exclusive=False):
+    """
+    在新的转换进程中运行命令
+
+    有内存准入控制时先等待内存预算，运行期间采样内存；
+    有CPU划分时限制线程数并绑定到分配给当前worker的核心。
+    """
+    env = env_environ(CONVERTER_ENVS[ctx.converter], env)
+    with ExitStack() as stack:
+        monitor = None
+        if ctx.memory is not None:
+            monitor = stack.enter_context(ctx.memory.admit(pages, exclusive))
+        cores = None
+        if ctx.partition is not None:
+            cores = stack.enter_context(ctx.partition.slot())
+            env = CorePartition.env(cores, env)
+        run_command(command, timeout=timeout, env=env, cpu_affinity=cores, monitor=monitor)
+
+
+def _run_converter(pdf_file: Path, stage_path: Path, ctx: _ConversionContext, use_ocr=True, degraded=False,
+                   exclusive=False):
+    """
+    调用转换器转换一个PDF（或分片），结果整理为 <stage_path>/<stem>/<stem>.md
+
+    如果提供了常驻转换服务(server)，则把任务提交给服务，而不是每次启动新的转换进程；
+    降级模式需要不同的转换配置，总是在新的转换进程中运行。
+    超时抛出 subprocess.TimeoutExpired，超过内存硬上限抛出 MemoryCapExceeded，
+    转换器返回非0或没有生成Markdown时抛出异常。
+    exclusive为True时等待其他转换进程结束后单独运行。
+    """
+    stage_md = stage_path / pdf_file.stem
+    if ctx.converter == 'mineru':
+        stage_md.mkdir(parents=True, exist_ok=True)
+
+    timeout = _conversion_timeout(pdf_file, ctx)
+    if ctx.server is not None and not degraded:
+        ctx.server.convert(pdf_file, stage_path, ocr=use_ocr, timeout=timeout)
+    else:
+        config_json, env = _degraded_options(pdf_file, stage_path, ctx.converter) if degraded else (None, None)
+        command = _build_command(pdf_file, stage_path, ctx.converter, use_ocr, config_json)
+        _run_subprocess(command, ctx.page_count(pdf_file), ctx, timeout, env, exclusive)
+
+    if ctx.converter == 'mineru':
+        _normalize_mineru_output(stage_md, pdf_file.stem, 'ocr' if use_ocr else 'txt')
+    if not (stage_md / f"{pdf_file.stem}.md").exists():
+        raise RuntimeError(f"Converter produced no Markdown for {pdf_file}")
+    return stage_md
+
+
+def _convert_with_retries(pdf_file: Path, stage_path: Path, ctx: _ConversionContext, use_ocr=True):
+    """
+    转换一个PDF（或分片），失败或超时后以降级模式重试，最多重试 ctx.retries 次
+
+    超过内存硬上限被结束的任务，在内存预算大于硬上限时先重新排队，
+    等其他任务结束后以整个预算为上限单独运行一次，不计入重试次数；否则直接进行降级重试。
+
+    Returns:
+        str: 'ok' 或 'degraded'（降级重试后成功）
+    """
+    attempt = 0
+    exclusive = False
+    while True:
+        degraded = attempt > 0
+        try:
+            _run_converter(pdf_file, stage_path, ctx, use_ocr, degraded, exclusive)
+            return OUTCOME_DEGRADED if degraded else OUTCOME_OK
+        except Exception as e:
+            if isinstance(e, MemoryCapExceeded) and not exclusive and ctx.memory.can_run_alone():
+                exclusive = True
+                warning_msg = f"Conversion of {pdf_file.name} was killed: {e}. Requeued to run alone"
+            elif attempt < ctx.retries:
+                attempt += 1
+                reason = 'timed out' if isinstance(e, subprocess.TimeoutExpired) else f"failed ({e})"
+                warning_msg = f"Conversion of {pdf_file.name} {reason}, retrying in degraded mode ({attempt}/{ctx.retries})"
+            else:
+                raise
+            print(warning_msg)
+            logging.warning(warning_msg)
+            # 清理上次尝试留下的不完整输出
+            shutil.rmtree(stage_path / pdf_file.stem, ignore_errors=True)
+
+
+def _prepare_document(pdf_file: Path, ctx: _ConversionContext):
+    """
+    准备单个PDF的转换：决定是否OCR、尝试从缓存恢复，大文件按页切分
+
+    ocr_mode为'auto'时先抽样检查文本层，只有没有可用文本层的文档才强制OCR。
+    如果提供了转换缓存(cache)，命中时直接从缓存恢复结果，不再调用转换器。
+    如果提供了页级缓存(page_cache)，文档按单页分片处理，只转换未命中缓存的页。
+    """
+    job = _DocumentJob(pdf_file, ctx)
+    try:
+        if ctx.ocr_mode == 'auto':
+            job.use_ocr = needs_ocr(pdf_file)
+            print(f"{pdf_file.name}: {'no usable text layer, using OCR' if job.use_ocr else 'text layer found, skipping OCR'}")
+        job.mode = 'ocr' if job.use_ocr else 'text'
+
+        if ctx.cache is not None:
+            job.cache_key = ConversionCache.make_key(pdf_file, ctx.converter, ctx.cache_version, _converter_flags(ctx.converter, job.use_ocr))
+            if ctx.cache.restore(job.cache_key, job.stage_md, pdf_file.stem):
+                print(f"Restored {pdf_file.name} from conversion cache")
+                job.mode = 'cache'
+                return job
+
+        if ctx.page_cache is not None and _prepare_page_cache(job, ctx):
+            return job
+
+        if ctx.shard_pages > 0:
+            page_count = ctx.page_count(pdf_file)
+            if page_count > ctx.shard_pages:
+                job.shards = split_pdf(pdf_file, job.stage_path / 'shards', ctx.shard_pages)
+                job.convert_shards = job.shards
+                print(f"Split {pdf_file.name} ({page_count} pages) into {len(job.shards)} shards")
+    except Exception:
+        job.cleanup()
+        raise
+    return job
+
+
+def _convert_batch(jobs, ctx: _ConversionContext):
+    """
+    用转换器的批量入口一次转换多个文档（OCR设置相同），模型只加载一次
+
+    批量输出整理为与逐个转换相同的 <stem>/<stem>.md 结构后逐个完成。
+    批量转换中没有生成结果的文档（批量进程报错、超时或跳过了该文档）
+    单独重新转换（包括降级重试），因此失败只归属到具体的文档。
+
+    Returns:
+        list: [(pdf_file, 转换信息或异常), ...]
+    """
+    use_ocr = jobs[0].use_ocr
+    batch_path = Path(tempfile.mkdtemp(prefix='batch_', dir=ctx.staging_root))
+    input_dir = batch_path / 'input'
+    output_dir = batch_path / 'output'
+    input_dir.mkdir()
+    output_dir.mkdir()
+    try:
+        for job in jobs:
+            _link_or_copy(job.pdf_file, input_dir / job.pdf_file.name)
+
+        names = ', '.join(job.pdf_file.name for job in jobs)
+        print(f"\nProcessing batch of {len(jobs)} PDFs: {names}")
+        pages = sum(max(1, ctx.page_count(job.pdf_file)) for job in jobs)
+        timeout = None
+        if ctx.page_timeout > 0:
+            timeout = ctx.base_timeout * len(jobs) + ctx.page_timeout * pages
+        try:
+            command = _build_batch_command(input_dir, output_dir, ctx.converter, use_ocr)
+            _run_subprocess(command, pages, ctx, timeout)
+        except Exception as e:
+            warning_msg = f"Batch conversion failed ({e}), checking which documents were converted"
+            print(warning_msg)
+            logging.warning(warning_msg)
+
+        results = []
+        for job in jobs:
+            pdf_file = job.pdf_file
+            batch_md = output_dir / pdf_file.stem
+            try:
+                try:
+                    if ctx.converter == 'mineru':
+                        _normalize_mineru_output(batch_md, pdf_file.stem, 'ocr' if use_ocr else 'txt')
+                    converted = (batch_md / f"{pdf_file.stem}.md").exists()
+                except OSError:
+                    converted = False
+
+                if converted:
+                    os.replace(batch_md, job.stage_md)
+                else:
+                    print(f"{pdf_file.name} missing from batch output, converting it separately")
+                    job.outcome = _convert_with_retries(pdf_file, job.stage_path, ctx, use_ocr)
+                results.append((pdf_file, _finish_document(job, ctx)))
+            except Exception as e:
+                job.cleanup()
+                results.append((pdf_file, e))
+        return results
+    finally:
+        shutil.rmtree(batch_path, ignore_errors=True)
+
+
+def _prepare_page_cache(job: _DocumentJob, ctx: _ConversionContext):
+    """
+    按页查询页级缓存：命中的页直接恢复为单页分片的结果，未命中的页写为单页PDF等待转换
+
+    文档中内容相同的页（如空白页、重复的封面）只转换第一页，其余页在合并前复制其结果。
+
+    Returns:
+        bool: 是否使用页级缓存（无法解析页面时返回False，按整个文档转换）
+    """
+    pdf_file = job.pdf_file
+    hashes = page_hashes(pdf_file)
+    if not hashes:
+        return False
+
+    flags = _converter_flags(ctx.converter, job.use_ocr)
+    missed = []
+    # 页缓存键 -> 本文档中第一个使用该键的分片名
+    seen = {}
+    for page_number, page_hash in enumerate(hashes):
+        name = shard_name(pdf_file.stem, page_number)
+        key = ConversionCache.make_page_key(page_hash, ctx.converter, ctx.cache_version, flags)
+        if key in seen:
+            job.page_copies[name] = seen[key]
+            continue
+        seen[key] = name
+        if not ctx.page_cache.restore(key, job.shard_output_path / name, name):
+            missed.append(page_number)
+            job.page_keys[name] = key
+
+    shard_dir = job.stage_path / 'shards'
+    job.shards = [shard_dir / f"{shard_name(pdf_file.stem, page_number)}.pdf" for page_number in range(len(hashes))]
+    job.convert_shards = write_pages(pdf_file, shard_dir, missed)
+    print(
+        f"{pdf_file.name}: {len(hashes) - len(missed) - len(job.page_copies)} of {len(hashes)} pages restored "
+        f"from page cache, {len(job.page_copies)} duplicate pages, {len(missed)} pages to convert"
+    )
+    return True
+
+
+def _convert_shard(job: _DocumentJob, shard_pdf: Path, ctx: _ConversionContext):
+    """
+    转换大文件的一个分片
+
+    页级缓存的页在转换前再查一次缓存（同时转换的其他文档可能刚转换了相同的页），
+    转换完成后立即写入缓存，之后的文档不必等本文档全部完成。
+    """
+    key = job.page_keys.get(shard_pdf.stem)
+    if key is not None and ctx.page_cache.contains(key):
+        if ctx.page_cache.restore(key, job.shard_output_path / shard_pdf.stem, shard_pdf.stem):
+            print(f"Restored {shard_pdf.name} from page cache")
+            return
+    print(f"\nProcessing shard: {shard_pdf.name}")
+    if _convert_with_retries(shard_pdf, job.shard_output_path, ctx, job.use_ocr) == OUTCOME_DEGRADED:
+        job.outcome = OUTCOME_DEGRADED
+    if key is not None:
+        ctx.page_cache.store(key, job.shard_output_path / shard_pdf.stem, shard_pdf.stem)
+
+
+def _copy_page_output(shard_output_path: Path, source: str, name: str):
+    """复制内容相同的页的转换结果，Markdown文件名改为新的分片名"""
+    shutil.copytree(shard_output_path / source, shard_output_path / name)
+    os.rename(shard_output_path / name / f"{source}.md", shard_output_path / name / f"{name}.md")
+
+
+def _finish_document(job: _DocumentJob, ctx: _ConversionContext):
+    """
+    完成单个PDF的转换：合并分片、写入缓存、移动到输出目录并执行即时处理
+
+    Returns:
+        dict: 本次转换的信息，'mode' 为 'ocr'、'text' 或 'cache'，'outcome' 为 'ok' 或 'degraded'
+    """
+    try:
+        pdf_file = job.pdf_file
+        if job.shards:
+            # 合并时分片目录会被移走，先复制内容相同的页
+            for name, source in job.page_copies.items():
+                _copy_page_output(job.shard_output_path, source, name)
+            shard_outputs = [job.shard_output_path / shard.stem for shard in job.shards]
+            stitch_shards(shard_outputs, job.stage_md, pdf_file.stem)
+
+        if job.cache_key is not None and job.mode != 'cache':
+            ctx.cache.store(job.cache_key, job.stage_md, pdf_file.stem)
+
+        _commit_output(job.stage_md, job.output_md)
+
+        # 如果启用了即时处理，对刚转换的文件进行处理
+        if ctx.process_each and job.output_md.exists():
+            _post_process_document(pdf_file, job.output_md, ctx)
+
+        return {'mode': job.mode, 'shards': len(job.shards), 'outcome': job.outcome}
+    finally:
+        job.cleanup()
+
+
+def _start_document(pdf_file: Path, ctx: _ConversionContext):
+    """
+    开始转换单个PDF
+
+    转换先写入独立的暂存目录，完成后再整体移动到 output_dir/<stem>，
+    因此多个worker并发转换时不会在输出目录中互相覆盖。
+
+    恢复运行(resume)时，清单中已完成且输出仍然存在的文档直接跳过，只补做未完成的即时处理。
+
+    Returns:
+        tuple: ('done', 转换信息)、('sharded', job) 或 ('batch', job)，
+               后两者需要调度各分片或加入批量转换后再调用 _finish_document
+    """
+    output_md = ctx.output_path / pdf_file.stem
+    if ctx.resume and ctx.manifest.is_done(pdf_file.stem, 'pdf_to_md') and output_md.exists():
+        print(f"\nSkipping {pdf_file.name}: already converted in a previous run")
+        if ctx.process_each:
+            _post_process_document(pdf_file, output_md, ctx)
+        return 'done', {'mode': 'resumed', 'shards': 0, 'outcome': OUTCOME_OK}
+
+    print(f"\nProcessing: {pdf_file}")
+    print(f"Output path: {ctx.output_path}")
+    if ctx.manifest is not None:
+        ctx.manifest.mark(pdf_file.stem, 'pdf_to_md', STARTED, pdf_file)
+    job = _prepare_document(pdf_file, ctx)
+    if job.shards:
+        return 'sharded', job
+    if ctx.batch_size > 1 and job.mode != 'cache':
+        return 'batch', job
+
+    try:
+        if job.mode != 'cache':
+            job.outcome = _convert_with_retries(pdf_file, job.stage_path, ctx, job.use_ocr)
+    except Exception:
+        job.cleanup()
+        raise
+    return 'done', _finish_document(job, ctx)
+
+
+def _autotune_partition(pdf_files, output_path: Path, converter: str, ocr_mode='force', sample_pages=4, base_timeout=300, page_timeout=60):
+    """
+    在样本上测量几种 worker数 x 线程数 组合的吞吐量，返回最快的CorePartition
+
+    样本取最大的PDF的前sample_pages页，每种组合同时运行workers个样本转换，
+    吞吐量按 总页数 / 耗时 计算（包含模型加载时间，与实际运行一致）。
+    """
+    staging_root = output_path / STAGING_DIR_NAME
+    staging_root.mkdir(parents=True, exist_ok=True)
+    tune_path = Path(tempfile.mkdtemp(prefix='autotune_', dir=staging_root))
+    try:
+        source = max(pdf_files, key=os.path.getsize)
+        sample = tune_path / f"{source.stem}.pdf"
+        pages = extract_pages(source, sample, sample_pages)
+        use_ocr = ocr_mode == 'force' or needs_ocr(sample)
+        print(f"Auto-tuning CPU partition on {pages} pages of {source.name}")
+
+        def measure(workers, threads):
+            ctx = _ConversionContext(output_path, converter, base_timeout=base_timeout, page_timeout=page_timeout,
+                                     retries=0, partition=CorePartition(workers, threads))
+            run_path = tune_path / f"{workers}x{threads}"
+            start = time.monotonic()
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = [
+                    executor.submit(_run_converter, sample, run_path / str(index), ctx, use_ocr)
+                    for index in range(workers)
+                ]
+                for future in futures:
+                    future.result()
+            elapsed = time.monotonic() - start
+            shutil.rmtree(run_path, ignore_errors=True)
+            return workers * pages / max(elapsed, 1e-6)
+
+        best, measurements = autotune(measure, candidate_configs())
+    finally:
+        shutil.rmtree(tune_path, ignore_errors=True)
+
+    if best is None:
+        return None, measurements
+    return CorePartition(*best), measurements
+
+
+def _record_failure(result, pdf_file, e, manifest=None):
+    """记录转换失败的文件，超时的文件分类为 'timeout'，超过内存上限的为 'memory'，其他为 'failed'"""
+    if str(pdf_file) not in result['failed_files']:
+        result['failed_files'].append(str(pdf_file))
+        if isinstance(e, subprocess.TimeoutExpired):
+            result['outcomes'][str(pdf_file)] = OUTCOME_TIMEOUT
+        elif isinstance(e, MemoryCapExceeded):
+            result['outcomes'][str(pdf_file)] = OUTCOME_MEMORY
+        else:
+            result['outcomes'][str(pdf_file)] = OUTCOME_FAILED
+        if manifest is not None:
+            manifest.mark(pdf_file.stem, 'pdf_to_md', FAILED, pdf_file, e)
+    if isinstance(e, subprocess.TimeoutExpired):
+        error_msg = f"Timed out converting {pdf_file} after {e.timeout:.0f}s"
+    elif isinstance(e, subprocess.CalledProcessError):
+        error_msg = f"Error converting {pdf_file}: {e}"
+    else:
+        error_msg = f"Unexpected error processing {pdf_file}: {e}"
+    print(error_msg)
+    logging.error(error_msg)
+
+
+def convert_pdf_to_md(input_dir: str, output_dir: str, converter='marker', process_each=False, uploader=None, qps=0, rate_limiter=None, steps_to_run=None, workers=1, use_server=False, cache_dir=None, cache_max_bytes=20 * 1024 ** 3, ocr_mode='force', shard_pages=0, on_document=None, manifest=None, resume=False, base_timeout=300, page_timeout=60, retries=1, threads_per_worker=0, cpu_autotune=False, autotune_pages=4, memory_budget_bytes=0, memory_cap_bytes=0, page_cache=False, batch_size=1, strip_min_repeats=0):
     """
     将PDF转换为Markdown文件
-    
+
     Args:
         input_dir: 输入目录
         output_dir: 输出目录
@@ -23,130 +689,271 @@ def convert_pdf_to_md(input_dir: str, output_dir: str, converter='marker', proce
         process_each: 是否对每个转换后的文件立即进行后续处理
         uploader: 图片上传器（当process_each=True且需要处理图片时需要）
         qps: 上传限速（当process_each=True且需要处理图片时可用）
+        rate_limiter: 已有的限流器（如带突发或跨进程共享的限流器），提供时忽略qps
         steps_to_run: 要运行的步骤列表
+        workers: 并发转换的PDF数量，1表示逐个转换，0表示按CPU核心数自动选择
+        use_server: 是否使用常驻转换服务，模型只加载一次
+        cache_dir: 转换缓存目录，None表示不使用缓存
+        cache_max_bytes: 转换缓存容量上限（字节），0表示不限制
+        ocr_mode: 'force' 始终OCR；'auto' 抽样检测文本层，只对没有文本层的文档OCR
+        shard_pages: 页数超过该值的PDF按此页数切分后并行转换再合并，0表示不切分
+        on_document: 每个PDF转换成功后的回调 on_document(pdf_file, 文档目录)，用于流水线处理
+        manifest: 运行清单(RunManifest)，记录每个文档的转换状态
+        resume: 是否跳过清单中已完成的文档
+        base_timeout: 每个PDF（或分片）转换超时的基础时间（秒）
+        page_timeout: 每页增加的超时时间（秒），0表示不限制转换时间
+        retries: 转换失败或超时后以降级模式重试的次数
+        threads_per_worker: 每个转换进程的线程数，0表示平分CPU核心
+        cpu_autotune: 是否先在样本上测量几种 worker数 x 线程数 组合，选用最快的一种
+        autotune_pages: 自动调优使用的样本页数
+        memory_budget_bytes: 同时运行的转换进程的内存预算（字节），预计超出时暂缓开始新任务，0表示不限制
+        memory_cap_bytes: 单个转换进程的内存硬上限（字节），超过时结束进程并重新排队单独运行，0表示不限制
+        page_cache: 是否在cache_dir/pages中按页缓存转换结果，文档改版后只转换变化的页（需要cache_dir）；
+                    未命中的页逐页转换，因此会自动使用常驻转换服务
+        batch_size: 大于1时每batch_size个文档调用一次转换器的批量入口，共享一次模型加载（不能与常驻服务同时使用）
+        strip_min_repeats: process_each时拆分前去除出现至少这么多次的页眉页脚，0表示不去除
+
+    Returns:
+        dict: 转换结果，'outcomes' 记录每个文件的结果分类：
+              'ok'、'degraded'（降级重试后成功）、'timeout'、'memory' 或 'failed'
     """
     print(f"Step 1: Converting PDFs to Markdown using {converter}...")
     result = {
         'success': False,
         'success_files': [],
         'failed_files': [],
-        'error': None
+        'error': None,
+        'outcomes': {}
     }
-    
+
     if steps_to_run is None:
         steps_to_run = [1, 2, 3]
-    
+
+    # 页级缓存逐页转换，每页启动一个转换进程会反复加载模型，改用常驻服务
+    if page_cache and cache_dir and not use_server:
+        print("Page cache converts missed pages one at a time, using the converter server")
+        use_server = True
+
+    server = None
     try:
         input_path = Path(input_dir)
         output_path = Path(output_dir)
-        
+
         pdf_files = list(input_path.glob('*.pdf'))
         print(f"Found {len(pdf_files)} PDF files to process")
-        
-        for pdf_file in pdf_files:
-            print(f"\nProcessing: {pdf_file}")
-            try:
-                output_md = output_path / f"{pdf_file.stem}"
-                print(f"Output path: {output_path}")
-                
-                if converter == 'marker':
-                    command = [
-                        'conda', 'run', '--no-capture-output', '-n', 'SimpleRAG',
-                        'marker_single',
-                        str(pdf_file),
-                        '--output_dir', str(output_path),
-                        '--output_format', 'markdown',
-                        '--force_ocr'
-                    ]
-                else:  # mineru
-                    output_md.mkdir(parents=True, exist_ok=True)
-                    print(f"output_md: {output_md}")
-                    command = [
-                        'conda', 'run', '--no-capture-output', '-n', 'MinerU',
-                        'magic-pdf',
-                        '-p', str(pdf_file),
-                        '-o', str(output_path),
-                        '-m', 'ocr'  
-                    ]
-                
-                subprocess.run(command)
-                if converter == 'mineru':
-                    output_file = output_md / f"ocr/{pdf_file.stem}.md"
-                    output_file_img = output_md / f"ocr/images"
-
-                    os.rename(output_file, output_md / f"{pdf_file.stem}.md")
-                    os.rename(output_file_img, output_md / f"images")
-
-                    output_last_path = output_md / "ocr"
-                    print(f"output_last_path: {output_last_path}")
-                    import shutil
-                    shutil.rmtree(output_last_path, ignore_errors=True)
-                
-                result['success_files'].append(str(pdf_file))
-                
-                # 如果启用了即时处理，对刚转换的文件进行处理
-                if process_each and output_md.exists():
-                    from step2_split_md import split_markdown_files
-                    from step3_process_images import process_images
-                    print(f"Performing immediate processing for {pdf_file}")
-                    
-                    # 创建临时目录用于单文件处理
-                    temp_dir = output_path / "temp_processing"
-                    temp_dir.mkdir(exist_ok=True)
-                    print(f"Created temp directory: {temp_dir}")
-                    
-                    # 复制文件到临时目录
-                    temp_md = temp_dir / output_md.name
-                    import shutil
-                    shutil.copytree(output_md, temp_md)
-                    
-                    processed_file = temp_md
-                    
-                    # 根据选择的步骤执行处理
-                    if 2 in steps_to_run:
-                        print(f"Running step 2 (split) for {pdf_file}")
-                        split_result = split_markdown_files(str(temp_dir))
-                        if not split_result['success']:
-                            print(f"Warning: Split failed for {pdf_file}")
-                    
-                    if 3 in steps_to_run:
-                        print(f"Running step 3 (image processing) for {pdf_file}")
-                        if uploader:
-                            process_result = process_images(str(temp_dir), uploader, qps)
-                            if not process_result['success']:
-                                print(f"Warning: Image processing failed for {pdf_file}")
-                    
-                    # 处理完成，将处理后的文件移回原位置
-                    shutil.rmtree(output_md, ignore_errors=True)  # 删除原目录
-                    shutil.copytree(processed_file, output_md)
-                    print(f"Moved processed file back to: {output_md}")
-                    
-                    # 清理临时目录
-                    shutil.rmtree(temp_dir)
-                    print(f"Cleaned up temp directory")
-                
-            except subprocess.CalledProcessError as e:
-                result['failed_files'].append(str(pdf_file))
-                error_msg = f"Error converting {pdf_file}: {e}"
-                print(error_msg)
-                logging.error(error_msg)
-                continue
-            except Exception as e:
-                error_msg = f"Unexpected error processing {pdf_file}: {e}"
-                print(error_msg)
-                logging.error(error_msg)
-                continue
-        
+
+        # 划分CPU核心，避免多个转换进程都按全部核心开线程。
+        # 常驻服务只有一个转换进程，不需要划分。
+        partition = None
+        autotune_results = None
+        if not use_server and pdf_files:
+            if cpu_autotune:
+                partition, autotune_results = _autotune_partition(
+                    pdf_files, output_path, converter, ocr_mode, autotune_pages, base_timeout, page_timeout
+                )
+            if partition is None:
+                partition = CorePartition(workers if workers > 0 else auto_workers(), threads_per_worker)
+            workers = partition.workers
+            print(f"CPU partition: {partition.describe()}")
+
+        # 按内存预算控制同时运行的转换进程，常驻服务只有一个进程，不需要控制
+        memory = None
+        if not use_server and (memory_budget_bytes > 0 or memory_cap_bytes > 0):
+            memory = MemoryGovernor(memory_budget_bytes, memory_cap_bytes)
+            print(f"Memory budget: {memory_budget_bytes / GB:.1f} GB, hard cap per converter: {memory_cap_bytes / GB:.1f} GB (0 = no limit)")
+        workers = max(1, workers)
+        if workers > 1:
+            print(f"Converting with {workers} concurrent workers")
+
+        # 预扫描页数，大文档优先开始，避免最后剩下一个大文档单独运行
+        schedule = plan_schedule(pdf_files, workers, shard_pages)
+        pdf_files = schedule['order']
+        if pdf_files:
+            print(
+                f"Scheduling {len(pdf_files)} PDFs ({schedule['total_pages']} pages) longest first, "
+                f"predicted makespan: {schedule['makespan_pages']} pages on the busiest worker "
+                f"(input order: {schedule['glob_makespan_pages']} pages)"
+            )
+        start_time = time.monotonic()
+
+        cache = None
+        cache_version = None
+        pages_cache = None
+        if cache_dir:
+            cache = ConversionCache(cache_dir, cache_max_bytes)
+            cache_version = _converter_version(converter)
+            print(f"Using conversion cache at {cache_dir} ({converter} {cache_version})")
+            if page_cache:
+                # 页级缓存与文档缓存共用 cache_max_bytes
+                pages_cache = ConversionCache(Path(cache_dir) / 'pages', shared_with=cache)
+                print("Using page-level conversion cache")
+
+        # 启动常驻转换服务，所有任务共享一次模型加载
+        if use_server and pdf_files:
+            server = ConverterClient(converter).start()
+
+        ctx = _ConversionContext(
+            output_path, converter,
+            process_each=process_each,
+            uploader=uploader,
+            qps=qps,
+            rate_limiter=rate_limiter,
+            steps_to_run=steps_to_run,
+            server=server,
+            cache=cache,
+            cache_version=cache_version,
+            ocr_mode=ocr_mode,
+            shard_pages=shard_pages,
+            manifest=manifest,
+            resume=resume and manifest is not None,
+            base_timeout=base_timeout,
+            page_timeout=page_timeout,
+            retries=max(0, retries),
+            partition=partition,
+            memory=memory,
+            page_cache=pages_cache,
+            batch_size=batch_size if not use_server else 1,
+            strip_min_repeats=strip_min_repeats
+        )
+        ctx.page_counts.update(schedule['page_counts'])
+        mode_counts = {'ocr': 0, 'text': 0, 'cache': 0, 'resumed': 0}
+        sharded_documents = 0
+
+        def record_success(pdf_file, info):
+            nonlocal sharded_documents
+            mode_counts[info['mode']] += 1
+            if info['shards']:
+                sharded_documents += 1
+            result['success_files'].append(str(pdf_file))
+            result['outcomes'][str(pdf_file)] = info['outcome']
+            if manifest is not None and info['mode'] != 'resumed':
+                manifest.mark(pdf_file.stem, 'pdf_to_md', DONE, pdf_file)
+            if on_document is not None:
+                on_document(pdf_file, output_path / pdf_file.stem)
+
+        # 使用有界线程池调度转换任务，实际的转换工作在子进程中完成。
+        # 大文件的各个分片作为独立任务进入同一个线程池，全部完成后再提交合并任务。
+        # 批量模式下需要转换的文档按OCR设置分组，凑满batch_size（或没有更多文档）时提交批量任务。
+        # 线程池中最多同时有workers个任务，其余任务在队列中按估算页数从大到小（最长任务优先）等待，
+        # 因此大文件切分出的分片排在剩余的小文档前面，与 plan_schedule 的预测一致；合并任务最先提交。
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = {}
+            # (-估算页数, 入队顺序, 任务类型, 文档, 函数, 参数)
+            queue = []
+            sequence = itertools.count()
+
+            def enqueue(cost, kind, key, fn, *args):
+                heapq.heappush(queue, (-cost, next(sequence), kind, key, fn, args))
+
+            for pdf_file in pdf_files:
+                enqueue(schedule['costs'][pdf_file], 'document', pdf_file, _start_document, pdf_file, ctx)
+            # pdf_file -> {'job': job, 'remaining': 未完成分片数, 'failed': 是否有分片失败}
+            sharded = {}
+            # use_ocr -> 等待批量转换的job
+            batch_buffers = {True: [], False: []}
+
+            while pending or queue:
+                while queue and len(pending) < workers:
+                    _, _, kind, key, fn, args = heapq.heappop(queue)
+                    pending[executor.submit(fn, *args)] = (kind, key)
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    kind, pdf_file = pending.pop(future)
+                    try:
+                        outcome = future.result()
+                    except Exception as e:
+                        if kind == 'batch':
+                            for job in pdf_file:
+                                job.cleanup()
+                                _record_failure(result, job.pdf_file, e, manifest)
+                            continue
+                        _record_failure(result, pdf_file, e, manifest)
+                        if kind == 'shard':
+                            state = sharded[pdf_file]
+                            state['failed'] = True
+                            state['remaining'] -= 1
+                            if state['remaining'] == 0:
+                                state['job'].cleanup()
+                        continue
+
+                    if kind == 'batch':
+                        for batch_pdf, batch_outcome in outcome:
+                            if isinstance(batch_outcome, Exception):
+                                _record_failure(result, batch_pdf, batch_outcome, manifest)
+                            else:
+                                record_success(batch_pdf, batch_outcome)
+                    elif kind == 'document' and outcome[0] == 'batch':
+                        batch_buffers[outcome[1].use_ocr].append(outcome[1])
+                    elif kind == 'document' and outcome[0] == 'sharded':
+                        job = outcome[1]
+                        if not job.convert_shards:
+                            # 所有页都已从页级缓存恢复
+                            enqueue(float('inf'), 'finish', pdf_file, _finish_document, job, ctx)
+                            continue
+                        sharded[pdf_file] = {'job': job, 'remaining': len(job.convert_shards), 'failed': False}
+                        for shard_pdf in job.convert_shards:
+                            enqueue(max(1, ctx.page_count(shard_pdf)), 'shard', pdf_file, _convert_shard, job, shard_pdf, ctx)
+                    elif kind == 'shard':
+                        state = sharded[pdf_file]
+                        state['remaining'] -= 1
+                        if state['remaining'] == 0:
+                            if state['failed']:
+                                state['job'].cleanup()
+                            else:
+                                enqueue(float('inf'), 'finish', pdf_file, _finish_document, state['job'], ctx)
+                    else:
+                        record_success(pdf_file, outcome[1] if kind == 'document' else outcome)
+
+                documents_pending = (
+                    any(kind == 'document' for kind, _ in pending.values())
+                    or any(item[2] == 'document' for item in queue)
+                )
+                for buffer in batch_buffers.values():
+                    while len(buffer) >= ctx.batch_size or (buffer and not documents_pending):
+                        batch = buffer[:ctx.batch_size]
+                        del buffer[:ctx.batch_size]
+                        cost = sum(max(1, ctx.page_count(job.pdf_file)) for job in batch)
+                        enqueue(cost, 'batch', batch, _convert_batch, batch, ctx)
+
+        shutil.rmtree(output_path / STAGING_DIR_NAME, ignore_errors=True)
+
+        outcome_counts = {OUTCOME_OK: 0, OUTCOME_DEGRADED: 0, OUTCOME_TIMEOUT: 0, OUTCOME_MEMORY: 0, OUTCOME_FAILED: 0}
+        for outcome in result['outcomes'].values():
+            outcome_counts[outcome] += 1
+        result['stats'] = {'conversion_modes': mode_counts, 'outcomes': outcome_counts}
+        if shard_pages > 0:
+            result['stats']['sharded_documents'] = sharded_documents
+        result['stats']['schedule'] = {
+            'total_pages': schedule['total_pages'],
+            'predicted_makespan_pages': schedule['makespan_pages'],
+            'elapsed_seconds': round(time.monotonic() - start_time, 1)
+        }
+        if partition is not None:
+            result['stats']['cpu_partition'] = {'workers': partition.workers, 'threads_per_worker': partition.threads}
+        if autotune_results is not None:
+            result['stats']['cpu_autotune'] = autotune_results
+        if memory is not None:
+            result['stats']['memory'] = memory.report()
+        if cache is not None:
+            result['stats']['cache'] = cache.report()
+            print(f"Conversion cache - Hits: {result['stats']['cache']['hits']}, Misses: {result['stats']['cache']['misses']}")
+        if pages_cache is not None:
+            result['stats']['page_cache'] = pages_cache.report()
+            print(f"Page cache - Hits: {result['stats']['page_cache']['hits']}, Misses: {result['stats']['page_cache']['misses']}")
+
         result['success'] = len(result['failed_files']) == 0
         summary_msg = f"\nProcessing completed. Successful: {len(result['success_files'])}, Failed: {len(result['failed_files'])}"
         print(summary_msg)
         logging.info(summary_msg)
-        
+
     except Exception as e:
         result['error'] = str(e)
         result['success'] = False
         error_msg = f"Fatal error: {e}"
         print(error_msg)
         logging.error(error_msg)
-    
+    finally:
+        if server is not None:
+            server.close()
+
     return result
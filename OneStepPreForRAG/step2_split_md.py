@@ -1,40 +1,301 @@
-from pdfdeal.file_tools import auto_split_mds
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+import json
+import os
+import re
+import shutil
+import tempfile
+from boilerplate import BoilerplateStats, find_boilerplate, classify_pieces
+from chunker import chunk_markdown_files
+from md_stream import SPLIT_STR, iter_pieces
+from run_manifest import STARTED, DONE, FAILED
 
-def split_markdown_files(output_dir: str):
-    """拆分Markdown文件的段落"""
-    print("\nStep 2: Splitting markdown files...")
-    result = {
+# 去除页眉页脚的统计报告
+BOILERPLATE_REPORT_NAME = 'boilerplate_report.json'
+
+# 标题行，遇到标题时在其前面插入分隔符
+HEADER_PATTERN = re.compile(r'#{1,6}\s')
+
+
+def find_document_md_files(output_dir: str):
+    """查找输出目录中按 <stem>/<stem>.md 组织的文档"""
+    md_files = []
+    for doc_dir in sorted(Path(output_dir).iterdir()):
+        md_file = doc_dir / f"{doc_dir.name}.md"
+        if doc_dir.is_dir() and md_file.exists():
+            md_files.append(md_file)
+    return md_files
+
+
+def find_markdown_files(output_dir: str):
+    """递归查找输出目录中的Markdown文件，跳过以.开头的暂存目录"""
+    root = Path(output_dir)
+    return sorted(
+        md_file for md_file in root.rglob('*.md')
+        if not any(part.startswith('.') for part in md_file.relative_to(root).parts)
+    )
+
+
+def document_key(md_file, output_dir: str):
+    """
+    运行清单中Markdown文件对应的文档名
+
+    <stem>/<stem>.md 使用 <stem>，与第1步记录的文档名一致；
+    其他Markdown文件使用相对输出目录的路径，避免同名目录中的文件互相覆盖
+    """
+    md_file = Path(md_file)
+    if md_file.stem == md_file.parent.name:
+        return md_file.stem
+    try:
+        return md_file.relative_to(output_dir).as_posix()
+    except ValueError:
+        return md_file.as_posix()
+
+
+def _new_result():
+    return {
         'success': False,
         'success_files': [],
         'failed_files': [],
+        'skipped_files': [],
         'error': None
     }
-    
+
+
+def _merge_result(total, partial):
+    total['success_files'].extend(partial['success_files'])
+    total['failed_files'].extend(partial['failed_files'])
+    total['skipped_files'].extend(partial.get('skipped_files', []))
+    if 'boilerplate' in partial:
+        total.setdefault('boilerplate', {}).update(partial['boilerplate'])
+    if partial.get('error'):
+        total['error'] = partial['error']
+
+
+def split_markdown_files(output_dir: str, manifest=None, resume=False, md_files=None, workers=0, chunk_options=None,
+                         strip_min_repeats=0):
+    """
+    拆分Markdown文件的段落
+
+    Args:
+        output_dir: 输出目录
+        manifest: 运行清单(RunManifest)，提供时记录每个文档的状态
+        resume: 是否跳过清单中已完成的文档
+        md_files: 只拆分这些文件（如本次新转换的文档），None表示查找输出目录中的所有文件
+        workers: 并行拆分的进程数，0表示按CPU核心数，1表示在当前进程中逐个拆分
+        chunk_options: 分块参数(ChunkOptions)，提供时把拆分成功的文件按token预算切分并写入分块文件，
+                       结果中另有 'chunks' 和 'chunk_store'
+        strip_min_repeats: 大于0时在拆分前去除出现至少这么多次的页眉页脚，
+                           结果中另有 'boilerplate'（每个文档的统计）和 'boilerplate_total'（合计），
+                           并写出 boilerplate_report.json
+    """
+    print("\nStep 2: Splitting markdown files...")
+    result = _new_result()
+
     try:
-        # 获取所有需要处理的markdown文件
-        md_files = list(Path(output_dir).glob('*.md'))
-        
-        # 执行拆分操作
-        success, failed, flag = auto_split_mds(
-            mdpath=output_dir, 
-            out_type="replace",
-            split_str="=+=+=+=+=+=+=+=+="
+        if md_files is not None:
+            md_files = [Path(md_file) for md_file in md_files]
+        else:
+            md_files = find_markdown_files(output_dir)
+
+        if manifest is not None:
+            # 清单中已完成的文档直接跳过，其余文档记录开始状态
+            todo = []
+            for md_file in md_files:
+                if resume and manifest.is_done(document_key(md_file, output_dir), 'split_md'):
+                    result['success_files'].append(str(md_file))
+                    result['skipped_files'].append(str(md_file))
+                else:
+                    manifest.mark(document_key(md_file, output_dir), 'split_md', STARTED, md_file)
+                    todo.append(md_file)
+            md_files = todo
+
+        workers = workers if workers > 0 else (os.cpu_count() or 1)
+        workers = min(workers, len(md_files))
+        chunk_tokens = chunk_options.max_tokens if chunk_options is not None and chunk_options.unit == 'tokens' else 512
+        args = (
+            list(map(str, md_files)),
+            [strip_min_repeats] * len(md_files),
+            [chunk_tokens] * len(md_files)
         )
-        
-        # 记录处理结果
-        result['success_files'].extend([str(f) for f in success])
-        if flag:
-            result['failed_files'].extend([str(f) for f in failed])
-        
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                file_results = list(executor.map(split_markdown_file, *args, chunksize=8))
+        else:
+            file_results = list(map(split_markdown_file, *args))
+
+        for md_file, file_result in zip(md_files, file_results):
+            _merge_result(result, file_result)
+            if manifest is not None:
+                if file_result['success']:
+                    manifest.mark(document_key(md_file, output_dir), 'split_md', DONE, md_file)
+                else:
+                    manifest.mark(document_key(md_file, output_dir), 'split_md', FAILED, md_file, file_result.get('error'))
+
         result['success'] = len(result['failed_files']) == 0
-        
+
         # 打印处理结果
-        print(f"Split results - Success: {len(success)} files, Failed: {len(failed)}")
-        
+        print(
+            f"Split results - Success: {len(result['success_files'])} files "
+            f"({len(result['skipped_files'])} already split), Failed: {len(result['failed_files'])}"
+        )
+
+        if strip_min_repeats > 0:
+            result['boilerplate_total'] = write_boilerplate_report(
+                output_dir, result.get('boilerplate', {}), strip_min_repeats, chunk_tokens
+            )
+
+        if chunk_options is not None:
+            chunk_result = chunk_markdown_files(output_dir, result['success_files'], chunk_options, workers)
+            result['failed_files'].extend(chunk_result['failed_files'])
+            for key in ('chunks', 'chunk_store', 'duplicates', 'dedup_report'):
+                if key in chunk_result:
+                    result[key] = chunk_result[key]
+            if chunk_result.get('error'):
+                result['error'] = chunk_result['error']
+            result['success'] = result['success'] and chunk_result['success']
+
     except Exception as e:
         result['error'] = str(e)
         result['success'] = False
         print(f"Error during markdown splitting: {e}")
-    
+
+    return result
+
+
+def write_boilerplate_report(output_dir: str, documents, min_repeats, chunk_tokens):
+    """
+    汇总各文档去除页眉页脚的统计并写入 <output_dir>/boilerplate_report.json
+
+    Returns:
+        dict: 所有文档的合计
+    """
+    total = {'lines_removed': 0, 'bytes_saved': 0, 'tokens_saved': 0, 'chunks_saved': 0}
+    for stats in documents.values():
+        for key in total:
+            total[key] += stats[key]
+    total['chunks_saved'] = round(total['chunks_saved'], 1)
+    report = {
+        'min_repeats': min_repeats,
+        'chunk_tokens': chunk_tokens,
+        'total': total,
+        'documents': documents
+    }
+    with open(Path(output_dir) / BOILERPLATE_REPORT_NAME, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(
+        f"Boilerplate removed - {total['lines_removed']} lines, {total['bytes_saved']} bytes, "
+        f"~{total['chunks_saved']} chunks from {len(documents)} files"
+    )
+    return total
+
+
+class _SegmentWriter:
+    """
+    流式写出段落：分隔符 + 去掉首尾空白的段落内容
+
+    与 SPLIT_STR + "\n" + ''.join(segment).strip() + "\n" 的输出相同，
+    但不在内存中保存整个段落：开头的空白直接丢弃，末尾的空白暂存到下一段非空白内容到来时再写出。
+    """
+
+    def __init__(self, out):
+        self.out = out
+        self.started = False
+        self.pending = ''
+
+    def start(self):
+        self.out.write(SPLIT_STR + "\n")
+        self.started = False
+        self.pending = ''
+
+    def write(self, piece: str):
+        if not self.started:
+            piece = piece.lstrip()
+            if not piece:
+                return
+            self.started = True
+        body = piece.rstrip()
+        if body:
+            self.out.write(self.pending)
+            self.out.write(body)
+            self.pending = piece[len(body):]
+        else:
+            self.pending += piece
+
+    def finish(self):
+        self.out.write("\n")
+
+
+def split_markdown_file(md_file: str, strip_min_repeats=0, chunk_tokens=512):
+    """
+    原地拆分单个Markdown文件的段落
+
+    按固定大小的片段读取文件（超长的行也不会整行读入），在每个标题前插入分隔符
+    （与pdfdeal的auto_split_md输出一致），段落边读边输出到同目录下的临时文件，
+    内存占用与文件大小无关。完成后通过rename原子替换原文件，中途失败时原文件保持不变。
+    已经包含分隔符的文件视为已拆分，直接跳过。
+
+    Args:
+        md_file: Markdown文件路径
+        strip_min_repeats: 大于0时先统计页眉页脚，拆分的同时去除出现至少这么多次的页眉页脚
+        chunk_tokens: 估算节省的分块数时每个分块的token数
+    """
+    result = _new_result()
+
+    md_path = Path(md_file)
+    temp_file = None
+    try:
+        fd, temp_file = tempfile.mkstemp(prefix=".split_", suffix=".md.tmp", dir=md_path.parent)
+        already_split = False
+        boilerplate = find_boilerplate(str(md_path), strip_min_repeats) if strip_min_repeats > 0 else set()
+        stats = BoilerplateStats()
+        with open(md_path, 'r', encoding='utf-8') as src, os.fdopen(fd, 'w', encoding='utf-8') as out:
+            writer = _SegmentWriter(out)
+            writer.start()
+            # 上一个片段的末尾，用于发现跨越片段边界的分隔符
+            tail = ''
+            for piece, at_line_start, key in classify_pieces(iter_pieces(src)):
+                if SPLIT_STR in tail + piece:
+                    already_split = True
+                    break
+                tail = piece[-len(SPLIT_STR):]
+                if key is not None and key in boilerplate:
+                    stats.add(piece)
+                    continue
+                if at_line_start and HEADER_PATTERN.match(piece):
+                    writer.finish()
+                    writer.start()
+                writer.write(piece)
+            if not already_split:
+                writer.finish()
+
+        if already_split:
+            result['skipped_files'].append(str(md_path))
+        else:
+            # mkstemp创建的文件权限是0600，保留原文件的权限
+            shutil.copymode(md_path, temp_file)
+            os.replace(temp_file, md_path)
+            temp_file = None
+            if strip_min_repeats > 0:
+                result['boilerplate'] = {str(md_path): stats.report(chunk_tokens)}
+                if stats.lines_removed:
+                    print(
+                        f"Removed {stats.lines_removed} repeated header/footer lines "
+                        f"({stats.bytes_saved} bytes) from {md_path.name}"
+                    )
+        result['success_files'].append(str(md_path))
+        result['success'] = True
+
+    except Exception as e:
+        result['failed_files'].append(str(md_path))
+        result['error'] = str(e)
+        result['success'] = False
+        print(f"Error during markdown splitting of {md_path}: {e}")
+    finally:
+        if temp_file:
+            try:
+                os.remove(temp_file)
+            except OSError:
+                pass
+
     return result
@@ -1,8 +1,44 @@
-from pdfdeal.file_tools import mds_replace_imgs
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import os
+import shutil
+import tempfile
+from md_stream import scan_image_links, replace_image_links
 from rate_limiter import RateLimiter
+from run_manifest import run_step
 
-def process_images(output_dir: str, uploader, qps: int = 0):
+
+def _make_upload_func(uploader, qps=0, rate_limiter=None):
+    """
+    取得上传函数，如果设置了QPS限制，创建限流器并包装上传函数
+
+    带上传缓存的上传器自己在缓存未命中时获取许可，缓存命中不受QPS限制。
+    """
+    upload_func = uploader.upload_file if hasattr(uploader, 'upload_file') else uploader
+    
+    if rate_limiter is None and qps > 0:
+        rate_limiter = RateLimiter(qps)
+    
+    if rate_limiter is not None and getattr(uploader, 'accepts_rate_limiter', False):
+        original_upload = upload_func
+        
+        def cache_limited_upload(*args, **kwargs):
+            return original_upload(*args, rate_limiter=rate_limiter, **kwargs)
+        
+        upload_func = cache_limited_upload
+    elif rate_limiter is not None:
+        original_upload = upload_func
+        
+        def rate_limited_upload(*args, **kwargs):
+            rate_limiter.acquire()
+            return original_upload(*args, **kwargs)
+        
+        upload_func = rate_limited_upload
+    
+    return upload_func
+
+def process_images(output_dir: str, uploader, qps: float = 0, rate_limiter=None, manifest=None, resume=False):
     """
     处理并上传图片
     
@@ -10,6 +46,9 @@ def process_images(output_dir: str, uploader, qps: int = 0):
         output_dir: 输出目录
         uploader: 上传器函数或带有upload方法的对象
         qps: 每秒最大请求数，0表示不限制
+        rate_limiter: 已有的限流器，多次调用共享同一个限额时使用，提供时忽略qps
+        manifest: 运行清单(RunManifest)，提供时记录每个文档的状态
+        resume: 是否跳过清单中已完成的文档
     """
     print("\nStep 3: Uploading images...")
     result = {
@@ -21,49 +60,40 @@ def process_images(output_dir: str, uploader, qps: int = 0):
     
     try:
         # 获取所有需要处理的markdown文件
-        md_files = list(Path(output_dir).glob('*.md'))
-        
-        # 如果设置了QPS限制，创建限流器并包装上传函数
-        upload_func = uploader.upload_file if hasattr(uploader, 'upload_file') else uploader
+        from step2_split_md import document_key, find_markdown_files
+        md_files = find_markdown_files(output_dir)
         
-        if qps > 0:
+        # 所有文档共享同一个限流器
+        if rate_limiter is None and qps > 0:
             rate_limiter = RateLimiter(qps)
-            original_upload = upload_func
-            
-            def rate_limited_upload(*args, **kwargs):
-                rate_limiter.acquire()
-                return original_upload(*args, **kwargs)
-            
-            upload_func = rate_limited_upload
         
-        # 替换图片
-        success, failed, flag = mds_replace_imgs(
-            path=output_dir,
-            replace=upload_func,
-            threads=2,
-            down_load_threads=3,
-            path_style=True,
-            skip='https://'
-        )
+        def process_document(md_file):
+            # 提供清单时记录每个文档的状态，resume时跳过已完成的文档
+            return run_step(
+                manifest, document_key(md_file, output_dir), 'process_images',
+                lambda: process_document_images(str(md_file), uploader, rate_limiter=rate_limiter),
+                md_file, resume
+            )
         
-        # 记录处理结果
-        result['success_files'].extend([str(f) for f in success])
+        # 逐个文档流式替换图片
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            doc_results = list(executor.map(process_document, md_files))
         
-        if failed:
-            for fail in failed:
-                file_info = {
-                    'file': str(fail.get('file', 'Unknown')),
-                    'error': str(fail.get('error', 'Unknown error'))
-                }
-                result['failed_files'].append(file_info)
+        failed = []
+        for md_file, doc_result in zip(md_files, doc_results):
+            result['success_files'].extend(doc_result['success_files'])
+            failed.extend(doc_result['failed_files'])
+            if doc_result.get('error'):
+                failed.append({'file': str(md_file), 'error': doc_result['error']})
+        result['failed_files'].extend(failed)
         
         # 设置处理状态
         result['success'] = len(result['failed_files']) == 0
         
         # 打印处理结果
-        if flag:
+        if failed:
             print("Warning: Some images failed to upload")
-        print(f"Image upload results - Success: {len(success)} files, Failed: {len(failed)}")
+        print(f"Image upload results - Success: {len(result['success_files'])} files, Failed: {len(failed)}")
         
         # 打印失败详情
         if failed:
@@ -78,3 +108,110 @@ def process_images(output_dir: str, uploader, qps: int = 0):
         print(f"Error during image upload: {e}")
     
     return result
+
+
+def _remote_file_name(md_path: Path, img_path: Path):
+    """远程文件名，与 mds_replace_imgs 的 path_style 一致：<文档名>/<md5>.<扩展名>"""
+    file_md5 = hashlib.md5()
+    with open(img_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            file_md5.update(block)
+    return f"{md_path.stem}/{file_md5.hexdigest()}{img_path.suffix}"
+
+
+def process_document_images(md_file: str, uploader, qps: float = 0, rate_limiter=None, threads: int = 3):
+    """
+    原地处理单个Markdown文件中的图片并上传
+
+    与 process_images 的输出格式一致，但只处理一个文档：替换后的内容先写入
+    同目录下的临时文件，再通过rename原子替换原文件，提交之后才删除已上传的本地图片。
+    因此可以对同一输出目录中的不同文档并发调用。
+    查找和替换图片链接都按固定大小的窗口流式进行，内存占用与文件大小无关；
+    内联的base64图片(data:)和远程图片保持不变。
+
+    Args:
+        md_file: Markdown文件路径
+        uploader: 上传器函数或带有upload方法的对象，带有upload_files方法的异步上传引擎一次提交所有图片
+        qps: 每秒最大请求数，0表示不限制
+        rate_limiter: 已有的限流器，多次调用共享同一个限额时使用，提供时忽略qps
+        threads: 同一文档内并发上传的图片数（异步上传引擎的并发数在创建时指定）
+    """
+    result = {
+        'success': False,
+        'success_files': [],
+        'failed_files': [],
+        'error': None
+    }
+
+    md_path = Path(md_file)
+    try:
+        # 异步上传引擎一次提交整个文档的图片，其他上传器在线程中逐个上传
+        batch_upload = getattr(uploader, 'upload_files', None)
+        if batch_upload is None:
+            upload_func = _make_upload_func(uploader, qps, rate_limiter)
+        elif rate_limiter is None and qps > 0:
+            rate_limiter = RateLimiter(qps)
+
+        origin_list, path_list = scan_image_links(md_path)
+        tasks = []
+        for origin, src in zip(origin_list, path_list):
+            if src.startswith(('http://', 'https://', 'data:')):
+                continue
+            img_path = Path(src) if os.path.isabs(src) else md_path.parent / src
+            tasks.append((origin, src, img_path))
+
+        def upload_task(task):
+            origin, src, img_path = task
+            try:
+                return upload_func(str(img_path), _remote_file_name(md_path, img_path))
+            except Exception as e:
+                return str(e), False
+
+        if batch_upload is not None:
+            upload_results = batch_upload(
+                [(str(img_path), _remote_file_name(md_path, img_path)) for _, _, img_path in tasks],
+                rate_limiter=rate_limiter
+            )
+        else:
+            with ThreadPoolExecutor(max_workers=max(1, threads)) as executor:
+                upload_results = list(executor.map(upload_task, tasks))
+
+        replacements = {}
+        uploaded = []
+        for task, (new_url, ok) in zip(tasks, upload_results):
+            origin, src, img_path = task
+            if ok:
+                replacements[origin] = f"![{md_path.stem}](<{new_url}>)\n"
+                uploaded.append(img_path)
+            else:
+                result['failed_files'].append({'file': str(md_path), 'error': f"{src}: {new_url}"})
+
+        # 原子提交：先流式写入临时文件再rename，没有替换时不重写文件
+        if replacements:
+            fd, tmp_file = tempfile.mkstemp(prefix=f".{md_path.stem}_", suffix='.md.tmp', dir=md_path.parent)
+            try:
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    replace_image_links(md_path, f, replacements)
+                # mkstemp创建的文件权限是0600，保留原文件的权限
+                shutil.copymode(md_path, tmp_file)
+                os.replace(tmp_file, md_path)
+            except Exception:
+                os.unlink(tmp_file)
+                raise
+
+        for img_path in uploaded:
+            try:
+                os.remove(img_path)
+            except OSError:
+                pass
+
+        if not result['failed_files']:
+            result['success_files'].append(str(md_path))
+        result['success'] = len(result['failed_files']) == 0
+
+    except Exception as e:
+        result['error'] = str(e)
+        result['success'] = False
+        print(f"Error during image upload of {md_path}: {e}")
+
+    return result
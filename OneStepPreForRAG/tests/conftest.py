@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# 各模块按扁平结构互相导入（如 from md_stream import ...），测试时把模块目录加入搜索路径
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
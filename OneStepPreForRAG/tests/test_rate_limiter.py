@@ -0,0 +1,180 @@
+"""令牌桶限流器：突发、稳态速率、小数QPS和跨进程共享（时间断言留有余量）"""
+import asyncio
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+import rate_limiter
+from rate_limiter import RateLimiter
+
+# 时间断言的下限系数，容忍sleep精度和计时误差
+LOWER = 0.8
+# 时间断言额外允许的秒数，容忍负载较高的机器
+SLACK = 1.0
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(rate_limiter.time, 'time', fake.time)
+    return fake
+
+
+def test_rejects_non_positive_qps():
+    with pytest.raises(ValueError):
+        RateLimiter(0)
+
+
+def test_burst_is_granted_immediately_then_rate_applies():
+    limiter = RateLimiter(5, burst=10)
+    start = time.monotonic()
+    for _ in range(10):
+        limiter.acquire()
+    burst_elapsed = time.monotonic() - start
+    for _ in range(5):
+        limiter.acquire()
+    elapsed = time.monotonic() - start
+
+    assert burst_elapsed < 0.2
+    # 突发之后的5个请求按5 QPS放行
+    assert 5 / 5 * LOWER <= elapsed <= 5 / 5 + SLACK
+
+
+def test_steady_state_rate_across_threads():
+    qps, threads, per_thread = 20, 8, 3
+    limiter = RateLimiter(qps)
+    grants = []
+    lock = threading.Lock()
+
+    def worker():
+        for _ in range(per_thread):
+            limiter.acquire()
+            with lock:
+                grants.append(time.monotonic())
+
+    start = time.monotonic()
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.monotonic() - start
+
+    expected = (threads * per_thread - 1) / qps
+    assert len(grants) == threads * per_thread
+    assert expected * LOWER <= elapsed <= expected + SLACK
+
+
+def test_steady_state_rate_async_does_not_block_loop():
+    qps, requests = 20, 21
+    limiter = RateLimiter(qps)
+
+    async def run():
+        ticks = 0
+        done = asyncio.Event()
+
+        async def ticker():
+            nonlocal ticks
+            while not done.is_set():
+                ticks += 1
+                await asyncio.sleep(0.01)
+
+        tick_task = asyncio.create_task(ticker())
+        start = time.monotonic()
+        await asyncio.gather(*(limiter.acquire_async() for _ in range(requests)))
+        elapsed = time.monotonic() - start
+        done.set()
+        await tick_task
+        return elapsed, ticks
+
+    elapsed, ticks = asyncio.run(run())
+    expected = (requests - 1) / qps
+    assert expected * LOWER <= elapsed <= expected + SLACK
+    # 等待期间事件循环仍在运行其他任务
+    assert ticks >= 10
+
+
+def test_try_acquire_with_fractional_rate(clock):
+    limiter = RateLimiter(0.5, burst=2)
+    assert [limiter.try_acquire() for _ in range(3)] == [True, True, False]
+
+    # 0.5 QPS：1秒只补充半个令牌
+    clock.now += 1
+    assert not limiter.try_acquire()
+    clock.now += 1
+    assert limiter.try_acquire()
+    assert not limiter.try_acquire()
+
+    # 空闲再久也最多积累burst个令牌
+    clock.now += 3600
+    assert [limiter.try_acquire() for _ in range(3)] == [True, True, False]
+
+
+def test_failed_try_acquire_does_not_reserve(clock):
+    limiter = RateLimiter(1)
+    assert limiter.try_acquire()
+    for _ in range(5):
+        assert not limiter.try_acquire()
+    clock.now += 1
+    assert limiter.try_acquire()
+
+
+def test_state_file_is_shared_between_limiters(tmp_path, clock):
+    state_file = tmp_path / 'limits' / 'qps.state'
+    first = RateLimiter(1, burst=2, state_file=str(state_file))
+    second = RateLimiter(1, burst=2, state_file=str(state_file))
+
+    assert first.try_acquire()
+    assert second.try_acquire()
+    # 两个限流器共用同一个桶
+    assert not first.try_acquire()
+    assert not second.try_acquire()
+    clock.now += 1
+    assert second.try_acquire()
+    assert not first.try_acquire()
+
+
+_CHILD = """
+import sys, time
+sys.path.insert(0, {module_dir!r})
+from rate_limiter import RateLimiter
+limiter = RateLimiter({qps}, state_file={state_file!r})
+for _ in range({requests}):
+    limiter.acquire()
+    print(time.time(), flush=True)
+"""
+
+
+def test_state_file_limits_processes_together(tmp_path):
+    qps, processes, requests = 10, 2, 5
+    script = _CHILD.format(
+        module_dir=str(Path(rate_limiter.__file__).resolve().parent),
+        qps=qps, state_file=str(tmp_path / 'qps.state'), requests=requests
+    )
+    children = [
+        subprocess.Popen([sys.executable, '-c', script], stdout=subprocess.PIPE, text=True)
+        for _ in range(processes)
+    ]
+    grants = []
+    for child in children:
+        output, _ = child.communicate(timeout=60)
+        assert child.returncode == 0
+        grants.extend(float(line) for line in output.split())
+
+    grants.sort()
+    assert len(grants) == processes * requests
+    # 两个进程合计按 qps 放行，而不是各自 qps
+    assert grants[-1] - grants[0] >= (len(grants) - 1) / qps * LOWER
+    assert min(b - a for a, b in zip(grants, grants[1:])) >= 1 / qps / 2
@@ -0,0 +1,63 @@
+"""流式拆分与pdfdeal的auto_split_md输出一致"""
+import os
+import stat
+
+import pytest
+from pdfdeal.file_tools import auto_split_md
+
+from md_stream import WINDOW_CHARS
+from step2_split_md import SPLIT_STR, split_markdown_file
+
+# 超过一个读取窗口的段落
+LONG_LINE = 'x' * (WINDOW_CHARS * 2 + 123)
+
+CASES = {
+    'heading_at_start': "# Title\n\nIntro paragraph.\n\n## Section\n\nBody text.\n",
+    'text_before_heading': "Preamble line.\n\n# Title\nBody\n### Deep\nMore body\n",
+    'no_heading': "Just a paragraph.\n\nAnother paragraph.\n",
+    'heading_levels': "# A\n## B\n### C\n#### D\n##### E\n###### F\n####### not a heading\n#hashtag\n",
+    'blank_padding': "\n\n\n# Title\n\n\n\ntext   \n\n\n## Next\n\n\n",
+    'no_trailing_newline': "# Title\ntext without trailing newline",
+    'oversized_paragraph': f"# Title\n\n{LONG_LINE}\n\n## After\n\ntail\n",
+    'oversized_before_heading': f"{LONG_LINE}\n# Title\nbody\n",
+    'heading_at_window_boundary': 'a' * (WINDOW_CHARS - 1) + "\n# Boundary\nbody\n",
+    'heading_after_window_boundary': 'a' * (WINDOW_CHARS + 1) + "\n# Boundary\nbody\n",
+    'unicode': "# 标题\n\n中文段落，包含图片 ![图](images/a.png)\n\n## 第二节\n\n内容\n",
+}
+
+
+@pytest.mark.parametrize('name', sorted(CASES))
+def test_matches_auto_split_md(tmp_path, name):
+    reference = tmp_path / 'reference' / f"{name}.md"
+    streamed = tmp_path / 'streamed' / f"{name}.md"
+    for path in (reference, streamed):
+        path.parent.mkdir()
+        path.write_text(CASES[name], encoding='utf-8')
+
+    _, ok = auto_split_md(str(reference), out_type='replace', split_str=SPLIT_STR)
+    assert ok
+    result = split_markdown_file(str(streamed))
+    assert result['success'], result['error']
+
+    assert streamed.read_text(encoding='utf-8') == reference.read_text(encoding='utf-8')
+
+
+def test_already_split_file_is_skipped(tmp_path):
+    md_file = tmp_path / 'doc.md'
+    md_file.write_text(CASES['heading_at_start'], encoding='utf-8')
+    split_markdown_file(str(md_file))
+    once = md_file.read_text(encoding='utf-8')
+
+    result = split_markdown_file(str(md_file))
+    assert result['skipped_files'] == [str(md_file)]
+    assert md_file.read_text(encoding='utf-8') == once
+    assert not [path for path in tmp_path.iterdir() if path.name.startswith('.split_')]
+
+
+@pytest.mark.skipif(os.name == 'nt', reason='POSIX file modes')
+def test_split_keeps_file_mode(tmp_path):
+    md_file = tmp_path / 'doc.md'
+    md_file.write_text(CASES['heading_at_start'], encoding='utf-8')
+    md_file.chmod(0o644)
+    split_markdown_file(str(md_file))
+    assert stat.S_IMODE(md_file.stat().st_mode) == 0o644
@@ -0,0 +1,299 @@
+"""
+以图片内容哈希为键的上传缓存
+
+同样的logo、图标和插图会出现在成千上万个文档中，每个副本都上传一次既慢又浪费图床空间。
+CachedUploader 包装任意上传器，上传前先在SQLite缓存中查找图片内容的SHA256：
+    - 命中时直接使用之前上传得到的地址，不再上传
+    - 同一批中内容相同的图片只上传一次
+    - 多个线程同时上传同一图片时，只有一个线程上传，其他线程等待其结果
+    - 缓存保存在文件中，之后的运行和同时运行的其他进程都可以使用
+
+缓存键还包含上传目标（如PicGO地址或OSS的bucket），更换图床后不会用到旧的地址。
+verify=True时，每个缓存的地址在本次运行中第一次使用前发送HEAD请求确认仍然存在，失效的条目被删除并重新上传。
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+# 确认缓存地址时的请求超时（秒）
+VERIFY_TIMEOUT = 10
+
+# 同时确认缓存地址的请求数
+VERIFY_THREADS = 8
+
+# claim(wait=False) 的返回值：其他线程正在上传这张图片
+IN_PROGRESS = object()
+
+
+def image_sha256(file_path):
+    """计算图片内容的SHA256"""
+    hash_sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            hash_sha256.update(block)
+    return hash_sha256.hexdigest()
+
+
+def url_exists(url):
+    """地址是否仍然可以访问；服务端不支持HEAD时改用GET（只读取响应头）"""
+    try:
+        response = httpx.head(url, follow_redirects=True, timeout=VERIFY_TIMEOUT)
+        if response.status_code in (403, 405, 501):
+            with httpx.stream('GET', url, follow_redirects=True, timeout=VERIFY_TIMEOUT) as response:
+                pass
+        return response.status_code < 400
+    except httpx.HTTPError:
+        return False
+
+
+class UploadCache:
+    """
+    SQLite中的 (上传目标, 图片SHA256) -> 地址 映射
+
+    Args:
+        path: SQLite数据库文件
+        namespace: 上传目标的标识
+        verify: 是否在使用缓存地址前确认其仍然存在
+    """
+
+    def __init__(self, path, namespace, verify=False):
+        self.path = str(path)
+        self.namespace = namespace
+        self.verify = verify
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(self.path, timeout=60, check_same_thread=False)
+        # WAL允许其他进程在写入时读取
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS uploads ('
+            'namespace TEXT NOT NULL, sha256 TEXT NOT NULL, url TEXT NOT NULL, size INTEGER NOT NULL, '
+            'created REAL NOT NULL, last_used REAL NOT NULL, PRIMARY KEY (namespace, sha256))'
+        )
+        self.db.commit()
+        # 正在由某个线程上传的图片: sha256 -> Event
+        self.pending = {}
+        # 本次运行中已经确认存在的地址
+        self.verified = set()
+        self.stats = {'hits': 0, 'misses': 0, 'stores': 0, 'stale': 0, 'bytes_saved': 0}
+
+    def _select(self, sha256):
+        row = self.db.execute(
+            'SELECT url, size FROM uploads WHERE namespace = ? AND sha256 = ?', (self.namespace, sha256)
+        ).fetchone()
+        return row if row else (None, 0)
+
+    def claim(self, sha256, wait=True):
+        """
+        查找缓存的地址
+
+        未命中时由调用者负责上传，之后必须调用 store 或 release。
+        调用者持有其他未完成的认领时不能等待（wait=False），否则两个线程可能互相等待。
+
+        Args:
+            sha256: 图片内容的SHA256
+            wait: 其他线程正在上传同一图片时是否等待其完成
+
+        Returns:
+            str、None或IN_PROGRESS: 缓存的地址；None表示由调用者上传；
+                IN_PROGRESS表示其他线程正在上传（仅wait=False时）
+        """
+        while True:
+            with self.lock:
+                url, size = self._select(sha256)
+                if url is None:
+                    event = self.pending.get(sha256)
+                    if event is None:
+                        self.pending[sha256] = threading.Event()
+                        self.stats['misses'] += 1
+                        return None
+                    if not wait:
+                        return IN_PROGRESS
+                elif not self.verify or url in self.verified:
+                    self._hit(sha256, size)
+                    return url
+            if url is None:
+                event.wait()
+                continue
+            # 在锁外确认地址，确认期间其他查找不受影响
+            if url_exists(url):
+                with self.lock:
+                    self.verified.add(url)
+                continue
+            with self.lock:
+                self.db.execute(
+                    'DELETE FROM uploads WHERE namespace = ? AND sha256 = ? AND url = ?',
+                    (self.namespace, sha256, url)
+                )
+                self.db.commit()
+                self.stats['stale'] += 1
+
+    def _hit(self, sha256, size):
+        self.stats['hits'] += 1
+        self.stats['bytes_saved'] += size
+        self.db.execute(
+            'UPDATE uploads SET last_used = ? WHERE namespace = ? AND sha256 = ?',
+            (time.time(), self.namespace, sha256)
+        )
+        self.db.commit()
+
+    def store(self, sha256, url, size):
+        """记录上传得到的地址，并唤醒等待同一图片的线程"""
+        now = time.time()
+        with self.lock:
+            self.db.execute(
+                'INSERT OR REPLACE INTO uploads (namespace, sha256, url, size, created, last_used) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (self.namespace, sha256, url, size, now, now)
+            )
+            self.db.commit()
+            self.stats['stores'] += 1
+            self.verified.add(url)
+            event = self.pending.pop(sha256, None)
+        if event is not None:
+            event.set()
+
+    def release(self, sha256):
+        """上传失败时放弃认领，等待的线程中的一个会重新上传"""
+        with self.lock:
+            event = self.pending.pop(sha256, None)
+        if event is not None:
+            event.set()
+
+    def report(self):
+        """返回命中统计，用于运行总结"""
+        with self.lock:
+            stats = dict(self.stats)
+            stats['entries'] = self.db.execute(
+                'SELECT COUNT(*) FROM uploads WHERE namespace = ?', (self.namespace,)
+            ).fetchone()[0]
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+        return stats
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+class CachedUploader:
+    """
+    在上传器前查询 UploadCache 的包装
+
+    与被包装的上传器接口一致：可以直接调用或调用upload_file；
+    被包装的是异步上传引擎时也提供 upload_files，一次提交一批中未命中的图片。
+    限流器只在实际上传（缓存未命中）时获取许可，缓存命中不占用QPS限额。
+    """
+
+    # upload_file 接受 rate_limiter 参数，调用者不必在外层限流
+    accepts_rate_limiter = True
+
+    def __init__(self, uploader, cache):
+        self.uploader = uploader
+        self.cache = cache
+        self._upload = uploader.upload_file if hasattr(uploader, 'upload_file') else uploader
+        if hasattr(uploader, 'upload_files'):
+            self.upload_files = self._upload_files
+
+    def upload_file(self, local_file_path, remote_file_path=None, rate_limiter=None):
+        """
+        上传单个文件，缓存命中时直接返回缓存的地址
+
+        Args:
+            local_file_path: 本地文件路径
+            remote_file_path: 远程文件名
+            rate_limiter: 限流器，只在缓存未命中、实际上传前获取许可
+
+        Returns:
+            tuple: (图片地址或错误信息, 是否成功)
+        """
+        sha256 = image_sha256(local_file_path)
+        url = self.cache.claim(sha256)
+        if url is not None:
+            return url, True
+        try:
+            if rate_limiter is not None:
+                rate_limiter.acquire()
+            new_url, ok = self._upload(local_file_path, remote_file_path)
+        except BaseException:
+            self.cache.release(sha256)
+            raise
+        if ok:
+            self.cache.store(sha256, new_url, os.path.getsize(local_file_path))
+        else:
+            self.cache.release(sha256)
+        return new_url, ok
+
+    __call__ = upload_file
+
+    def _upload_files(self, tasks, rate_limiter=None):
+        """
+        上传一批文件，只上传缓存中没有的图片，同一批中内容相同的图片只上传一次
+
+        Args:
+            tasks: [(本地文件路径, 远程文件名)]
+            rate_limiter: 传给被包装的上传引擎的限流器
+
+        Returns:
+            list: 与tasks顺序一致的 (图片地址或错误信息, 是否成功)
+        """
+        digests = [image_sha256(local_file_path) for local_file_path, _ in tasks]
+        first = {}
+        for index, sha256 in enumerate(digests):
+            first.setdefault(sha256, index)
+
+        results = {}
+        # 先不等待地查找所有图片（确认地址可以并行进行），未命中的一次提交给上传引擎
+        claimed, in_progress = [], []
+        with ThreadPoolExecutor(max_workers=VERIFY_THREADS if self.cache.verify else 1) as executor:
+            for sha256, url in zip(first, executor.map(lambda sha256: self.cache.claim(sha256, wait=False), first)):
+                if url is None:
+                    claimed.append(sha256)
+                elif url is IN_PROGRESS:
+                    in_progress.append(sha256)
+                else:
+                    results[sha256] = (url, True)
+        self._upload_claimed(claimed, tasks, first, results, rate_limiter)
+
+        # 其他线程正在上传的图片：此时不再持有任何认领，可以逐个等待
+        for sha256 in in_progress:
+            url = self.cache.claim(sha256)
+            if url is None:
+                self._upload_claimed([sha256], tasks, first, results, rate_limiter)
+            else:
+                results[sha256] = (url, True)
+        return [results[sha256] for sha256 in digests]
+
+    def _upload_claimed(self, claimed, tasks, first, results, rate_limiter):
+        """上传已认领的图片并记录结果，失败或出错时放弃认领"""
+        if not claimed:
+            return
+        try:
+            uploads = self.uploader.upload_files(
+                [tasks[first[sha256]] for sha256 in claimed], rate_limiter=rate_limiter
+            )
+            for sha256, (new_url, ok) in zip(claimed, uploads):
+                results[sha256] = (new_url, ok)
+                if ok:
+                    self.cache.store(sha256, new_url, os.path.getsize(tasks[first[sha256]][0]))
+        finally:
+            for sha256 in claimed:
+                if not results.get(sha256, (None, False))[1]:
+                    self.cache.release(sha256)
+
+    def stats(self):
+        """被包装的上传器的统计加上缓存命中统计，用于运行总结"""
+        stats = self.uploader.stats() if hasattr(self.uploader, 'stats') else {}
+        for key, value in self.cache.report().items():
+            stats[f'upload_cache_{key}'] = value
+        return stats
+
+    def close(self):
+        if hasattr(self.uploader, 'close'):
+            self.uploader.close()
+        self.cache.close()
@@ -1,22 +1,59 @@
 from pdfdeal.FileTools.Img.Ali_OSS import Ali_OSS
 from pdfdeal.FileTools.Img.PicGO import PicGO
+from async_upload import AsyncUploadEngine, AliOSSBackend, PicGOBackend
+from upload_cache import CachedUploader, UploadCache
+from image_transcode import TranscodingUploader
 
 class UploaderFactory:
     @staticmethod
-    def create_uploader(uploader_type: str, **kwargs):
+    def create_uploader(uploader_type: str, engine: str = 'thread', concurrency: int = 16, adaptive: bool = False,
+                        retries: int = 3, cache_path=None, verify_cache: bool = False, transcode=None,
+                        transcode_workers: int = 0, **kwargs):
         """
         创建上传器实例
         
         Args:
             uploader_type: 上传器类型 ('alioss' 或 'picgo')
+            engine: 'thread' 使用pdfdeal的上传函数；'async' 使用共享连接池的异步上传引擎（用完需要调用close）
+            concurrency: 异步上传引擎同时进行的上传数（adaptive时为上限）
+            adaptive: 异步上传引擎是否根据限流和延迟自动调整并发数
+            retries: 异步上传引擎中每张图片的重试次数
+            cache_path: 上传缓存的SQLite文件，提供时内容相同的图片只上传一次（包括之前的运行中上传过的）
+            verify_cache: 使用缓存的地址前是否确认其仍然存在
+            transcode: 图片压缩参数(TranscodeOptions)，提供时上传前缩小并重新编码图片
+            transcode_workers: 压缩图片的进程数，0表示CPU核心数
             **kwargs: 上传器所需的参数
         """
+        uploader = UploaderFactory._create_uploader(uploader_type, engine, concurrency, adaptive, retries, **kwargs)
+        if transcode is not None:
+            uploader = TranscodingUploader(uploader, transcode, transcode_workers)
+        # 缓存在压缩之外，按原图内容查找，命中时不需要压缩
+        if cache_path is None:
+            return uploader
+        
+        # 缓存键包含上传目标，更换图床后不会用到旧的地址
+        if uploader_type.lower() == 'alioss':
+            namespace = f"alioss:{kwargs['bucket']}@{kwargs['endpoint']}"
+        else:
+            namespace = f"picgo:{kwargs.get('endpoint', 'http://127.0.0.1:36677')}"
+        return CachedUploader(uploader, UploadCache(cache_path, namespace, verify_cache))
+    
+    @staticmethod
+    def _create_uploader(uploader_type: str, engine: str, concurrency: int, adaptive: bool, retries: int, **kwargs):
+        """创建不带缓存的上传器"""
+        if engine not in ('thread', 'async'):
+            raise ValueError(f"Unsupported upload engine: {engine}")
+        
         if uploader_type.lower() == 'alioss':
             required_params = ['access_key_id', 'access_key_secret', 'endpoint', 'bucket']
             for param in required_params:
                 if param not in kwargs:
                     raise ValueError(f"AliOSS uploader requires {param}")
             
+            if engine == 'async':
+                return AsyncUploadEngine(AliOSSBackend(
+                    kwargs['access_key_id'], kwargs['access_key_secret'], kwargs['endpoint'], kwargs['bucket']
+                ), concurrency, adaptive, retries)
             return Ali_OSS(
                 OSS_ACCESS_KEY_ID=kwargs['access_key_id'],
                 OSS_ACCESS_KEY_SECRET=kwargs['access_key_secret'],
@@ -26,6 +63,8 @@ class UploaderFactory:
             
         elif uploader_type.lower() == 'picgo':
             endpoint = kwargs.get('endpoint', 'http://127.0.0.1:36677')
+            if engine == 'async':
+                return AsyncUploadEngine(PicGOBackend(endpoint), concurrency, adaptive, retries)
             return PicGO(endpoint=endpoint)
             
         else: